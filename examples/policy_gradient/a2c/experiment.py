@@ -46,6 +46,7 @@ class ExperimentMaster(BaseExperimentMaster):
         
         # Agent configuration
         config.add_grid(name='agent:standardize', val=[True, False])
+        config.add_item(name='agent:gae_lambda', val=1.0)  # GAE lambda, 1.0 for bootstrapped discounted returns
         config.add_item(name='agent:max_grad_norm', val=0.5)  # gradient clipping with max gradient norm
         config.add_item(name='agent:value_coef', val=0.5)  # Coefficient for learning value function
         config.add_item(name='agent:entropy_coef', val=0.01)  # Coefficient for maximize policy entropy
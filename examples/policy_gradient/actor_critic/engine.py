@@ -5,7 +5,9 @@ import torch
 from lagom import Logger
 from lagom.engine import BaseEngine
 from lagom.envs import make_gym_env
-from lagom.runner import TrajectoryRunner
+from lagom.envs import make_envs
+from lagom.envs.vec_env import SerialVecEnv
+from lagom.runner import VecTrajectoryRunner
 
 
 class Engine(BaseEngine):
@@ -83,15 +85,17 @@ class Engine(BaseEngine):
         # Set network as evaluation mode
         self.agent.policy.network.eval()
         
-        # Create a new instance of the envrionment
-        env = make_gym_env(env_id=self.config['env:id'], 
-                           seed=self.config['seed'], 
-                           monitor=False, 
-                           monitor_dir=None)
-        # Create a TrajectoryRunner
-        runner = TrajectoryRunner(agent=self.agent, 
-                                  env=env, 
-                                  gamma=self.config['algo:gamma'])
+        # Create new instances of the envrionment, one for each trajectory
+        list_make_env = make_envs(make_env=make_gym_env, 
+                                  env_id=self.config['env:id'], 
+                                  num_env=self.config['eval:N'], 
+                                  init_seed=self.config['seed'])
+        env = SerialVecEnv(list_make_env=list_make_env)
+        # Create a VecTrajectoryRunner, all trajectories are collected concurrently without computation graph
+        runner = VecTrajectoryRunner(agent=self.agent, 
+                                     env=env, 
+                                     gamma=self.config['algo:gamma'], 
+                                     no_grad=True)
         # Evaluate the agent for a set of trajectories
         D = runner(N=self.config['eval:N'], T=self.config['eval:T'])
         
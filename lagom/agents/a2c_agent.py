@@ -5,7 +5,8 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from .base_agent import BaseAgent
-from lagom.core.transform import Standardize
+from lagom.core.transform import GAE
+from lagom.runner import RolloutSegment
 
 
 class A2CAgent(BaseAgent):
@@ -20,6 +21,14 @@ class A2CAgent(BaseAgent):
     https://blog.openai.com/baselines-acktr-a2c/
     
     For this purpose, please use SegmentRunner, not TrajectoryRunner to collect data for A2CAgent. 
+    
+    The advantage estimates and value targets for all segments are computed at once by GAE. 
+    The GAE lambda can be set with the configuration 'agent:gae_lambda', default to 1.0 i.e. 
+    bootstrapped discounted returns. 
+    
+    If the segments are collected without computation graph, i.e. SegmentRunner with `no_grad=True`, 
+    the log-probabilities, entropies and state values for all time steps in all segments are 
+    re-evaluated in a single batched forward pass of the policy. 
     """
     def __init__(self, policy, optimizer, config, **kwargs):
         self.policy = policy
@@ -31,7 +40,7 @@ class A2CAgent(BaseAgent):
         # Convert to Tensor
         # Note that obs should be batched already (even if only one segment), because we use VecEnv and SegmentRunner
         if not torch.is_tensor(obs):
-            obs = torch.from_numpy(np.array(obs)).float()
+            obs = torch.from_numpy(np.asarray(obs)).float()  # no copy for stacked ndarray
             obs = obs.to(self.device)  # move to device
         
         # Call policy
@@ -45,68 +54,54 @@ class A2CAgent(BaseAgent):
         return output
         
     def learn(self, D):
-        batch_policy_loss = []
-        batch_value_loss = []
-        batch_entropy_loss = []
-        batch_total_loss = []
-        
-        # Iterate over list of Segment in D
-        for segment in D:
-            # Get all boostrapped discounted returns as estimate of Q
-            Qs = segment.all_bootstrapped_discounted_returns
-            # TODO: when use GAE of TDs, really standardize it ? biased magnitude of learned value get wrong TD error
-            # Standardize advantage estimates if required
-            # encourage/discourage half of performed actions, respectively.
-            
-            ########
-            # A2C: testing, normalizing advantage estimate instead
-            
-            
-            
-            # Get all state values (without V_s_next with all done=True also without the final transition)
-            Vs = segment.all_info('V_s')
-            
-            # Advantage estimates
-            As = [Q - V.item() for Q, V in zip(Qs, Vs)]
-            
-            
-            ############
-            if self.config['agent:standardize']:
-                As = Standardize()(As)
-            
-            
-            
-            # Get all log-probabilities and entropies
-            logprobs = segment.all_info('action_logprob')
-            entropies = segment.all_info('entropy')
-            
-            # Estimate policy gradient for all time steps and record all losses
-            policy_loss = []
-            value_loss = []
-            entropy_loss = []
-            for logprob, entropy, A, Q, V in zip(logprobs, entropies, As, Qs, Vs):
-                policy_loss.append(-logprob*A)
-                value_loss.append(F.mse_loss(V, torch.tensor(Q).to(V.device)))
-                entropy_loss.append(-entropy)
+        # Stack data from all segments with shape [T, N], N is the number of segments
+        # Note that all segments from SegmentRunner have the same length
+        rewards = np.stack([segment.all_r for segment in D], axis=1)
+        dones = np.stack([segment.all_done for segment in D], axis=1)
+        last_Vs = torch.stack([segment.transitions[-1].V_s_next for segment in D]).view(-1)
+        if self._is_deferred(D):  # collected without computation graph, re-evaluate all time steps at once
+            logprobs, entropies, Vs = self._evaluate(D)
+        else:
+            Vs = torch.stack([torch.stack(segment.all_info('V_s')).view(-1) for segment in D], dim=1)
+            logprobs = torch.stack([torch.stack(segment.all_info('action_logprob')) for segment in D], dim=1)
+            entropies = torch.stack([torch.stack(segment.all_info('entropy')) for segment in D], dim=1)
         
-            # Average over losses for all time steps
-            policy_loss = torch.stack(policy_loss).mean()
-            value_loss = torch.stack(value_loss).mean()
-            entropy_loss = torch.stack(entropy_loss).mean()
+        # Compute advantage estimates and value targets for all segments at once
+        # With gae_lambda=1.0, the value targets are boostrapped discounted returns as estimate of Q
+        gae = GAE(gamma=D[0].gamma, gae_lambda=self.config.get('agent:gae_lambda', 1.0))
+        As, Qs = gae(rewards, Vs.detach().cpu().numpy(), dones, last_Vs.detach().cpu().numpy())
         
-            # Calculate total loss
-            value_coef = self.config['agent:value_coef']
-            entropy_coef = self.config['agent:entropy_coef']
-            total_loss = policy_loss + value_coef*value_loss + entropy_coef*entropy_loss
-            
-            # Record all losses
-            batch_policy_loss.append(policy_loss)
-            batch_value_loss.append(value_loss)
-            batch_entropy_loss.append(entropy_loss)
-            batch_total_loss.append(total_loss)
+        # Standardize advantage estimates for each segment if required
+        # encourage/discourage half of performed actions, respectively.
+        if self.config['agent:standardize']:
+            As = (As - As.mean(0))/(As.std(0) + np.finfo(np.float32).eps)
+        
+        As = torch.from_numpy(As).to(Vs.device)
+        Qs = torch.from_numpy(Qs).to(Vs.device)
+        
+        # Estimate policy gradient for all time steps and compute all losses, each with shape [T, N, ...]
+        policy_loss = -logprobs*As.view(*As.shape, *[1]*(logprobs.dim() - 2))
+        value_loss = F.mse_loss(Vs, Qs, reduction='none')
+        entropy_loss = -entropies
+        
+        # Average over losses for all time steps in each segment
+        policy_loss = self._mean_per_segment(policy_loss)
+        value_loss = self._mean_per_segment(value_loss)
+        entropy_loss = self._mean_per_segment(entropy_loss)
+        
+        # Calculate total loss
+        value_coef = self.config['agent:value_coef']
+        entropy_coef = self.config['agent:entropy_coef']
+        total_loss = policy_loss + value_coef*value_loss + entropy_coef*entropy_loss
+        
+        # Record all losses, each for one segment
+        batch_policy_loss = list(policy_loss.unbind())
+        batch_value_loss = list(value_loss.unbind())
+        batch_entropy_loss = list(entropy_loss.unbind())
+        batch_total_loss = list(total_loss.unbind())
         
         # Compute loss (average over segments)
-        loss = torch.stack(batch_total_loss).mean()  # use stack because each element is zero-dim tensor
+        loss = total_loss.mean()
         
         # Zero-out gradient buffer
         self.optimizer.zero_grad()
@@ -139,6 +134,61 @@ class A2CAgent(BaseAgent):
         
         return output
     
+    def _evaluate(self, D):
+        """
+        Re-evaluate the log-probabilities, entropies and state values for all time steps in all
+        segments in a single batched forward pass with shape [T*N, ...]
+        
+        Args:
+            D (list of Segment): list of segments collected without computation graph
+            
+        Returns:
+            logprobs (Tensor): log-probabilities of the actions with shape [T, N, ...]
+            entropies (Tensor): entropies of the policy with shape [T, N, ...]
+            Vs (Tensor): state values with shape [T, N]
+        """
+        # Stack observations and actions with shape [T, N, ...]
+        # Segments from SegmentRunner are views of a RolloutBuffer, so read its [T, N, ...] columns directly
+        if all([isinstance(segment, RolloutSegment) for segment in D]):
+            buffer = D[0].buffer
+            if all([segment.buffer is buffer for segment in D]):
+                env_index = [segment.index for segment in D]
+                obs = buffer.s[:, env_index]
+                all_a = buffer.a[:, env_index]
+            else:
+                obs = np.stack([segment.buffer.s[:, segment.index] for segment in D], axis=1)
+                all_a = np.stack([segment.buffer.a[:, segment.index] for segment in D], axis=1)
+            use_unconstrained_action = 'unconstrained_action' in buffer.info
+        else:
+            obs = np.stack([[transition.s for transition in segment.transitions] for segment in D], axis=1)
+            all_a = np.stack([segment.all_a for segment in D], axis=1)
+            use_unconstrained_action = 'unconstrained_action' in D[0].transitions[0].info
+        if use_unconstrained_action:
+            actions = torch.stack([torch.stack(segment.all_info('unconstrained_action')) for segment in D], dim=1)
+        else:
+            actions = torch.from_numpy(np.ascontiguousarray(all_a))
+        T, N = obs.shape[:2]
+        
+        # Single forward pass over all time steps in all segments
+        obs = torch.from_numpy(obs.reshape(T*N, *obs.shape[2:])).float().to(self.device)
+        actions = actions.detach().view(T*N, *actions.shape[2:]).to(self.device)
+        out_policy = self.policy(obs, action=actions)
+        
+        # Restore shape [T, N, ...]
+        logprobs = out_policy['action_logprob']
+        logprobs = logprobs.view(T, N, *logprobs.shape[1:])
+        entropies = out_policy['entropy']
+        entropies = entropies.view(T, N, *entropies.shape[1:])
+        Vs = out_policy['state_value'].view(T, N)
+        
+        return logprobs, entropies, Vs
+    
+    def _mean_per_segment(self, x):
+        """
+        Average the batched loss with shape [T, N, ...] over all dimensions except for segment dimension N. 
+        """
+        return x.transpose(0, 1).contiguous().view(x.shape[1], -1).mean(1)
+    
     def save(self, filename):
         self.policy.network.save(filename)
     
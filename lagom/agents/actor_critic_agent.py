@@ -13,6 +13,10 @@ class ActorCriticAgent(BaseAgent):
     Actor-Critic with value network (baseline), no bootstrapping to estimate value function. 
     
     Sometimes it is also called Vanilla Policy Gradient (VPG)
+    
+    If the trajectories are collected without computation graph, i.e. TrajectoryRunner with `no_grad=True`, 
+    the log-probabilities, entropies and state values for all time steps in all trajectories are re-evaluated in a single 
+    batched forward pass of the policy. 
     """
     def __init__(self, policy, optimizer, config, **kwargs):
         self.policy = policy
@@ -24,7 +28,7 @@ class ActorCriticAgent(BaseAgent):
         # Convert to Tensor
         # Note that the observation should be batched already (even if only one trajectory)
         if not torch.is_tensor(obs):
-            obs = torch.from_numpy(np.array(obs)).float()
+            obs = torch.from_numpy(np.asarray(obs)).float()  # no copy for stacked ndarray
             obs = obs.to(self.device)  # move to device
             
         # Call policy
@@ -43,8 +47,13 @@ class ActorCriticAgent(BaseAgent):
         batch_entropy_loss = []
         batch_total_loss = []
         
+        # Re-evaluate all trajectories at once if collected without computation graph
+        deferred = self._is_deferred(D)
+        if deferred:
+            out_evaluate = self._evaluate_trajectories(D, keys=['action_logprob', 'entropy', 'state_value'])
+        
         # Iterate over list of trajectories in D
-        for trajectory in D:
+        for i, trajectory in enumerate(D):
             # Get all discounted returns as estimate of Q
             Qs = trajectory.all_discounted_returns
             # TODO: when use GAE of TDs, really standardize it ? biased magnitude of learned value get wrong TD error
@@ -53,16 +62,19 @@ class ActorCriticAgent(BaseAgent):
             if self.config['agent:standardize']:
                 Qs = Standardize()(Qs)
                 
-            # Get all state values (without V_s_next in final transition)
-            Vs = trajectory.all_info('V_s')
+            # Get all state values (without V_s_next in final transition), log-probabilities and entropies
+            if deferred:
+                Vs = out_evaluate['state_value'][i]
+                logprobs = out_evaluate['action_logprob'][i]
+                entropies = out_evaluate['entropy'][i]
+            else:
+                Vs = trajectory.all_info('V_s')
+                logprobs = trajectory.all_info('action_logprob')
+                entropies = trajectory.all_info('entropy')
             
             # Advantage estimates
             As = [Q - V.item() for Q, V in zip(Qs, Vs)]
             
-            # Get all log-probabilities and entropies
-            logprobs = trajectory.all_info('action_logprob')
-            entropies = trajectory.all_info('entropy')
-            
             # Estimate policy gradient for all time steps and record all losses
             policy_loss = []
             value_loss = []
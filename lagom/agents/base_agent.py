@@ -1,3 +1,8 @@
+import numpy as np
+
+import torch
+
+
 class BaseAgent(object):
     """
     Base class of the agent for action selection and learning rule. 
@@ -60,6 +65,53 @@ class BaseAgent(object):
         """
         raise NotImplementedError
         
+    def _is_deferred(self, D):
+        """
+        Whether the batched data is collected without computation graph, i.e. runner with `no_grad=True`, 
+        which is recorded by the runner in `info['no_grad']` of each Trajectory or Segment. Then the 
+        log-probabilities, entropies and state values should be re-evaluated, e.g. by `_evaluate_trajectories`. 
+        
+        Args:
+            D (list): list of Trajectory or Segment
+            
+        Returns:
+            deferred (bool): whether the data is collected without computation graph
+        """
+        return D[0].info.get('no_grad', False)
+        
+    def _evaluate_trajectories(self, D, keys):
+        """
+        Re-evaluate the policy for all time steps in all trajectories in a single batched forward pass. 
+        
+        It requires `self.policy` to accept an optional `action` argument to evaluate the given actions, 
+        and `self.device`. The unconstrained actions are used if they are recorded by the runner. 
+        
+        Args:
+            D (list of Trajectory): list of trajectories collected without computation graph
+            keys (list): keys of the policy output to return, e.g. ['action_logprob', 'entropy']
+            
+        Returns:
+            out (dict): dictionary of given keys, each is a list of Tensor (one for each trajectory)
+        """
+        # Concatenate observations and actions of all trajectories
+        obs = np.concatenate([np.asarray([transition.s for transition in trajectory.transitions]) for trajectory in D])
+        if 'unconstrained_action' in D[0].transitions[0].info:
+            actions = torch.cat([torch.cat(trajectory.all_info('unconstrained_action')) for trajectory in D])
+        else:
+            actions = torch.cat([torch.cat(trajectory.all_a) for trajectory in D])
+            
+        # Single forward pass over all time steps in all trajectories
+        obs = torch.from_numpy(obs).float().to(self.device)
+        out_policy = self.policy(obs, action=actions.detach().to(self.device))
+        
+        # Split into each trajectory
+        Ts = [trajectory.T for trajectory in D]
+        out = {}
+        for key in keys:
+            out[key] = torch.split(out_policy[key], Ts)
+        
+        return out
+        
     def save(self, filename):
         """
         Save the current parameters of the agent. 
@@ -11,6 +11,10 @@ from lagom.core.transform import Standardize
 class REINFORCEAgent(BaseAgent):
     """
     REINFORCE algorithm (no baseline)
+    
+    If the trajectories are collected without computation graph, i.e. TrajectoryRunner with `no_grad=True`, 
+    the log-probabilities and entropies for all time steps in all trajectories are re-evaluated in a single 
+    batched forward pass of the policy. 
     """
     def __init__(self, policy, optimizer, config, **kwargs):
         self.policy = policy
@@ -22,7 +26,7 @@ class REINFORCEAgent(BaseAgent):
         # Convert to Tensor
         # Note that the observation should be batched already (even if only one trajectory)
         if not torch.is_tensor(obs):
-            obs = torch.from_numpy(np.array(obs)).float()
+            obs = torch.from_numpy(np.asarray(obs)).float()  # no copy for stacked ndarray
             obs = obs.to(self.device)  # move to device
             
         # Call policy
@@ -40,8 +44,13 @@ class REINFORCEAgent(BaseAgent):
         batch_entropy_loss = []
         batch_total_loss = []
         
+        # Re-evaluate all trajectories at once if collected without computation graph
+        deferred = self._is_deferred(D)
+        if deferred:
+            out_evaluate = self._evaluate_trajectories(D, keys=['action_logprob', 'entropy'])
+        
         # Iterate over list of Trajectory in D
-        for trajectory in D:
+        for i, trajectory in enumerate(D):
             # Get all discounted returns as estimate of Q
             Qs = trajectory.all_discounted_returns
             # TODO: when use GAE of TDs, really standardize it ? biased magnitude of learned value get wrong TD error
@@ -51,8 +60,12 @@ class REINFORCEAgent(BaseAgent):
                 Qs = Standardize()(Qs)
             
             # Get all log-probabilities and entropies
-            logprobs = trajectory.all_info('action_logprob')
-            entropies = trajectory.all_info('entropy')
+            if deferred:
+                logprobs = out_evaluate['action_logprob'][i]
+                entropies = out_evaluate['entropy'][i]
+            else:
+                logprobs = trajectory.all_info('action_logprob')
+                entropies = trajectory.all_info('entropy')
             
             # Estimate policy gradient for all time steps and record all losses
             policy_loss = []
@@ -4,6 +4,11 @@ from .base_es_master import BaseESMaster
 from .base_gym_es_master import BaseGymESMaster
 
 from .cma_es import CMAES
+from .native_cma_es import NativeCMAES
 from .openai_es import OpenAIES
 
+from .shared_noise_table import SharedNoiseTable
+from .shared_noise_table import SharedParameters
+from .shared_noise_table import NoiseCandidate
+
 from .es_optimizer import ESOptimizer
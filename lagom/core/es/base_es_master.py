@@ -1,3 +1,7 @@
+from multiprocessing.connection import wait
+
+import numpy as np
+
 from lagom.core.multiprocessing import BaseIterativeMaster
 
 
@@ -6,8 +10,31 @@ class BaseESMaster(BaseIterativeMaster):
     Base class for master of parallelized evolution strategies (ES). 
     
     It internally defines an ES algorithm. 
-    In each generation, it distributes all sampled solution candidates, each for one worker,
-    to compute a list of object function values and then update the ES. 
+    In each generation, it splits all sampled solution candidates into batches, each evaluated by a 
+    worker in a loop (or vectorized, see BaseESWorker), to compute a list of object function values 
+    and then update the ES. The population size is independent of the number of workers, e.g. 256 
+    candidates can be evaluated with 16 workers, each with a batch of 16 candidates. The function 
+    values are reassembled in the order of candidates. 
+    
+    It also supports IPOP-style restarts, i.e. when `should_restart` returns True, the ES is created 
+    again via `make_es` with population size scaled by `self.popsize_factor`, which is multiplied by 
+    `ipop_factor` for each restart. The pool of workers is kept, so only the ES is rebuilt. Note that 
+    shared memory (e.g. SharedNoiseTable) created after the workers started is not visible to them, so 
+    restarts are not supported for ES with a shared noise table, and an AssertionError is raised. 
+    
+    If `async_k` is given, it runs a steady-state asynchronous ES instead of generations. Each worker 
+    is kept busy with a batch of `batch_size` (Default: 1) candidates sampled from the current search 
+    distribution. As soon as `async_k` function values have arrived, the ES is updated, and the idle 
+    workers immediately receive new candidates from the updated distribution, so the workers do not 
+    wait for the stragglers (e.g. long episodes). The number of updates is `num_iteration`. Because 
+    the candidates might be sampled before some updates, each function value is weighted by 
+    `staleness_decay**staleness` or discarded if the staleness exceeds `max_staleness`, where the 
+    staleness is the number of updates since the candidate was sampled. Each update needs at least two 
+    function values to rank and standardize them, so `async_k` must be at least 2, and if fewer than 
+    two values are left after discarding the too stale ones, they are kept until more values arrive. 
+    The ES must support `ask(popsize)` and `tell(solutions, function_values, weights)` with the 
+    candidates from a shared noise table, e.g. OpenAIES with `noise_table` and `num_slot` larger than 
+    `max_staleness`. 
     
     For more details about how master class works, please refer
     to the documentation of the class, BaseIterativeMaster. 
@@ -21,16 +48,52 @@ class BaseESMaster(BaseIterativeMaster):
                  worker_class, 
                  num_worker,
                  init_seed=0, 
-                 daemonic_worker=None):
+                 daemonic_worker=None, 
+                 batch_size=None, 
+                 ipop_factor=2, 
+                 async_k=None, 
+                 max_staleness=1, 
+                 staleness_decay=0.5):
+        """
+        Args:
+            num_iteration (int): number of generations
+            worker_class (BaseESWorker): a callable worker class. 
+            num_worker (int): number of workers. Recommended to be the same as number of CPU cores. 
+            init_seed (int): initial seed for the seeder which samples seeds for candidates.
+            daemonic_worker (bool): If True, then set all workers to be daemonic. 
+            batch_size (int, optional): number of candidates evaluated by a worker in each task. 
+                Default: None, i.e. one batch for each worker. 
+            ipop_factor (int): factor to increase the population size for each restart. Default: 2
+            async_k (int, optional): If not None, then run asynchronous ES, and update the ES with every 
+                `async_k` function values, at least 2. Default: None
+            max_staleness (int): maximum staleness of function values for asynchronous ES. Default: 1
+            staleness_decay (float): weight decay of function values for each update of staleness in 
+                asynchronous ES. Default: 0.5
+        """
         super().__init__(num_iteration=num_iteration, 
                          worker_class=worker_class, 
                          num_worker=num_worker,
                          init_seed=init_seed, 
                          daemonic_worker=daemonic_worker)
+        self.batch_size = batch_size
+        self.ipop_factor = ipop_factor
+        self.async_k = async_k
+        if self.async_k is not None:
+            assert self.async_k >= 2, 'At least two function values are required for each asynchronous update. '
+        self.max_staleness = max_staleness
+        self.staleness_decay = staleness_decay
+        
+        # Number of restarts of ES
+        self.num_restart = 0
         # Create ES solver
         self.es = self.make_es()
-        # It is better to force popsize to be number of workers
-        assert self.es.popsize == self.num_worker
+        
+    @property
+    def popsize_factor(self):
+        """
+        Factor of the population size for current restart, used in `make_es` for IPOP restarts. 
+        """
+        return self.ipop_factor**self.num_restart
         
     def make_es(self):
         """
@@ -42,7 +105,7 @@ class BaseESMaster(BaseIterativeMaster):
         Examples:
             cmaes = CMAES(mu0=[3]*100, 
                           std0=0.5, 
-                          popsize=12)
+                          popsize=12*self.popsize_factor)
             return cmaes
         """
         raise NotImplementedError
@@ -50,29 +113,184 @@ class BaseESMaster(BaseIterativeMaster):
     def make_tasks(self, iteration):
         # ES samples new candidate solutions
         solutions = self.es.ask()
+        # Record the candidates to update ES with reassembled function values
+        self.solutions = solutions
         
         # Record iteration number, for logging in _process_workers_result()
         # And it also keeps API untouched for assign_tasks() in non-iterative Master class
         self.generation = iteration
         
-        return solutions
+        # Split the candidates into batches
+        if self.batch_size is None:
+            batch_size = int(np.ceil(len(solutions)/self.num_worker))
+        else:
+            batch_size = self.batch_size
+        tasks = self._make_batches(solutions, batch_size)
         
-    def _process_workers_result(self, tasks, workers_result):
-        # Rename, in ES context, the task is to evalute the solution candidate
-        solutions = tasks
+        return tasks
+    
+    def _make_batches(self, solutions, batch_size):
+        """
+        Split the candidates into batches, each with a seed for each candidate. 
+        
+        Args:
+            solutions (list): candidate solutions
+            batch_size (int): number of candidates in each batch
+            
+        Returns:
+            tasks (list): a list of batches, each with data structure [solutions, seeds]
+        """
+        num_solution = len(solutions)
+        seeds = self.seeder(size=num_solution)
+        tasks = [[solutions[i:i+batch_size], seeds[i:i+batch_size]] for i in range(0, num_solution, batch_size)]
         
-        # Unpack function values from workers results, [solution_id, function_value]
+        return tasks
+        
+    def _process_workers_result(self, tasks, workers_result):
+        # Unpack function values from workers results, [batch_id, function_values]
         # Note that the workers result already sorted ascendingly with respect to task ID
-        function_values = [result[1] for result in workers_result]
+        # So the function values are in the order of candidates
+        function_values = [function_value for _, batch_values in workers_result for function_value in batch_values]
+        assert len(function_values) == len(self.solutions)
         
         # Update ES
-        self.es.tell(solutions, function_values)
+        self.es.tell(self.solutions, function_values)
         
         # Obtain results from ES
         result = self.es.result
         
         # Process the ES result
         self._process_es_result(result)
+        
+        # Restart ES with larger population, the workers are kept
+        if self.should_restart(result):
+            self.restart()
+            
+    def should_restart(self, result):
+        """
+        User-defined function to decide whether to restart the ES, e.g. stagnation of the best 
+        function values for IPOP restarts. 
+        
+        Args:
+            result (dict): A dictionary of result returned from es.result. 
+            
+        Returns:
+            restart (bool): If True, then restart the ES. Default: False
+        """
+        return False
+    
+    def __call__(self):
+        if self.async_k is None:
+            return super().__call__()
+        
+        # Initialize all workers
+        self.initialize_workers()
+        
+        # Steady-state asynchronous ES
+        self._run_async()
+        
+        # Stop all workers and terminate all processes
+        self.stop_workers()
+        
+    def _run_async(self):
+        """
+        Keep all workers busy with candidates and update the ES with every `async_k` function values. 
+        """
+        batch_size = 1 if self.batch_size is None else self.batch_size
+        
+        # Number of updates, same as generation
+        self.generation = 0
+        # Pending batches for each worker, with data structure [es, solutions, generation when sampled]
+        pending = {}
+        # Arrived function values, with data structure [es, solution, function_value, generation when sampled]
+        arrived = []
+        
+        def send(task_id, master_conn):
+            assert getattr(self.es, 'noise_table', None) is not None, \
+                'Asynchronous ES requires candidates from a shared noise table, e.g. OpenAIES with noise_table. '
+            assert self.es.params.num_slot > self.max_staleness, \
+                'The number of slots of the shared mean must be larger than the maximum staleness. '
+            # Sample new candidates from current search distribution
+            solutions = self.es.ask(batch_size)
+            [task] = self._make_batches(solutions, batch_size)
+            master_conn.send([task_id, task, None])
+            pending[master_conn] = [self.es, solutions, self.generation]
+            
+        num_task = 0
+        for master_conn in self.master_conns:
+            send(num_task, master_conn)
+            num_task += 1
+            
+        while self.generation < self.num_iteration:
+            # Receive results from whichever workers finish first
+            for master_conn in wait(list(pending.keys())):
+                # Stop once enough updates are done, the remaining ready results are received below
+                if self.generation >= self.num_iteration:
+                    break
+                    
+                _, function_values = master_conn.recv()
+                es, solutions, generation = pending.pop(master_conn)
+                arrived.extend([[es, solution, function_value, generation] 
+                                for solution, function_value in zip(solutions, function_values)])
+                
+                # Update ES as soon as enough function values have arrived
+                if len(arrived) >= self.async_k:
+                    arrived = self._update_async(arrived)
+                    
+                # Immediately send new candidates to the idle worker
+                if self.generation < self.num_iteration:
+                    send(num_task, master_conn)
+                    num_task += 1
+                    
+        # Wait for remaining pending workers
+        [master_conn.recv() for master_conn in pending.keys()]
+        
+    def _update_async(self, arrived):
+        """
+        Update the ES with arrived function values, weighted by their staleness. 
+        
+        Args:
+            arrived (list): arrived function values, each with data structure 
+                [es, solution, function_value, generation when sampled]
+                
+        Returns:
+            arrived (list): function values kept for next update, i.e. the remaining ones if fewer than 
+                two are left after discarding, otherwise an empty list. 
+        """
+        # Discard the function values for previous ES before restart or too stale
+        arrived = [x for x in arrived if x[0] is self.es and self.generation - x[3] <= self.max_staleness]
+        # A single function value cannot be ranked or standardized, keep it until more values arrive
+        if len(arrived) < 2:
+            return arrived
+        _, solutions, function_values, generations = zip(*arrived)
+        staleness = self.generation - np.array(generations)
+        weights = self.staleness_decay**staleness
+        
+        # Update ES
+        self.es.tell(list(solutions), list(function_values), weights=weights)
+        self.generation += 1
+        
+        # Process the ES result
+        result = self.es.result
+        self._process_es_result(result)
+        
+        # Restart ES with larger population, the workers are kept
+        if self.should_restart(result):
+            self.restart()
+            
+        return []
+            
+    def restart(self):
+        """
+        Restart the ES with a larger population, i.e. create it again via `make_es` with 
+        population size factor multiplied by `ipop_factor`. 
+        """
+        # The shared memory of new ES would be created after the workers are forked, so they cannot find it
+        assert getattr(self.es, 'noise_table', None) is None, \
+            'Restarts are not supported for ES with a shared noise table, because the workers are already forked. '
+        
+        self.num_restart += 1
+        self.es = self.make_es()
             
     def _process_es_result(self, result):
         """
@@ -1,5 +1,7 @@
 from lagom.core.multiprocessing import BaseWorker
 
+from .shared_noise_table import materialize
+
 
 class BaseESWorker(BaseWorker):
     """
@@ -8,20 +10,43 @@ class BaseESWorker(BaseWorker):
     It defines an objective function to evaluate the given solution 
     candidate and compute a objective function value. 
     
+    Each task from the master is a batch of solution candidates, which are evaluated in a loop by 
+    default. It can be vectorized by overriding `f_batch`. 
+    
     For more details about how worker class works, please refer
     to the documentation of the class, BaseWorker. 
     
+    If the solution candidate is a NoiseCandidate (e.g. OpenAIES with a shared noise table), then 
+    its parameters are reconstructed locally before calling `f`. 
+    
     All inherited subclasses should at least implement the following function:
     1. f(self, solution, seed)
     """
     def work(self, master_cmd):
-        # Unpack master command
-        solution_id, solution, seed = master_cmd
+        # Unpack master command, a batch of solutions each with a seed
+        batch_id, (solutions, seeds), seed = master_cmd
+        # Reconstruct the parameters from shared noise table if necessary
+        solutions = [materialize(solution) for solution in solutions]
         
-        # Evaluate the solution to obtain fitness to the objective function
-        function_value = self.f(solution, seed)
+        # Evaluate the solutions to obtain fitness to the objective function
+        function_values = self.f_batch(solutions, seeds)
+        
+        return batch_id, function_values
+    
+    def f_batch(self, solutions, seeds):
+        """
+        Evaluate a batch of solution candidates, by default each with `f` in a loop. 
         
-        return solution_id, function_value
+        It can be overridden to evaluate the batch in a vectorized way, e.g. a batched forward pass. 
+        
+        Args:
+            solutions (list): a batch of solution candidates
+            seeds (list): random seeds, each for one solution candidate
+            
+        Returns:
+            function_values (list): objective function values, each for one solution candidate
+        """
+        return [self.f(solution, seed) for solution, seed in zip(solutions, seeds)]
     
     def f(self, solution, seed):
         """
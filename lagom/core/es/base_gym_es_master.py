@@ -22,29 +22,31 @@ class BaseGymESMaster(BaseESMaster):
                  worker_class, 
                  num_worker,
                  init_seed=0, 
-                 daemonic_worker=None):
+                 daemonic_worker=None, 
+                 batch_size=None, 
+                 ipop_factor=2, 
+                 async_k=None, 
+                 max_staleness=1, 
+                 staleness_decay=0.5):
         super().__init__(num_iteration=num_iteration, 
                          worker_class=worker_class, 
                          num_worker=num_worker,
                          init_seed=init_seed, 
-                         daemonic_worker=daemonic_worker)
+                         daemonic_worker=daemonic_worker, 
+                         batch_size=batch_size, 
+                         ipop_factor=ipop_factor, 
+                         async_k=async_k, 
+                         max_staleness=max_staleness, 
+                         staleness_decay=staleness_decay)
         
         self.make_env = make_env
         
-    def make_tasks(self, iteration):
-        # Call parent class's method to make tasks (solutions)
-        solutions = super().make_tasks(iteration)
+    def _make_batches(self, solutions, batch_size):
+        # Call parent class's method to make batches of solutions
+        tasks = super()._make_batches(solutions, batch_size)
         
         # Pack make_env together for each solution
         # e.g. ES with gym environment
-        solutions = list(zip(solutions, [self.make_env for _ in range(len(solutions))]))
-        assert len(solutions) == self.es.popsize
+        tasks = [[[(solution, self.make_env) for solution in solutions], seeds] for solutions, seeds in tasks]
         
-        return solutions
-        
-    def _process_workers_result(self, tasks, workers_result):
-        # Unpack tasks to solutions, it inclues [solutions, make_env]
-        solutions = [task[0] for task in tasks]
-        
-        # Call parent class's method to deal with unpacked solutions
-        super()._process_workers_result(tasks=solutions, workers_result=workers_result)
+        return tasks
@@ -1,3 +1,6 @@
+from .shared_noise_table import materialize
+
+
 class ESOptimizer(object):
     """
     Optimizer for evolution strategies (ES). 
@@ -23,7 +26,8 @@ class ESOptimizer(object):
         # Sample candidate solutions from ES
         solutions = self.es.ask()
         # Compute objective function values of sampled candidate solutions
-        function_values = [self.f(solution) for solution in solutions]
+        # Note that the parameters are reconstructed if the solutions are from a shared noise table
+        function_values = [self.f(materialize(solution)) for solution in solutions]
         # Update a new population
         self.es.tell(solutions, function_values)
         # Output results
@@ -0,0 +1,190 @@
+import numpy as np
+
+from .base_es import BaseES
+
+
+class NativeCMAES(BaseES):
+    """
+    Native numpy implementation of CMA-ES, without the external `cma` package.
+    
+    It supports two modes:
+    
+        - Full covariance matrix: the standard CMA-ES, with O(n^2) memory and O(n^3) eigendecomposition,
+          which is only feasible for small number of parameters.
+        - Separable (sep-CMA-ES): only the diagonal of the covariance matrix is adapted, with O(n) memory
+          and time per candidate, suitable for large number of parameters, e.g. neural networks.
+          The learning rates of the covariance matrix are increased by (n + 2)/3 as in the original paper.
+          
+    The sampling in `ask` and the update in `tell` are vectorized over the population. It has the same
+    interface and result as CMAES, i.e. 'best_param' and 'best_f_val' are the best solution so far, and 
+    'hist_best_param' is the mean of the search distribution, so it can be used in BaseESMaster by only 
+    changing `make_es`.
+    
+    Note that we minimize the objective, i.e. function values in tell().
+    
+    Reference:
+        Hansen, N. (2016). The CMA evolution strategy: A tutorial. arXiv:1604.00772
+        Ros, R., Hansen, N. (2008). A simple modification in CMA-ES achieving linear time and space complexity.
+        
+    Examples:
+    
+        es = NativeCMAES(mu0=[3]*100, std0=0.5, popsize=12, separable=True)
+        solutions = es.ask()
+        function_values = [f(solution) for solution in solutions]
+        es.tell(solutions, function_values)
+    """
+    def __init__(self,
+                 mu0,
+                 std0,
+                 popsize,
+                 separable=None):
+        """
+        Args:
+            mu0 (list or ndarray): initial mean
+            std0 (float): initial standard deviation
+            popsize (int): population size
+            separable (bool, optional): If True, then only adapt the diagonal of the covariance matrix.
+                Default: None, i.e. separable only if the number of parameters is more than 100.
+        """
+        self.mu0 = np.array(mu0, dtype=np.float64)
+        self.std0 = std0
+        self.popsize = popsize
+        
+        self.num_params = self.mu0.size
+        n = self.num_params
+        if separable is None:
+            separable = n > 100
+        self.separable = separable
+        
+        # Recombination weights for the best half of the population
+        self.num_elite = self.popsize//2
+        weights = np.log(self.num_elite + 0.5) - np.log(np.arange(1, self.num_elite + 1))
+        self.weights = weights/weights.sum()
+        self.mueff = 1.0/np.sum(self.weights**2)
+        
+        # Learning rates for cumulation, rank-one and rank-mu update of covariance matrix
+        self.cc = (4 + self.mueff/n)/(n + 4 + 2*self.mueff/n)
+        self.cs = (self.mueff + 2)/(n + self.mueff + 5)
+        self.c1 = 2/((n + 1.3)**2 + self.mueff)
+        self.cmu = min(1 - self.c1, 2*(self.mueff - 2 + 1/self.mueff)/((n + 2)**2 + self.mueff))
+        if self.separable:  # faster learning for the diagonal
+            self.c1 = min(1.0, self.c1*(n + 2)/3)
+            self.cmu = min(1 - self.c1, self.cmu*(n + 2)/3)
+        # Damping for step-size
+        self.damps = 1 + 2*max(0, np.sqrt((self.mueff - 1)/(n + 1)) - 1) + self.cs
+        # Expectation of ||N(0, I)||
+        self.chiN = np.sqrt(n)*(1 - 1/(4*n) + 1/(21*n**2))
+        
+        # Dynamic states
+        self.mean = np.copy(self.mu0)
+        self.sigma = self.std0
+        self.pc = np.zeros(n)
+        self.ps = np.zeros(n)
+        if self.separable:
+            self.C = None
+            self.B = None
+            # Standard deviations of each coordinate, i.e. square root of the diagonal of covariance matrix
+            self.D = np.ones(n)
+        else:
+            self.C = np.eye(n)
+            # Eigendecomposition of C = B*diag(D**2)*B^T, updated lazily
+            self.B = np.eye(n)
+            self.D = np.ones(n)
+            self.eigen_generation = 0
+        self.generation = 0
+        
+        self.solutions = None
+        self.best_param = None
+        self.best_f_val = None
+        self.hist_best_param = None
+        self.hist_best_f_val = None
+        
+    def ask(self):
+        # Sample standard Gaussian noise for all candidates at once
+        z = np.random.randn(self.popsize, self.num_params)
+        if self.separable:
+            y = z*self.D
+        else:
+            y = (z*self.D).dot(self.B.T)
+            
+        self.solutions = self.mean + self.sigma*y
+        
+        return list(self.solutions)
+        
+    def tell(self, solutions, function_values):
+        solutions = np.asarray(solutions, dtype=np.float64)
+        function_values = np.asarray(function_values)
+        # Sort function values in ascending order, since we are minimizing the objective
+        idx = np.argsort(function_values)
+        
+        # Make some results
+        self.best_param = solutions[idx[0]]
+        self.best_f_val = function_values[idx[0]]
+        # Update the historical best result
+        first_iteration = self.hist_best_param is None or self.hist_best_f_val is None
+        if first_iteration or self.best_f_val < self.hist_best_f_val:
+            self.hist_best_f_val = self.best_f_val
+            self.hist_best_param = self.best_param
+            
+        self.generation += 1
+        n = self.num_params
+        
+        # Steps of the best candidates, and weighted recombination of the mean
+        y = (solutions[idx[:self.num_elite]] - self.mean)/self.sigma
+        y_w = self.weights.dot(y)
+        self.mean = self.mean + self.sigma*y_w
+        
+        # Cumulation for step-size, with C^(-1/2)*y_w
+        if self.separable:
+            invsqrtC_y_w = y_w/self.D
+        else:
+            invsqrtC_y_w = self.B.dot(self.B.T.dot(y_w)/self.D)
+        self.ps = (1 - self.cs)*self.ps + np.sqrt(self.cs*(2 - self.cs)*self.mueff)*invsqrtC_y_w
+        # Stall the update of pc if ||ps|| is large
+        norm_ps = np.linalg.norm(self.ps)
+        hsig = norm_ps/np.sqrt(1 - (1 - self.cs)**(2*self.generation))/self.chiN < 1.4 + 2/(n + 1)
+        self.pc = (1 - self.cc)*self.pc + hsig*np.sqrt(self.cc*(2 - self.cc)*self.mueff)*y_w
+        
+        # Rank-one and rank-mu update of covariance matrix
+        decay = 1 - self.c1 - self.cmu + (1 - hsig)*self.c1*self.cc*(2 - self.cc)
+        if self.separable:
+            diagC = decay*self.D**2 + self.c1*self.pc**2 + self.cmu*self.weights.dot(y**2)
+            self.D = np.sqrt(diagC)
+        else:
+            self.C = decay*self.C + self.c1*np.outer(self.pc, self.pc) + self.cmu*(y.T*self.weights).dot(y)
+            self._update_eigen()
+            
+        # Adapt step-size
+        self.sigma = self.sigma*np.exp((self.cs/self.damps)*(norm_ps/self.chiN - 1))
+        
+    def _update_eigen(self):
+        """
+        Update the eigendecomposition of the covariance matrix, lazily to achieve O(n^2) amortized time.
+        """
+        if self.generation - self.eigen_generation > self.popsize/(self.c1 + self.cmu)/self.num_params/10:
+            self.eigen_generation = self.generation
+            # Enforce symmetry
+            self.C = np.triu(self.C) + np.triu(self.C, 1).T
+            D2, self.B = np.linalg.eigh(self.C)
+            self.D = np.sqrt(np.maximum(D2, 1e-20))
+            
+    @property
+    def stds(self):
+        """
+        Standard deviations of each coordinate.
+        """
+        if self.separable:
+            return self.sigma*self.D
+        else:
+            return self.sigma*np.sqrt(np.diag(self.C))
+            
+    @property
+    def result(self):
+        # Same keys and meanings as CMAES, i.e. the best solution so far, and the mean of search distribution
+        # (`xfavorite` in CMA-ES) as 'hist_best_param'
+        results = {'best_param': self.hist_best_param,
+                   'best_f_val': self.hist_best_f_val,
+                   'hist_best_param': self.mean,
+                   'stds': self.stds}
+        
+        return results
@@ -4,6 +4,9 @@ import torch
 import torch.optim as optim
 
 from .base_es import BaseES
+from .shared_noise_table import SharedParameters
+from .shared_noise_table import NoiseCandidate
+from .shared_noise_table import materialize
 
 from lagom.core.transform import Standardize
 from lagom.core.transform import RankTransform
@@ -17,6 +20,27 @@ class OpenAIES(BaseES):
     
     A practical tip, the learning rate is better to be proportional to batch size
     i.e. larger batch size, use larger learning rate and vise versa. 
+    
+    If a SharedNoiseTable is given, the noise is not sampled for each generation but indexed from the 
+    table, and the candidate solutions are returned as NoiseCandidate, i.e. only the offset, sign and 
+    standard deviation of each perturbation, with the mean written once into shared memory. So sending 
+    the candidates to the workers is cheap for large number of parameters, and they reconstruct the 
+    parameters locally. In `tell`, the gradient is rebuilt from the offsets and the function values 
+    without storing the noise matrix. 
+    
+    For asynchronous ES, the number of candidates can be given in `ask`, and the function values can 
+    be weighted in `tell`, e.g. according to their staleness. In this case, the candidates should come 
+    from the noise table, so they are valid for `tell` after the mean is updated. The mean is written 
+    into a new slot of shared memory once after each update, so the candidates sampled before the 
+    latest `num_slot - 1` updates are still reconstructed correctly. 
+    
+    Examples:
+    
+        noise_table = SharedNoiseTable(size=25000000, seed=0)
+        es = OpenAIES(mu0=[0.0]*100000, std0=0.1, popsize=64, noise_table=noise_table)
+        solutions = es.ask()
+        function_values = [f(np.asarray(solution)) for solution in solutions]
+        es.tell(solutions, function_values)
     """
     def __init__(self, 
                  mu0, 
@@ -28,7 +52,9 @@ class OpenAIES(BaseES):
                  lr_decay=0.9999, 
                  min_lr=1e-2, 
                  antithetic=False,
-                 rank_transform=True):
+                 rank_transform=True, 
+                 noise_table=None, 
+                 num_slot=2):
         """
         Args:
             mu0 (ndarray): initial mean
@@ -41,6 +67,10 @@ class OpenAIES(BaseES):
             min_lr (float): minumum of learning rate
             antithetic (bool): If True, then use antithetic sampling to generate population.
             rank_transform (bool): If True, then use rank transformation of fitness (combat with outliers). 
+            noise_table (SharedNoiseTable, optional): If not None, then index the noise from the shared noise 
+                table and return candidate solutions as NoiseCandidate. Default: None
+            num_slot (int): number of rotating slots of the mean in shared memory. Only used with the noise 
+                table. Default: 2
         """
         self.mu0 = np.array(mu0)
         self.std0 = std0
@@ -66,19 +96,43 @@ class OpenAIES(BaseES):
         self.lr_scheduler = optim.lr_scheduler.ExponentialLR(optimizer=self.optimizer, 
                                                              gamma=self.lr_decay)
         
+        self.noise_table = noise_table
+        if self.noise_table is not None:
+            # Mean of current generation in shared memory, referred by the candidates
+            self.params = SharedParameters(num_params=self.num_params, num_slot=num_slot)
+            # Slot of current mean, None if it is not yet written since last update
+            self.slot = None
+        
         self.solutions = None
         self.best_param = None
         self.best_f_val = None
         self.hist_best_param = None
         self.hist_best_f_val = None
     
-    def ask(self):
+    def ask(self, popsize=None):
+        """
+        Sample new candidate solutions. 
+        
+        Args:
+            popsize (int, optional): number of candidates. Default: None, i.e. `self.popsize`
+            
+        Returns:
+            solutions (list): sampled candidate solutions
+        """
+        if popsize is None:
+            popsize = self.popsize
+        if self.antithetic:
+            assert popsize % 2 == 0, 'popsize must be even for antithetic sampling. '
+        
+        if self.noise_table is not None:
+            return self._ask_noise_table(popsize)
+        
         # Generate standard Gaussian noise for perturbating model parameters. 
         if self.antithetic:  # antithetic sampling
-            eps = np.random.randn(self.popsize//2, self.num_params)
+            eps = np.random.randn(popsize//2, self.num_params)
             eps = np.concatenate([eps, -eps], axis=0)
         else:
-            eps = np.random.randn(self.popsize, self.num_params)
+            eps = np.random.randn(popsize, self.num_params)
         # Record the noise for gradient computation in tell()
         self.eps = eps
         
@@ -86,8 +140,44 @@ class OpenAIES(BaseES):
         self.solutions = self.mu.detach().numpy() + self.eps*self.std
         
         return list(self.solutions)
+    
+    def _ask_noise_table(self, popsize):
+        """
+        Sample candidate solutions as offsets in the shared noise table. 
+        """
+        # Write the mean into shared memory once for all candidates until next update
+        if self.slot is None:
+            self.slot = self.params.push(self.mu.detach().numpy())
+        
+        # Sample offsets of the noise, the antithetic pairs share the same offset with opposite signs
+        if self.antithetic:
+            offsets = self.noise_table.sample_offset(num_params=self.num_params, num=popsize//2)
+            offsets = np.concatenate([offsets, offsets])
+            signs = np.concatenate([np.ones(popsize//2), -np.ones(popsize//2)])
+        else:
+            offsets = self.noise_table.sample_offset(num_params=self.num_params, num=popsize)
+            signs = np.ones(popsize)
+        
+        self.solutions = [NoiseCandidate(params=self.params, 
+                                         slot=self.slot, 
+                                         noise_table=self.noise_table, 
+                                         offset=offset, 
+                                         sign=sign, 
+                                         std=self.std) 
+                          for offset, sign in zip(offsets, signs)]
+        
+        return list(self.solutions)
+        
+    def tell(self, solutions, function_values, weights=None):
+        """
+        Update the mean with the function values evaluated for sampled solutions. 
         
-    def tell(self, solutions, function_values):
+        Args:
+            solutions (list): candidate solutions sampled from ask()
+            function_values (list): objective function values evaluated for sampled solutions
+            weights (ndarray, optional): weights of the function values in the gradient, e.g. according to 
+                their staleness in asynchronous ES. Default: None
+        """
         # Enforce ndarray of function values
         function_values = np.array(function_values)
         if self.rank_transform:
@@ -99,7 +189,7 @@ class OpenAIES(BaseES):
         # Make some results
         # Sort function values and select the minimum, since we are minimizing the objective. 
         idx = np.argsort(function_values)[0]  # argsort is in ascending order
-        self.best_param = solutions[idx]
+        self.best_param = materialize(solutions[idx])
         if self.rank_transform:  # use rank transform, we should record the original function values
             self.best_f_val = original_function_values[idx]
         else:
@@ -114,8 +204,18 @@ class OpenAIES(BaseES):
         # Enforce fitness as Gaussian distributed, here we use centered ranks
         standardize = Standardize()
         F = standardize(function_values)
-        # Compute gradient, F:[popsize], eps: [popsize, num_params]
-        grad = (1/self.std)*np.mean(np.expand_dims(F, 1)*self.eps, axis=0)
+        if weights is not None:
+            F = F*np.asarray(weights)
+        if self.noise_table is not None:
+            # Rebuild the gradient from the offsets in the noise table, gathered as eps: [popsize, num_params]
+            # Each with its own standard deviation as it might be sampled before some updates
+            offsets = np.array([solution.offset for solution in solutions])
+            coef = np.array([f*solution.sign/solution.std for f, solution in zip(F, solutions)], dtype=np.float32)
+            eps = self.noise_table.noise[offsets[:, np.newaxis] + np.arange(self.num_params)]
+            grad = coef.dot(eps)/len(solutions)
+        else:
+            # Compute gradient, F:[popsize], eps: [popsize, num_params]
+            grad = (1/self.std)*np.mean(np.expand_dims(F, 1)*self.eps, axis=0)
         grad = torch.from_numpy(grad).float()
         # Update the gradient to mu
         self.mu.grad = grad
@@ -127,6 +227,10 @@ class OpenAIES(BaseES):
         # Adaptive std
         if self.std > self.min_std:
             self.std = self.std_decay*self.std
+            
+        # The updated mean is written into shared memory at next ask()
+        if self.noise_table is not None:
+            self.slot = None
         
     @property
     def result(self):
@@ -0,0 +1,220 @@
+from multiprocessing import RawArray
+from multiprocessing import get_start_method
+
+from uuid import uuid4
+
+import numpy as np
+
+
+# Registry of all shared memory blocks created in this process, with unique keys
+# The worker processes forked afterwards inherit it, so the blocks are looked up by keys after unpickling
+# rather than copying their contents through the pipes. So the worker processes must be started with 'fork'
+_shared_blocks = {}
+
+
+def _create_block(size):
+    """
+    Create a float32 block in shared memory and register it.
+    
+    Args:
+        size (int): number of elements
+        
+    Returns:
+        key (str): unique key of the block
+        block (ndarray): a view of the block
+    """
+    assert get_start_method() == 'fork', 'The shared memory is only inherited by worker processes started with fork. '
+    
+    key = uuid4().hex
+    _shared_blocks[key] = RawArray('f', int(size))
+    
+    return key, _get_block(key)
+    
+
+def _get_block(key):
+    """
+    Return a float32 view of the registered block in shared memory with given key.
+    """
+    assert key in _shared_blocks, 'The shared memory must be created before the worker processes are forked. '
+    
+    return np.frombuffer(_shared_blocks[key], dtype=np.float32)
+    
+
+class SharedNoiseTable(object):
+    """
+    A large block of standard Gaussian noise in shared memory, created once and shared by all workers.
+    
+    Then each perturbation of a candidate solution is described by an offset in the noise table, i.e.
+    a slice with the length of the number of parameters, instead of the full parameter vector. So only a
+    few numbers are sent to the workers, and they reconstruct the candidate solutions locally.
+    
+    Note that it must be created before the worker processes are forked, e.g. in `make_es()` of the
+    BaseESMaster, and it requires the start method 'fork' of multiprocessing. When it is pickled, only its key is sent and the noise is looked up in the forked
+    worker process. So the restarts in BaseESMaster, which call `make_es()` again after the workers are
+    forked, are not supported with it.
+    
+    Examples:
+    
+        noise_table = SharedNoiseTable(size=10000000, seed=0)
+        offsets = noise_table.sample_offset(num_params=1000, num=10)
+        eps = noise_table.get(offsets[0], num_params=1000)
+    """
+    def __init__(self, size=25000000, seed=0):
+        """
+        Args:
+            size (int): number of elements in the noise table. Default: 25000000, i.e. 100 MB
+            seed (int): random seed to generate the noise. Default: 0
+        """
+        self.size = size
+        self.seed = seed
+        
+        # Generate the noise in place in shared memory
+        self.key, noise = _create_block(self.size)
+        np.random.default_rng(self.seed).standard_normal(size=self.size, dtype=np.float32, out=noise)
+        
+    @property
+    def noise(self):
+        return _get_block(self.key)
+        
+    def get(self, offset, num_params):
+        """
+        Return the noise vector at given offset, a view of the noise table without copying.
+        
+        Args:
+            offset (int): offset in the noise table
+            num_params (int): number of parameters
+            
+        Returns:
+            eps (ndarray): noise vector
+        """
+        return self.noise[offset:offset+num_params]
+        
+    def sample_offset(self, num_params, num):
+        """
+        Sample random offsets in the noise table.
+        
+        Args:
+            num_params (int): number of parameters
+            num (int): number of offsets
+            
+        Returns:
+            offsets (ndarray): sampled offsets
+        """
+        assert num_params <= self.size, 'The noise table is smaller than the number of parameters. '
+        
+        return np.random.randint(0, self.size - num_params + 1, size=num)
+        
+    def __getstate__(self):
+        return {'size': self.size, 'seed': self.seed, 'key': self.key}
+        
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        
+
+class SharedParameters(object):
+    """
+    Parameter vectors (e.g. mean of the search distribution) in shared memory, which rotate over
+    `num_slot` slots.
+    
+    It is used together with SharedNoiseTable, so the mean is written once per update instead of being
+    sent with each candidate solution. Each candidate refers to the slot of the mean it is sampled
+    from, so the mean can be updated while older candidates are still evaluated, until the slot is
+    overwritten after `num_slot` further updates.
+    
+    Note that it must be created before the worker processes are forked, with the start method 'fork'.
+    """
+    def __init__(self, num_params, num_slot=2):
+        """
+        Args:
+            num_params (int): number of parameters
+            num_slot (int): number of rotating slots. Default: 2
+        """
+        self.num_params = num_params
+        self.num_slot = num_slot
+        
+        self.key, _ = _create_block(self.num_slot*self.num_params)
+        # Current slot
+        self.slot = -1
+        
+    def push(self, param):
+        """
+        Write the parameters into next slot.
+        
+        Args:
+            param (ndarray): parameters
+            
+        Returns:
+            slot (int): the slot written
+        """
+        self.slot = (self.slot + 1) % self.num_slot
+        self.get(self.slot)[:] = param
+        
+        return self.slot
+        
+    def get(self, slot):
+        """
+        Return the parameters in the given slot, a view of the shared memory.
+        """
+        return _get_block(self.key).reshape([self.num_slot, self.num_params])[slot]
+        
+    def __getstate__(self):
+        return {'num_params': self.num_params, 'num_slot': self.num_slot, 'key': self.key, 'slot': self.slot}
+        
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        
+
+class NoiseCandidate(object):
+    """
+    A candidate solution described by the slot of its mean in SharedParameters and its perturbation
+    (offset, sign, std) in SharedNoiseTable, i.e. mean + sign*std*noise[offset:offset+num_params].
+    
+    It is sent to the workers with only a few numbers, and the parameters are reconstructed locally
+    via `np.asarray(candidate)`.
+    """
+    def __init__(self, params, slot, noise_table, offset, sign, std):
+        """
+        Args:
+            params (SharedParameters): shared parameters of the mean
+            slot (int): slot of the mean
+            noise_table (SharedNoiseTable): shared noise table
+            offset (int): offset in the noise table
+            sign (int): sign of the perturbation, i.e. +1 or -1 for antithetic sampling
+            std (float): standard deviation of the perturbation
+        """
+        self.params = params
+        self.slot = slot
+        self.noise_table = noise_table
+        self.offset = int(offset)
+        self.sign = int(sign)
+        self.std = float(std)
+        
+    def __array__(self, dtype=None):
+        eps = self.noise_table.get(self.offset, self.params.num_params)
+        param = self.params.get(self.slot) + self.sign*self.std*eps
+        if dtype is not None:
+            param = param.astype(dtype)
+            
+        return param
+        
+    def __repr__(self):
+        return f'NoiseCandidate(slot={self.slot}, offset={self.offset}, sign={self.sign}, std={self.std})'
+        
+
+def materialize(solution):
+    """
+    Reconstruct the parameters of NoiseCandidate, also inside a tuple or list, e.g. packed with
+    `make_env`. Other solutions are returned unchanged.
+    
+    Args:
+        solution (object): a candidate solution
+        
+    Returns:
+        solution (object): the candidate solution with reconstructed parameters
+    """
+    if isinstance(solution, NoiseCandidate):
+        return np.asarray(solution)
+    elif isinstance(solution, (tuple, list)) and any([isinstance(x, NoiseCandidate) for x in solution]):
+        return type(solution)([materialize(x) for x in solution])
+    else:
+        return solution
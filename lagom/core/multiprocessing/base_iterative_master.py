@@ -47,16 +47,15 @@ class BaseIterativeMaster(BaseMaster):
     def __call__(self):
         """
         It initializes the workers and then iteratively makes a set of iteration-dependent tasks 
-        and assign each task to a worker. 
+        and assign them to the pool of workers. 
         After processing results from all workers and iterations, stop them and terminate all processes. 
         """
         # Initialize all workers
         self.initialize_workers()
 
-        # Iteratively make tasks and assign each task to a worker
+        # Iteratively make tasks and assign them to the workers
         for iteration in range(self.num_iteration):
             tasks = self.make_tasks(iteration)
-            assert len(tasks) <= self.num_worker, 'The number of tasks cannot exceed the number of workers.'
             self.assign_tasks(tasks)
 
         # Stop all workers and terminate all processes
@@ -3,6 +3,9 @@
 
 from multiprocessing import Process
 from multiprocessing import Pipe
+from multiprocessing.connection import wait
+
+from collections import deque
 
 # TODO: consider support of torch.multiprocessing, for its own SimpleQueue or Queue
 """
@@ -17,15 +20,18 @@ from lagom import Seeder
 
 class BaseMaster(object):
     """
-    Base class of a callable master to parallelize solving a set of tasks, each with a worker. 
+    Base class of a callable master to parallelize solving a set of tasks with a pool of workers. 
     
     Each calling it initialize all the workers (each opens a Process) and independent Pipe connections
-    between each worker and itself. And then it makes a set of tasks and assign each task to a worker.
+    between each worker and itself. And then it makes a set of tasks and assign them to the workers.
     After processing each working results received from workers, it stops all workers and terminate
     all processes. 
     
-    Note that it is possible to make less tasks than the number of workers, however, it is not generally
-    recommended to do so. 
+    The workers work as a pool, so any number of tasks can be made. Initially each worker receives one 
+    task and the rest are kept in a pending queue. Whenever a worker sends back its result, it receives 
+    the next pending task immediately, i.e. the tasks are dynamically balanced over the workers. So 
+    the tasks with uneven durations do not leave the workers idle until all tasks are assigned. The 
+    results are always ordered by the task ID. 
     
     All inherited subclasses should at least implement the following functions:
     1. make_tasks(self)
@@ -55,15 +61,14 @@ class BaseMaster(object):
         
     def __call__(self):
         """
-        It initializes the workers, makes a set of tasks and assign each task to a worker. 
+        It initializes the workers, makes a set of tasks and assign them to the workers. 
         After finish processing results from all workers, stop them and terminate all processes. 
         """
         # Initialize all workers
         self.initialize_workers()
         
-        # Make tasks and assign each task to a worker
+        # Make tasks and assign them to the workers
         tasks = self.make_tasks()
-        assert len(tasks) <= self.num_worker, 'The number of tasks cannot exceed the number of workers.'
         self.assign_tasks(tasks)
         
         # Stop all workers and terminate all processes
@@ -102,43 +107,39 @@ class BaseMaster(object):
         
     def assign_tasks(self, tasks):
         """
-        Assign each task to a worker. And process the results from all tasks. 
+        Assign the tasks to the workers dynamically. And process the results from all tasks. 
         
         Args:
-            tasks (list): a list of tasks
+            tasks (list): a list of tasks, any number of them
         """
         num_task = len(tasks)
         
         # Sample random seeds, each for one task
         seeds = self.seeder(size=num_task)
         
-        # Special case when there are less tasks than number of workers
-        if num_task < self.num_worker:
-            master_conns = self.master_conns[:num_task]  # slice exact connection terminals
-            # Send 'cozy' signal to rest of workers as they don't have work to do
-            [master_conn.send('cozy') for master_conn in self.master_conns[num_task:]]
-        else:  # same number of tasks and workers
-            master_conns = self.master_conns
-        
-        # Iterate over all tasks, each assigned to a worker to work
-        for task_id, (task, seed, master_conn) in enumerate(zip(tasks, seeds, master_conns)):
-            # Send the task to worker via master connection
-            # It is important to send ID to make received results with consistent order
-            master_cmd = [task_id, task, seed]
-            master_conn.send(master_cmd)
-        
-        # Receive results from all workers
-        workers_result = [master_conn.recv() for master_conn in self.master_conns]
-        assert len(workers_result) == self.num_worker
-        # Remove all 'roger' reply from cozy workers
-        workers_result = [result for result in workers_result if result != 'roger']
-        
-        # Reordering the result to be consistent with tasks as workers might finish in different speed
-        # i.e. ascending ordering of task ID [0, ..., num_task - 1]
-        # each result with data structure: [task_id, result]
-        workers_result = sorted(workers_result, key=lambda x: x[0])  # x[0] get task_id
-        
-        # Process the results from all workers
+        # Pending queue of all tasks
+        # It is important to send ID to make received results with consistent order
+        queue = deque([[task_id, task, seed] for task_id, (task, seed) in enumerate(zip(tasks, seeds))])
+        
+        # Initially send one task to each worker, the rest of workers stay idle if not enough tasks
+        busy_conns = []
+        for master_conn in self.master_conns[:min(num_task, self.num_worker)]:
+            master_conn.send(queue.popleft())
+            busy_conns.append(master_conn)
+        
+        # Receive results from whichever workers finish first and send them the next pending tasks
+        workers_result = [None]*num_task
+        while len(busy_conns) > 0:
+            for master_conn in wait(busy_conns):
+                # Each result with data structure: [task_id, result]
+                task_id, result = master_conn.recv()
+                workers_result[task_id] = [task_id, result]
+                if len(queue) > 0:
+                    master_conn.send(queue.popleft())
+                else:
+                    busy_conns.remove(master_conn)
+        
+        # Process the results from all workers, ordered by task ID [0, ..., num_task - 1]
         self._process_workers_result(tasks, workers_result)
     
     def _process_workers_result(self, tasks, workers_result):
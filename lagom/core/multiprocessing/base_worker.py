@@ -28,8 +28,6 @@ class BaseWorker(object):
             if master_cmd == 'close':
                 worker_conn.close()
                 break
-            elif master_cmd == 'cozy':
-                worker_conn.send('roger')
             else:
                 task_id, result = self.work(master_cmd)
                 # Send working result back to the master
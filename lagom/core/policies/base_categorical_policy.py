@@ -54,8 +54,11 @@ class BaseCategoricalPolicy(BasePolicy):
                 
         network = MLP(config=None)
         policy = CategoricalPolicy(network=network, env_spec=env_spec)
+        
+    Note that if the action is provided in __call__, it is evaluated (log-probability and entropy)
+    instead of sampling a new action. 
     """
-    def __call__(self, x):
+    def __call__(self, x, action=None):
         network_out = self.network(x)
         assert isinstance(network_out, dict) and 'action_scores' in network_out
         
@@ -65,9 +68,10 @@ class BaseCategoricalPolicy(BasePolicy):
         action_probs = F.softmax(action_scores, dim=-1)  # over last dimension
         # Create a categorical distribution
         action_dist = Categorical(probs=action_probs)
-        # Sample an action from the distribution
-        action = action_dist.sample()
-        # Calculate log-probability of sampled action
+        # Sample an action from the distribution if not provided
+        if action is None:
+            action = action_dist.sample()
+        # Calculate log-probability of the action
         action_logprob = action_dist.log_prob(action)
         # Calculate entropy of the policy conditional on state
         entropy = action_dist.entropy()
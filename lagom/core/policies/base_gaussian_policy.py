@@ -65,8 +65,12 @@ class BaseGaussianPolicy(BasePolicy):
                 
         network = MLP(config=None)
         policy = GaussianPolicy(network=network, env_spec=env_spec)
+        
+    Note that if the action is provided in __call__, it is evaluated (log-probability and entropy)
+    instead of sampling a new action. The provided action must be the unconstrained action, i.e. 
+    before `constraint_action`, which is returned with the key 'unconstrained_action'. 
     """
-    def __call__(self, x):
+    def __call__(self, x, action=None):
         network_out = self.network(x)
         assert isinstance(network_out, dict) and 'mean' in network_out and 'logvar' in network_out
         
@@ -77,10 +81,11 @@ class BaseGaussianPolicy(BasePolicy):
         std = torch.exp(0.5*logvar)
         # Create indpendent normal distribution 
         action_dist = Normal(loc=mean, scale=std)
-        # Sample an action from the distribution
+        # Sample an action from the distribution if not provided
         # We use PyTorch build-in reparameterized verion, rsample()
-        action = action_dist.rsample()
-        # Calculate log-probability of sampled action
+        if action is None:
+            action = action_dist.rsample()
+        # Calculate log-probability of the action
         action_logprob = action_dist.log_prob(action)
         # Calculate entropy of the policy conditional on state
         entropy = action_dist.entropy()
@@ -94,6 +99,8 @@ class BaseGaussianPolicy(BasePolicy):
         # before computing the log-probability. Because log-prob with transformed action is 
         # definitely a wrong value, it's equivalent to transformation of a Gaussian distribution
         # and compute transformed samples with Gaussian density. 
+        # The unconstrained action is also returned, so it can be evaluated again later
+        unconstrained_action = action
         action = self.constraint_action(action)
         
         # User-defined function to process any possible other output
@@ -102,6 +109,7 @@ class BaseGaussianPolicy(BasePolicy):
         # Dictionary of output
         out = {}
         out['action'] = action
+        out['unconstrained_action'] = unconstrained_action
         out['action_logprob'] = action_logprob
         out['entropy'] = entropy
         out['perplexity'] = perplexity
@@ -18,7 +18,7 @@ class BasePolicy(object):
         self.network = network
         self.env_spec = env_spec
         
-    def __call__(self, x):
+    def __call__(self, x, action=None):
         """
         User-defined function to run the policy network given the input. 
         
@@ -26,8 +26,13 @@ class BasePolicy(object):
         
         Note that it must return a dictionary of output. 
         
+        If the action is provided, the policy should not sample a new action but evaluate the given 
+        action instead, e.g. its log-probability. This is useful to re-evaluate a batch of actions
+        collected without computation graph, i.e. in a single forward pass in the learning step. 
+        
         Args:
             x (Tensor): input data. 
+            action (Tensor, optional): batched actions to evaluate. Default to None, i.e. sample new actions. 
             
         Returns:
             out (dict): A dictionary of output data from running the policy network of given input. 
@@ -5,7 +5,7 @@ class RandomPolicy(BasePolicy):
     """
     A random policy. The action is sampled from action space.
     """
-    def __call__(self, x):
+    def __call__(self, x, action=None):
         # Randomly sample an action from action space
         action = self.env_spec.action_space.sample()
         
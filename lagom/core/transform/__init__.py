@@ -4,6 +4,7 @@ from .normalize import Normalize
 from .centralize import Centralize
 from .standardize import Standardize
 from .exp_factor_cumsum import ExpFactorCumSum
+from .gae import GAE
 from .running_mean_std import RunningMeanStd
 from .rank_transform import RankTransform
 from .polysmooth import PolySmooth
@@ -1,16 +1,27 @@
 import numpy as np
 
+from scipy.signal import lfilter
+
+import torch
+
 from .base_transform import BaseTransform
 
 
 class ExpFactorCumSum(BaseTransform):
     """
-    Calculate future accumulated sums with exponential factor. 
+    Calculate future accumulated sums with exponential factor.
     
     e.g. Given input [x_1, ..., x_n] and factor \alpha, the computation returns an array y with same length
     and y_i = x_i + \alpha*x_{i+1} + \alpha^2*x_{i+2} + ... + \alpha^{n-i-1}*x_{n-1} + \alpha^{n-i}*x_{n}
     
-    Commonly useful for calculating returns in RL. 
+    Commonly useful for calculating returns in RL.
+    
+    It supports both a single sequence with shape [T] and a batch of sequences with shape [T, N],
+    where the first dimension is always the time dimension. For ndarray, the computation is a linear
+    filter over the reversed time dimension by `scipy.signal.lfilter`, i.e. y_i = x_i + \alpha*y_{i+1},
+    which runs in C and is vectorized over the batch dimension. With a mask, the filter is applied for
+    each segment between zeros of the mask. For Tensor, it is a reverse scan over the time dimension
+    in linear time, vectorized over the batch dimension, so the gradients are kept.
     """
     def __init__(self, alpha):
         """
@@ -21,44 +32,114 @@ class ExpFactorCumSum(BaseTransform):
         
     def __call__(self, x, mask=None):
         """
-        Calculate future accumulated sums with exponential factor. 
+        Calculate future accumulated sums with exponential factor.
         
-        An option with binary mask is provided. 
+        An option with binary mask is provided.
         Intuitively, the computation will restart for each occurrence
         of zero. If nothing provided, the default mask is ones everywhere.
         
         Args:
-            x (list): input data
-            mask (list): binary mask for each data item. 
+            x (list/ndarray/Tensor): input data with shape [T] or [T, N]
+            mask (list/ndarray/Tensor): binary mask for each data item, same shape as input data.
             
         Returns:
-            out (list): calculated data
+            out (ndarray/Tensor): calculated data. It is a Tensor if the input data is a Tensor,
+                otherwise an ndarray with dtype np.float32.
         """
-        # Convert input to ndarray
+        # Convert input to ndarray or Tensor
         x = self.make_input(x)
-        # Convert to list
-        x = x.tolist()
-        
-        # Enforce input data as list type
-        assert isinstance(x, list), f'Input data must be list dtype, but got {type(x)}. '
         
-        # Enforce mask as list type
+        # Enforce mask to the same type as input data
         if mask is None:
-            mask = [1.0]*len(x)
-        else:  # check is mask is binary array, because boolean array might lead to bugs easily
-            assert np.array(mask).dtype != bool, 'Ensure using binary value only, becuase boolean might lead to bugs. '
-        assert isinstance(mask, list), f'Mask must be list dtype, but got {type(mask)}.'
-        assert len(x) == len(mask), 'The length of input data should be the same as the length of mask.'
-        assert np.array_equal(mask, np.array(mask).astype(bool)), 'The mask must be binary, i.e. either 0 or 1. '
-        
-        # buffer of accumulated sum
-        cumsum = 0
+            mask = torch.ones_like(x) if torch.is_tensor(x) else np.ones_like(x)
+        else:
+            mask = self.make_mask(mask, x)
+            
+        if torch.is_tensor(x):
+            return self._scan(x, mask)
+        else:
+            return self._filter(x, mask)
+            
+    def _scan(self, x, mask):
+        """
+        Reverse scan over time steps for Tensor, each step is vectorized over the batch dimension. 
+        """
+        out = [None]*x.shape[0]
+        cumsum = torch.zeros_like(x[0])
+        for t in reversed(range(x.shape[0])):
+            cumsum = x[t] + self.alpha*cumsum*mask[t]  # recursive update
+            out[t] = cumsum
+            
+        return torch.stack(out)
         
-        out = []
+    def _filter(self, x, mask):
+        """
+        Reverse linear filter over time steps for ndarray, restarted after each zero of the mask. 
+        """
+        def reverse_filter(data):
+            return lfilter([1], [1, -self.alpha], data[::-1], axis=0)[::-1]
+            
+        if np.all(mask == 1):
+            return np.ascontiguousarray(reverse_filter(x), dtype=np.float32)
         
-        # iterate items in reverse ordering
-        for val, mask_item in zip(x[::-1], mask[::-1]):
-            cumsum = val + self.alpha*cumsum*mask_item  # recursive update
-            out.insert(0, cumsum)  # insert to the front
-
+        # Filter each segment ending at a zero of the mask, for each sequence in the batch
+        T = x.shape[0]
+        out = np.zeros_like(x)
+        for x_n, mask_n, out_n in zip(x.reshape(T, -1).T, mask.reshape(T, -1).T, out.reshape(T, -1).T):
+            start = 0
+            for end in list(np.flatnonzero(mask_n == 0) + 1) + [T]:
+                if end > start:
+                    out_n[start:end] = reverse_filter(x_n[start:end])
+                start = end
+                
         return out
+        
+    def make_input(self, x):
+        """
+        Convert the input as an ndarray with dtype np.float32 or a floating Tensor,
+        with shape either [T] or [T, N].
+        
+        Args:
+            x (list/ndarray/Tensor): input data
+            
+        Returns:
+            x (ndarray/Tensor): converted data
+        """
+        if torch.is_tensor(x):
+            if not x.is_floating_point():
+                x = x.float()
+        else:
+            x = np.asarray(x, dtype=np.float32)
+            
+        assert x.ndim > 0, 'Scalar value is not supported. '
+        if x.ndim > 2:
+            raise ValueError('Only 1-dim vector [T] or 2-dim array [T, N] are supported. ')
+            
+        return x
+        
+    def make_mask(self, mask, x):
+        """
+        Convert the mask to the same type and shape as converted input data.
+        
+        Args:
+            mask (list/ndarray/Tensor): binary mask
+            x (ndarray/Tensor): converted input data
+            
+        Returns:
+            mask (ndarray/Tensor): converted mask
+        """
+        if torch.is_tensor(mask):
+            # Boolean mask might lead to bugs easily
+            assert mask.dtype not in [torch.uint8, torch.bool], 'Ensure using binary value only, becuase boolean might lead to bugs. '
+            mask = mask.cpu().numpy()
+        else:
+            mask = np.asarray(mask)
+        # Check is mask is binary array, because boolean array might lead to bugs easily
+        assert mask.dtype != bool, 'Ensure using binary value only, becuase boolean might lead to bugs. '
+        assert mask.shape == tuple(x.shape), 'The shape of input data should be the same as the shape of mask.'
+        assert np.all((mask == 0) | (mask == 1)), 'The mask must be binary, i.e. either 0 or 1. '
+        
+        if torch.is_tensor(x):
+            return torch.from_numpy(mask).to(dtype=x.dtype, device=x.device)
+        else:
+            return mask.astype(np.float32)
@@ -0,0 +1,79 @@
+import numpy as np
+
+import torch
+
+from .base_transform import BaseTransform
+from .exp_factor_cumsum import ExpFactorCumSum
+
+
+class GAE(BaseTransform):
+    r"""
+    Generalized Advantage Estimation (GAE) and TD(lambda) returns for a batch of rollouts.
+    https://arxiv.org/abs/1506.02438
+    
+    Given rewards, state values and dones with shape [T] or [T, N], where the first dimension
+    is the time dimension, and the state values of the final next states with shape [] or [N], it computes
+    \delta_t = r_t + \gamma V(s_{t+1}) (1 - done_t) - V(s_t)
+    A_t = \delta_t + \gamma\lambda (1 - done_t) A_{t+1}
+    
+    The TD(lambda) returns used as targets of the value function are A_t + V(s_t).
+    
+    Note that it is okay when the rollouts contain transitions from several episodes, the binary mask
+    from dones restarts the computation for each episode. The value of the next state is not used for
+    time steps with done=True, i.e. terminal state value is zero.
+    
+    Both ndarray and Tensor are supported. If the state values are Tensor, then the computation is done
+    in PyTorch and the outputs are Tensor.
+    
+    Examples:
+    
+        gae = GAE(gamma=0.99, gae_lambda=0.95)
+        advantages, returns = gae(rewards, values, dones, last_values)
+    """
+    def __init__(self, gamma, gae_lambda):
+        """
+        Args:
+            gamma (float): discounted factor
+            gae_lambda (float): GAE lambda, in range [0, 1]. When it is 1.0, the advantages are
+                bootstrapped discounted returns subtracted by state values. When it is 0.0, they are TD errors.
+        """
+        self.gamma = gamma
+        self.gae_lambda = gae_lambda
+        
+    def __call__(self, rewards, values, dones, last_values):
+        """
+        Compute the advantages and value targets.
+        
+        Args:
+            rewards (list/ndarray/Tensor): rewards with shape [T] or [T, N]
+            values (list/ndarray/Tensor): state values V(s_t) with shape [T] or [T, N]
+            dones (list/ndarray/Tensor): dones with shape [T] or [T, N]
+            last_values (float/list/ndarray/Tensor): state values of the final next states, with shape [] or [N]
+            
+        Returns:
+            advantages (ndarray/Tensor): GAE with shape same as rewards
+            returns (ndarray/Tensor): TD(lambda) returns with shape same as rewards
+        """
+        if torch.is_tensor(values):
+            rewards = torch.as_tensor(rewards, dtype=values.dtype, device=values.device)
+            masks = 1.0 - torch.as_tensor(dones, dtype=values.dtype, device=values.device)
+            last_values = torch.as_tensor(last_values, dtype=values.dtype, device=values.device)
+            next_values = torch.cat([values[1:], last_values.view(1, *values.shape[1:])])
+        else:
+            values = np.asarray(values, dtype=np.float32)
+            rewards = np.asarray(rewards, dtype=np.float32)
+            masks = 1.0 - np.asarray(dones, dtype=np.float32)
+            last_values = np.asarray(last_values, dtype=np.float32)
+            next_values = np.concatenate([values[1:], last_values.reshape(1, *values.shape[1:])])
+        assert rewards.shape == values.shape == masks.shape, 'rewards, values and dones must have the same shape. '
+        
+        # TD errors for all time steps, the value of next state is masked out for done=True
+        deltas = rewards + self.gamma*next_values*masks - values
+        
+        # Accumulate the TD errors backwards within each episode
+        advantages = ExpFactorCumSum(self.gamma*self.gae_lambda)(deltas, mask=masks)
+        
+        # TD(lambda) returns as targets for value function
+        returns = advantages + values
+        
+        return advantages, returns
@@ -35,6 +35,21 @@ class RunningMeanStd(BaseTransform):
         batch_var = np.var(x, axis=0)
         batch_N = x.shape[0]
         
+        self.update_from_moments(batch_mean, batch_var, batch_N)
+        
+    def update_from_moments(self, batch_mean, batch_var, batch_N):
+        """
+        Update the mean and variance given the mean, variance and number of samples of additional data, 
+        e.g. running averages computed in parallel by other RunningMeanStd. 
+        
+        Args:
+            batch_mean (ndarray): mean of additional data
+            batch_var (ndarray): variance of additional data
+            batch_N (int): number of samples of additional data
+        """
+        if batch_N == 0:  # nothing to update
+            return None
+        
         # Compute the updated mean, variance
         if self.mean is None or self.var is None:  # Initialize mean and variance
             new_mean = batch_mean
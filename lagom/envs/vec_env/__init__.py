@@ -1,7 +1,16 @@
 from .vec_env import VecEnv
 from .vec_env_wrapper import VecEnvWrapper
 from .standardize_vec_env import StandardizeVecEnv
+from .standardize_vec_env import Standardizer
 from .serial_vec_env import SerialVecEnv
 from .parallel_vec_env import worker
 from .parallel_vec_env import ParallelVecEnv
+from .async_vec_env import AsyncVecEnv
+from .threaded_vec_env import ThreadedVecEnv
+from .batched_vec_env import BatchedVecEnv
+from .batched_vec_env import CartPoleVecEnv
+from .batched_vec_env import PendulumVecEnv
 from .utils import CloudpickleWrapper
+from .utils import SharedArrays
+from .utils import StackedArrays
+from .utils import ResetAhead
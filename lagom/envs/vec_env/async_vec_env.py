@@ -0,0 +1,131 @@
+from multiprocessing.connection import wait
+
+from .parallel_vec_env import ParallelVecEnv
+
+
+class AsyncVecEnv(ParallelVecEnv):
+    """
+    Run vectorized environment in parallel and asynchronously, i.e. the environments do not have to
+    step in lockstep.
+    
+    With ParallelVecEnv, each step is paced by the slowest environment (e.g. the one which just reset
+    its episode). Here the actions can be sent to any subset of environments via `step_async` with their
+    indices, and `step_wait_ready` returns the results of whichever environments have finished, tagged
+    with their indices. So the agent can immediately select actions for just those environments and
+    send them again, while the others are still working.
+    
+    The environments are grouped in blocks as in ParallelVecEnv, and each block is the unit of execution,
+    i.e. the actions should be sent to all environments of a block together, and the results of a block
+    are returned together. With the default `num_env_per_worker=1`, each environment is independent.
+    
+    The synchronous interface `step(actions)` still works, for all environments in order.
+    
+    Examples:
+    
+        env = AsyncVecEnv(list_make_env)
+        observations = env.reset()
+        env.step_async(actions, indices=list(range(env.num_env)))
+        for _ in range(100):
+            indices, observations, rewards, dones, infos = env.step_wait_ready(k=2)
+            ...
+            env.step_async(actions, indices=indices)
+    """
+    def __init__(self, list_make_env, num_env_per_worker=1):
+        """
+        Args:
+            list_make_env (list): list of functions to generate an environment.
+            num_env_per_worker (int, optional): number of environments in each worker Process. Default: 1
+        """
+        super().__init__(list_make_env=list_make_env, num_env_per_worker=num_env_per_worker)
+        
+        # Worker index of each environment
+        self.worker_index = {index: n for n, block in enumerate(self.blocks) for index in block}
+        # Indices of workers with pending actions
+        self.pending = set()
+        
+    def step_async(self, actions, indices=None):
+        """
+        Notify the environments with given indices to execute the given actions.
+        
+        Args:
+            actions (list): a list of given actions, each for one environment in `indices`
+            indices (list, optional): indices of environments, all environments of a block must be included.
+                Default: None, i.e. all environments.
+        """
+        if indices is None:
+            indices = list(range(self.num_env))
+        assert len(actions) == len(indices), 'The number of actions should be the same as indices. '
+        action_dict = dict(zip(indices, actions))
+        
+        # Send 'step' and actions to the workers of the environments
+        for n in sorted(set([self.worker_index[index] for index in indices])):
+            assert n not in self.pending, f'The worker of environments {self.blocks[n]} is already pending. '
+            assert all([index in action_dict for index in self.blocks[n]]), \
+                f'The actions should be given to all environments {self.blocks[n]} of a block together. '
+            block_actions = [action_dict[index] for index in self.blocks[n]]
+            self.master_conns[n].send(['step', [block_actions, list(range(len(self.blocks[n]))), None]])
+            self.pending.add(n)
+        # Set waiting flag
+        self.waiting = True
+        
+    def step_wait_ready(self, k=1):
+        """
+        Wait until at least `k` pending environments have finished, and return their results.
+        
+        Args:
+            k (int): minimal number of environments to wait for. It is clipped by the number of pending
+                environments. Default: 1
+                
+        Returns:
+            indices (list of int): indices of the environments with results
+            observations (list of object): observations, each for one environment in `indices`
+            rewards (list of float): rewards, each for one environment in `indices`
+            dones (list of bool): dones, each for one environment in `indices`
+            infos (list of dict): infos, each for one environment in `indices`
+        """
+        assert len(self.pending) > 0, 'No environment is pending. '
+        k = min(k, sum([len(self.blocks[n]) for n in self.pending]))
+        
+        indices = []
+        results = []
+        while len(indices) < k:
+            # Wait for any pending workers to be ready
+            pending_conns = {self.master_conns[n]: n for n in self.pending}
+            for master_conn in wait(list(pending_conns.keys())):
+                n = pending_conns[master_conn]
+                results.extend(master_conn.recv())
+                indices.extend(self.blocks[n])
+                self.pending.remove(n)
+        # Update waiting flag
+        self.waiting = len(self.pending) > 0
+        
+        # Unpack results
+        observations, rewards, dones, infos = zip(*results)
+        
+        return indices, list(observations), list(rewards), list(dones), list(infos)
+        
+    def step_wait(self):
+        assert len(self.pending) == self.num_worker, 'The actions should be sent to all environments. '
+        
+        # Wait for all environments and sort the results in order of environments
+        indices, observations, rewards, dones, infos = self.step_wait_ready(k=self.num_env)
+        order = sorted(range(self.num_env), key=lambda j: indices[j])
+        observations, rewards, dones, infos = [[x[j] for j in order] for x in [observations, rewards, dones, infos]]
+        
+        return observations, rewards, dones, infos
+        
+    def reset(self):
+        assert len(self.pending) == 0, 'Cannot reset when some environments are still pending. '
+        
+        return super().reset()
+        
+    def close(self):
+        if self.closed:  # all environments already closed
+            return None
+            
+        # Waiting to receive data only from the pending workers
+        [self.master_conns[n].recv() for n in self.pending]
+        self.pending = set()
+        self.waiting = False
+        
+        super().close()
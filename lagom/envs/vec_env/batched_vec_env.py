@@ -0,0 +1,298 @@
+import numpy as np
+
+from gym.utils import seeding
+
+from lagom.envs.spaces import Box
+from lagom.envs.spaces import Discrete
+
+from .vec_env import VecEnv
+from .utils import StackedArrays
+
+
+class BatchedVecEnv(VecEnv):
+    """
+    Base class of vectorized environment with dynamics implemented natively in numpy over a batch of states,
+    i.e. all environments are stepped at once without a Python loop over each environment.
+    
+    It is useful for fast environments (e.g. classic control) where the overhead of calling step() for each
+    environment dominates the cost of the dynamics itself.
+    
+    Each environment has its own random number generator, seeded in the same way as gym, so the results of
+    each environment are reproducible regardless of the other environments. The states of all environments
+    are stored in a single array with shape [num_env, ...]. When an episode terminates or reaches the time
+    limit `T`, the environment is automatically reset and the initial observation is put in
+    info['init_observation'], same as other VecEnv. The time limit is also marked as
+    info['TimeLimit.truncated'] as in gym.
+    
+    All inherited subclasses should at least implement the following functions:
+    1. _reset_state(self, index)
+    2. _step_state(self, actions)
+    3. _get_obs(self)
+    """
+    def __init__(self, num_env, observation_space, action_space, T, max_episode_reward, seeds=None, return_array=False):
+        """
+        Args:
+            num_env (int): number of environments
+            observation_space (Space): observation space of each environment
+            action_space (Space): action space of each environment
+            T (int): maximum horizon of each episode
+            max_episode_reward (float): maximum episodic reward, None if not available
+            seeds (list, optional): seeds for each environment. Default: None, i.e. random seeds.
+            return_array (bool): If True, return stacked ndarrays for observations, rewards and dones. 
+                Default: False
+        """
+        # There is no individual environment to create
+        super().__init__(list_make_env=[None]*num_env,
+                         observation_space=observation_space,
+                         action_space=action_space)
+                         
+        self._T = T
+        self._max_episode_reward = max_episode_reward
+        
+        # Number of elapsed steps in current episode for each environment
+        self.elapsed_steps = np.zeros(self.num_env, dtype=np.int64)
+        
+        self.seed([None]*self.num_env if seeds is None else seeds)
+        
+        self.return_array = return_array
+        if self.return_array:
+            self.stacked_arrays = StackedArrays(observation_space=self.observation_space, num_env=self.num_env)
+        
+    def _reset_state(self, index):
+        """
+        Reset the states of the environments with given indices, in place.
+        
+        Args:
+            index (ndarray): indices of environments
+        """
+        raise NotImplementedError
+        
+    def _step_state(self, actions):
+        """
+        Update the states of all environments with given actions, in place.
+        
+        Args:
+            actions (ndarray): batched actions
+            
+        Returns:
+            rewards (ndarray): batched rewards
+            terminals (ndarray): batched booleans, True if the episode terminates (not by time limit)
+        """
+        raise NotImplementedError
+        
+    def _get_obs(self):
+        """
+        Return the batched observations with shape [num_env, ...] from current states.
+        """
+        raise NotImplementedError
+        
+    def step_async(self, actions):
+        # Record current actions
+        self.actions = np.asarray(actions)
+        
+    def step_wait(self):
+        # Step all environments at once
+        rewards, terminals = self._step_state(self.actions)
+        observations = self._get_obs()
+        
+        # Time limit
+        self.elapsed_steps += 1
+        truncated = self.elapsed_steps >= self._T
+        dones = terminals | truncated
+        
+        infos = [{} for _ in range(self.num_env)]
+        for k in np.where(truncated)[0]:
+            infos[k]['TimeLimit.truncated'] = not terminals[k]
+            
+        # Automatically reset the environments with done=True, and record initial observations in info
+        index = np.where(dones)[0]
+        if index.size > 0:
+            self._reset_state(index)
+            self.elapsed_steps[index] = 0
+            init_observations = self._get_obs()
+            for k in index:
+                infos[k]['init_observation'] = init_observations[k]
+                
+        if self.return_array:
+            observations, rewards, dones = self.stacked_arrays(observations, rewards, dones)
+            
+            return observations, rewards, dones, infos
+                
+        return list(observations), rewards.tolist(), dones.tolist(), infos
+        
+    def reset(self):
+        # Reset all the environment and return all the initial observations
+        self._reset_state(np.arange(self.num_env))
+        self.elapsed_steps[:] = 0
+        
+        if self.return_array:
+            return self.stacked_arrays(self._get_obs())
+        
+        return list(self._get_obs())
+        
+    def render(self, mode='human'):
+        raise NotImplementedError('Rendering is not supported for natively batched environments. ')
+        
+    def close(self):
+        pass
+        
+    def seed(self, seeds):
+        # Seed the random number generator of each environment, same as gym
+        self.np_randoms = [seeding.np_random(seed)[0] for seed in seeds]
+        
+    @property
+    def T(self):
+        return [self._T]*self.num_env
+        
+    @property
+    def max_episode_reward(self):
+        return [self._max_episode_reward]*self.num_env
+        
+
+class CartPoleVecEnv(BatchedVecEnv):
+    """
+    Natively batched CartPole-v1, the same dynamics as gym with Euler integration.
+    
+    Examples:
+    
+        env = CartPoleVecEnv(num_env=1000, seeds=Seeder(init_seed=0)(size=1000))
+        observations = env.reset()
+        observations, rewards, dones, infos = env.step([0]*1000)
+    """
+    gravity = 9.8
+    masscart = 1.0
+    masspole = 0.1
+    total_mass = masspole + masscart
+    length = 0.5  # actually half the pole's length
+    polemass_length = masspole*length
+    force_mag = 10.0
+    tau = 0.02  # seconds between state updates
+    
+    # Angle at which to fail the episode
+    theta_threshold_radians = 12*2*np.pi/360
+    x_threshold = 2.4
+    
+    def __init__(self, num_env, seeds=None, T=500, max_episode_reward=475.0, return_array=False):
+        """
+        Args:
+            num_env (int): number of environments
+            seeds (list, optional): seeds for each environment. Default: None, i.e. random seeds.
+            T (int): maximum horizon of each episode. Default: 500
+            max_episode_reward (float): maximum episodic reward. Default: 475.0
+            return_array (bool): If True, return stacked ndarrays for observations, rewards and dones. 
+                Default: False
+        """
+        high = np.array([self.x_threshold*2,
+                         np.finfo(np.float32).max,
+                         self.theta_threshold_radians*2,
+                         np.finfo(np.float32).max], dtype=np.float32)
+                         
+        self.state = np.zeros([num_env, 4])
+        
+        super().__init__(num_env=num_env,
+                         observation_space=Box(low=-high, high=high, dtype=np.float32),
+                         action_space=Discrete(2),
+                         T=T,
+                         max_episode_reward=max_episode_reward,
+                         seeds=seeds, 
+                         return_array=return_array)
+                         
+    def _reset_state(self, index):
+        for k in index:
+            self.state[k] = self.np_randoms[k].uniform(low=-0.05, high=0.05, size=(4,))
+            
+    def _step_state(self, actions):
+        x, x_dot, theta, theta_dot = self.state.T
+        force = np.where(actions == 1, self.force_mag, -self.force_mag)
+        costheta = np.cos(theta)
+        sintheta = np.sin(theta)
+        
+        temp = (force + self.polemass_length*theta_dot**2*sintheta)/self.total_mass
+        thetaacc = (self.gravity*sintheta - costheta*temp)/(self.length*(4.0/3.0 - self.masspole*costheta**2/self.total_mass))
+        xacc = temp - self.polemass_length*thetaacc*costheta/self.total_mass
+        
+        # Euler integration
+        self.state = np.stack([x + self.tau*x_dot,
+                               x_dot + self.tau*xacc,
+                               theta + self.tau*theta_dot,
+                               theta_dot + self.tau*thetaacc], axis=1)
+                               
+        x, theta = self.state[:, 0], self.state[:, 2]
+        terminals = (np.abs(x) > self.x_threshold) | (np.abs(theta) > self.theta_threshold_radians)
+        rewards = np.ones(self.num_env)
+        
+        return rewards, terminals
+        
+    def _get_obs(self):
+        return self.state.copy()
+        
+
+class PendulumVecEnv(BatchedVecEnv):
+    """
+    Natively batched Pendulum-v0, the same dynamics as gym.
+    
+    Examples:
+    
+        env = PendulumVecEnv(num_env=1000, seeds=Seeder(init_seed=0)(size=1000))
+        observations = env.reset()
+        observations, rewards, dones, infos = env.step(np.zeros([1000, 1]))
+    """
+    max_speed = 8
+    max_torque = 2.0
+    dt = 0.05
+    m = 1.0
+    l = 1.0
+    
+    def __init__(self, num_env, seeds=None, T=200, max_episode_reward=None, g=10.0, return_array=False):
+        """
+        Args:
+            num_env (int): number of environments
+            seeds (list, optional): seeds for each environment. Default: None, i.e. random seeds.
+            T (int): maximum horizon of each episode. Default: 200
+            max_episode_reward (float): maximum episodic reward. Default: None
+            g (float): gravity. Default: 10.0
+            return_array (bool): If True, return stacked ndarrays for observations, rewards and dones. 
+                Default: False
+        """
+        self.g = g
+        high = np.array([1.0, 1.0, self.max_speed], dtype=np.float32)
+        
+        # States of [theta, theta_dot]
+        self.state = np.zeros([num_env, 2])
+        
+        super().__init__(num_env=num_env,
+                         observation_space=Box(low=-high, high=high, dtype=np.float32),
+                         action_space=Box(low=-self.max_torque, high=self.max_torque, shape=(1,), dtype=np.float32),
+                         T=T,
+                         max_episode_reward=max_episode_reward,
+                         seeds=seeds, 
+                         return_array=return_array)
+                         
+    def _reset_state(self, index):
+        high = np.array([np.pi, 1])
+        for k in index:
+            self.state[k] = self.np_randoms[k].uniform(low=-high, high=high)
+            
+    def _step_state(self, actions):
+        th, thdot = self.state.T
+        
+        # Compute in float64 as gym does with scalar actions
+        u = np.clip(actions.reshape(self.num_env, -1)[:, 0], -self.max_torque, self.max_torque).astype(np.float64)
+        costs = angle_normalize(th)**2 + 0.1*thdot**2 + 0.001*(u**2)
+        
+        newthdot = thdot + (-3*self.g/(2*self.l)*np.sin(th + np.pi) + 3.0/(self.m*self.l**2)*u)*self.dt
+        newth = th + newthdot*self.dt
+        newthdot = np.clip(newthdot, -self.max_speed, self.max_speed)
+        
+        self.state = np.stack([newth, newthdot], axis=1)
+        
+        return -costs, np.zeros(self.num_env, dtype=bool)
+        
+    def _get_obs(self):
+        theta, thetadot = self.state.T
+        
+        return np.stack([np.cos(theta), np.sin(theta), thetadot], axis=1)
+        
+
+def angle_normalize(x):
+    return ((x + np.pi) % (2*np.pi)) - np.pi
@@ -1,73 +1,173 @@
 import numpy as np
 
+from multiprocessing import cpu_count
 from multiprocessing import Process  # easier than threading
 from multiprocessing import Pipe  # faster than Queue
 
 from .vec_env import VecEnv
 from .utils import CloudpickleWrapper
+from .utils import SharedArrays
+from .utils import StackedArrays
+from .utils import ResetAhead
+from .standardize_vec_env import Standardizer
 
+from lagom.core.transform import RunningMeanStd
 
-def worker(master_conn, worker_conn, make_env):
+
+def get_spec_id(env):
+    """
+    Return the ID of the environment specification if available, e.g. 'CartPole-v1' for gym environments. 
+    """
+    spec = getattr(env.unwrapped, 'spec', None)
+    
+    return getattr(spec, 'id', None)
+    
+
+def worker(master_conn, worker_conn, list_make_env, shared_arrays=None, indices=None, standardize=None, reset_ahead=False):
     # Close forked master connection as it is not used here
     # It does not affect the master connection in the main process
     master_conn.close()
     
-    # Create the environment
-    env = make_env()
+    # Create a block of environments, stepped serially in this worker
+    list_env = [make_env() for make_env in list_make_env]
+    
+    # Shared memory transport: results are written into slot of shared arrays, only infos are sent back
+    # indices are the global indices of the environments in the shared arrays
+    if shared_arrays is not None:
+        shared_arrays = shared_arrays.to_ndarray()
+        
+    # Standardize observations and rewards locally with running averages for the block of environments
+    if standardize is not None:
+        standardizer = Standardizer(num_env=len(list_env), track_delta=True, **standardize)
+    else:
+        standardizer = None
+        
+    # Reset the environments on a helper thread when episodes terminate, i.e. while the master is busy
+    if reset_ahead:
+        reset_ahead_helper = ResetAhead()
     
     # Loop until receiving close command from master
     while True:
         # Receive master command
         cmd, data = worker_conn.recv()
         
+        # Wait for pending resets in background before other commands, the environments are not thread-safe
+        if reset_ahead and cmd not in ['step', 'get_standardize_delta', 'set_standardize_stats']:
+            reset_ahead_helper.wait()
+        
         # Do the work according to the command
+        # Note that all the results are batched for the block of environments, i.e. one message per block
         if cmd == 'step':
-            observation, reward, done, info = env.step(data)
-            
-            # If episode terminates, reset the environment and send back initial observation in info
-            if done:
-                init_observation = env.reset()
-                info['init_observation'] = init_observation
+            # Only the environments at given positions within the block are stepped
+            actions, positions, slot = data
+            observations, rewards, dones, infos = [], [], [], []
+            for position, action in zip(positions, actions):
+                env = list_env[position]
+                # Reset in background if episode terminates, initial observation is delivered with next step
+                if reset_ahead:
+                    observation, reward, done, info = reset_ahead_helper.step(env, position, action)
+                else:
+                    observation, reward, done, info = env.step(action)
+                    
+                # If episode terminates, reset the environment and send back initial observation in info
+                if done and not reset_ahead:
+                    init_observation = env.reset()
+                    info['init_observation'] = init_observation
+                    
+                observations.append(observation)
+                rewards.append(reward)
+                dones.append(done)
+                infos.append(info)
                 
-            # Send information back to master
-            worker_conn.send([observation, reward, done, info])
+            if standardizer is not None:
+                observations = list(standardizer.process_obs(np.asarray(observations), infos=infos))
+                rewards = list(standardizer.process_reward(np.asarray(rewards), indices=positions, infos=infos))
+                infos = standardizer.process_infos(infos)
+                
+            if shared_arrays is not None:
+                # Write results into shared arrays and only send back infos as completion signal
+                # Master will put initial observation in info['init_observation']
+                for position, observation, reward, done, info in zip(positions, observations, rewards, dones, infos):
+                    index = indices[position]
+                    shared_arrays['observation'][slot, index] = observation
+                    shared_arrays['reward'][slot, index] = reward
+                    shared_arrays['done'][slot, index] = done
+                    if 'init_observation' in info:
+                        shared_arrays['init_observation'][slot, index] = info.pop('init_observation')
+                worker_conn.send(infos)
+            else:
+                # Send information back to master
+                worker_conn.send(list(zip(observations, rewards, dones, infos)))
         elif cmd == 'reset':
-            # Reset environment
-            observation = env.reset()
-            # Send back initial observation
-            worker_conn.send(observation)
+            # Discard pending resets in background
+            if reset_ahead:
+                reset_ahead_helper.clear()
+            # Reset environments
+            observations = [env.reset() for env in list_env]
+            if standardizer is not None:
+                observations = list(standardizer.process_obs(np.asarray(observations)))
+                
+            if shared_arrays is not None:
+                # Write initial observations into shared array and send back completion signal
+                for index, observation in zip(indices, observations):
+                    shared_arrays['observation'][data, index] = observation
+                worker_conn.send(None)
+            else:
+                # Send back initial observations
+                worker_conn.send(observations)
+        elif cmd == 'get_standardize_delta':
+            worker_conn.send(standardizer.get_delta())
+        elif cmd == 'set_standardize_stats':
+            standardizer.set_stats(data)
         elif cmd == 'render':
-            # Render the environment
-            img = env.render(mode='rgb_array')
-            # Send back rendered RGB image
-            worker_conn.send(img)
+            # Render the environments
+            imgs = [env.render(mode='rgb_array') for env in list_env]
+            # Send back rendered RGB images
+            worker_conn.send(imgs)
         elif cmd == 'close':
-            # Close the environment
-            env.close()
+            # Shut down the helper thread for resets
+            if reset_ahead:
+                reset_ahead_helper.close()
+            # Close the environments
+            [env.close() for env in list_env]
             # Close the worker connection
             worker_conn.close()
             # Break the while loop
             break
         elif cmd == 'seed':
-            env.seed(data)
-        elif cmd == 'T':
-            worker_conn.send(env.T)
-        elif cmd == 'max_episode_reward':
-            worker_conn.send(env.max_episode_reward)
-        elif cmd == 'get_spaces':
-            result = [env.observation_space, env.action_space]
-            # Send back spaces
-            worker_conn.send(result)
+            [env.seed(seed) for env, seed in zip(list_env, data)]
+        elif cmd == 'get_attr':
+            name, positions = data
+            worker_conn.send([getattr(list_env[position], name) for position in positions])
+        elif cmd == 'call_method':
+            name, args, kwargs, positions = data
+            worker_conn.send([getattr(list_env[position], name)(*args, **kwargs) for position in positions])
+        elif cmd == 'get_metadata':
+            # All static properties of the environments in a single message
+            metadata = {'observation_space': list_env[0].observation_space, 
+                        'action_space': list_env[0].action_space, 
+                        'T': [env.T for env in list_env], 
+                        'max_episode_reward': [env.max_episode_reward for env in list_env], 
+                        'spec_id': [get_spec_id(env) for env in list_env]}
+            # Send back metadata
+            worker_conn.send(metadata)
             
 
 class ParallelVecEnv(VecEnv):
     """
-    Run vectorized environment in parallel. Each environment is running in an individual Process.
+    Run vectorized environment in parallel. The environments are split into contiguous blocks, each block
+    is running in an individual Process, and the environments within a block are stepped serially. 
     
     Note that it is recommended to use parallel vectorized environment only if the step() in the environment
     needs quite some computation, otherwise it will be slower than doing it serially. For 'fast'
     environment, it is recommended to use SerialVecEnv instead. 
     
+    The number of environments per worker Process is set by `num_env_per_worker`. By default, all CPU cores
+    are used with equally sized blocks, i.e. ceil(num_env/num_cores). Then each worker sends back one batched 
+    message per step for its block, which avoids oversubscribing the CPU and reduces the number of IPC round 
+    trips for many cheap environments. Setting `num_env_per_worker=1` runs each environment in its own Process 
+    and setting it to num_env runs all of them serially in a single Process. 
+    
     Examples:
     
         def make_env():
@@ -80,60 +180,241 @@ class ParallelVecEnv(VecEnv):
         env.reset()
         for _ in range(100):
             env.step([0]*5)
+            
+    If `shared_memory=True`, each worker writes its observation, reward and done directly into a slot of 
+    preallocated shared arrays and only sends back the info as a completion signal. Then `step_wait` and
+    `reset` return ndarrays with shape [num_env, ...] which are views of the shared arrays without copying, 
+    i.e. observations, rewards (float32) and dones (bool), so `return_array` is always True. The initial 
+    observations for done=True are also put in info['init_observation'] as views. This is useful for 
+    large observations e.g. images, where pickling and copying dominate the step time. 
+    
+    The static properties, i.e. spaces, `T`, `max_episode_reward` and `spec_ids`, are fetched from all workers 
+    in a single round trip at construction and cached. Other attributes and methods of the environments 
+    can be accessed via `get_attr` and `call_method`, which send the command to all workers first and then 
+    gather the results, so the workers run concurrently. 
+    
+    If `reset_ahead=True`, each worker resets the environments with terminated episodes on a helper thread, 
+    so the results are sent back without waiting for the resets, which then run while the master is 
+    selecting the next actions. The initial observations are delivered with the next step, see `ResetAhead` 
+    for details. 
+    
+    If `standardize` is given, the observations and rewards are standardized inside the workers in the 
+    same way as StandardizeVecEnv, so the work is done in parallel rather than in the master process. 
+    Each worker keeps its own running averages for its block of environments. Every `sync_interval` 
+    calls of `step_wait`, the master collects the running averages of new data since last synchronization 
+    from all workers, merges them into the global running averages `obs_runningavg` and `reward_runningavg` 
+    with the parallel algorithm in RunningMeanStd, and sends them back to all workers. Note that the 
+    initial observations in info['init_observation'] are also standardized. 
+    
+    The actions can be sent to a subset of environments via `step_async(actions, indices)`, then only the 
+    workers of these environments step them, and `step_wait` returns their results in the order of `indices`. 
+    
+    Note that the shared arrays rotate over `num_slot` slots, so the returned arrays from one call are
+    overwritten after `num_slot` further calls of `step_wait` or `reset`. Make a copy if they should
+    be kept longer. The default of three slots allows runners to keep the previous observations while 
+    the next step is in flight. The observation space must be a Box or Discrete space. 
     """
-    def __init__(self, list_make_env):
+    def __init__(self, 
+                 list_make_env, 
+                 num_env_per_worker=None, 
+                 shared_memory=False, 
+                 num_slot=3, 
+                 return_array=False, 
+                 standardize=None, 
+                 sync_interval=100, 
+                 reset_ahead=False):
         """
         Args:
             list_make_env (list): list of functions to generate an environment. 
+            num_env_per_worker (int, optional): number of environments in each worker Process. 
+                Default: None, i.e. ceil(num_env/num_cores).
+            shared_memory (bool): If True, use shared memory to transport observations, rewards and dones. 
+                Default: False
+            num_slot (int): number of rotating slots of the shared arrays. Only used if `shared_memory=True`.
+            return_array (bool): If True, return stacked ndarrays for observations, rewards and dones. 
+                Default: False
+            standardize (dict, optional): If not None, standardize observations and rewards in the workers, 
+                with keyword arguments for Standardizer, e.g. {'clip_obs': 10.0, 'gamma': 0.99}. 
+                Default: None
+            sync_interval (int): number of steps between synchronizations of the running averages in all
+                workers. Only used if `standardize` is not None. Default: 100
+            reset_ahead (bool): If True, reset the environments in the background when episodes terminate, 
+                and deliver the initial observations with the next step. Default: False
         """
+        num_env = len(list_make_env)
+        if num_env_per_worker is None:
+            num_env_per_worker = -(-num_env//cpu_count())  # ceil division
+        assert num_env_per_worker >= 1, 'The number of environments per worker must be at least one. '
+        self.num_env_per_worker = num_env_per_worker
+        # Contiguous blocks of environment indices, one for each worker
+        self.blocks = [list(range(start, min(start + self.num_env_per_worker, num_env))) 
+                       for start in range(0, num_env, self.num_env_per_worker)]
+        self.num_worker = len(self.blocks)
+        
+        self.shared_memory = shared_memory
+        self.num_slot = num_slot
+        if self.shared_memory:
+            # Create an environment in main process to get the observation space for allocation
+            env = list_make_env[0]()
+            self.shared_arrays = SharedArrays(observation_space=env.observation_space, 
+                                              shape=[self.num_slot, len(list_make_env)])
+            env.close()
+            shared_arrays = self.shared_arrays
+            self.shared_ndarrays = self.shared_arrays.to_ndarray()
+            # Current slot of the shared arrays
+            self.slot = 0
+        else:
+            shared_arrays = None
+        
         # Create Pipe connections, each for one environment worker
-        self.master_conns, self.worker_conns = zip(*[Pipe() for _ in range(len(list_make_env))])
-        # Create processes, each for one environment worker
+        self.master_conns, self.worker_conns = zip(*[Pipe() for _ in range(self.num_worker)])
+        # Create processes, each for one block of environments
         self.list_process = [Process(target=worker, 
-                                     args=[master_conn, worker_conn, CloudpickleWrapper(make_env)], 
+                                     args=[master_conn, 
+                                           worker_conn, 
+                                           [CloudpickleWrapper(list_make_env[index]) for index in block], 
+                                           shared_arrays, 
+                                           block, 
+                                           standardize, 
+                                           reset_ahead], 
                                      daemon=True)
-                             for master_conn, worker_conn, make_env 
-                             in zip(self.master_conns, self.worker_conns, list_make_env)]
+                             for master_conn, worker_conn, block 
+                             in zip(self.master_conns, self.worker_conns, self.blocks)]
         # Start all the processes
         [process.start() for process in self.list_process]
         
         # Close worker connections as they are not used here, the Processes already fork them
         [worker_conn.close() for worker_conn in self.worker_conns]
         
-        # Obtain observation and action spaces from all environments
-        self.master_conns[0].send(['get_spaces', None])
-        observation_space, action_space = self.master_conns[0].recv()
+        # Metadata handshake: obtain static properties from all workers in one round trip and cache them
+        [master_conn.send(['get_metadata', None]) for master_conn in self.master_conns]
+        all_metadata = [master_conn.recv() for master_conn in self.master_conns]
+        self._T = [T for metadata in all_metadata for T in metadata['T']]
+        self._max_episode_reward = [x for metadata in all_metadata for x in metadata['max_episode_reward']]
+        self.spec_ids = [spec_id for metadata in all_metadata for spec_id in metadata['spec_id']]
         
         # Call parent constructor
         super().__init__(list_make_env=list_make_env, 
-                         observation_space=observation_space, 
-                         action_space=action_space)
+                         observation_space=all_metadata[0]['observation_space'], 
+                         action_space=all_metadata[0]['action_space'])
+        
+        # Stacked arrays to return, already in shared memory if shared_memory=True
+        self.return_array = return_array or self.shared_memory
+        if self.return_array and not self.shared_memory:
+            self.stacked_arrays = StackedArrays(observation_space=self.observation_space, num_env=self.num_env)
+        
+        self.reset_ahead = reset_ahead
+        
+        # Global running averages merged from all workers
+        self.standardize = standardize
+        self.sync_interval = sync_interval
+        if self.standardize is not None:
+            self.obs_runningavg = RunningMeanStd(dtype='ndarray')
+            self.reward_runningavg = RunningMeanStd(dtype='ndarray')
+            # Number of steps since last synchronization
+            self.num_step_unsync = 0
         
         # Some settings
         self.waiting = False  # If True, then workers are still working
         self.closed = False  # If True, then all processes already closed
         
-    def step_async(self, actions):
-        # Send 'step' and action to all environment workers
-        [master_conn.send(['step', action]) for master_conn, action in zip(self.master_conns, actions)]
+    def _split(self, x):
+        """
+        Split a list of data for all environments into blocks, one for each worker. 
+        """
+        return [[x[index] for index in block] for block in self.blocks]
+    
+    def _recv_all(self):
+        """
+        Receive batched results from all workers and flatten them in the order of environments. 
+        """
+        return [result for master_conn in self.master_conns for result in master_conn.recv()]
+        
+    def step_async(self, actions, indices=None):
+        """
+        Send the given actions to the workers of the environments. 
+        
+        Args:
+            actions (list): a list of given actions, each for one environment in `indices`
+            indices (list, optional): indices of environments to step, the others are not stepped. 
+                Default: None, i.e. all environments. 
+        """
+        if indices is None:
+            indices = list(range(self.num_env))
+        assert len(actions) == len(indices), 'The number of actions should be the same as indices. '
+        action_dict = dict(zip(indices, actions))
+        self.step_indices = indices
+        self.step_positions = self._positions(indices)
+        
+        if self.shared_memory:
+            # Results are written into next slot of shared arrays
+            self.slot = (self.slot + 1) % self.num_slot
+            slot = self.slot
+        else:
+            slot = None
+        # Send 'step', actions, positions within the block and slot of shared arrays to involved workers
+        for n, positions in self.step_positions.items():
+            block_actions = [action_dict[self.blocks[n][position]] for position in positions]
+            self.master_conns[n].send(['step', [block_actions, positions, slot]])
         # Set waiting flag
         self.waiting = True
         
     def step_wait(self):
-        # Receive results from all workers
-        results = [master_conn.recv() for master_conn in self.master_conns]
+        # Receive results from all involved workers, in the order of stepped environments
+        results = self._gather(self.step_positions, self.step_indices)
         # Turn off waiting flag
         self.waiting = False
+        
+        # Periodically synchronize running averages of standardization in all workers
+        if self.standardize is not None:
+            self.num_step_unsync += 1
+            if self.num_step_unsync >= self.sync_interval:
+                self.sync_standardize()
+        
+        if self.shared_memory:
+            # Results are already in shared arrays, only infos are received
+            infos = results
+            if self.step_indices == list(range(self.num_env)):
+                observations = self.shared_ndarrays['observation'][self.slot]
+                rewards = self.shared_ndarrays['reward'][self.slot]
+                dones = self.shared_ndarrays['done'][self.slot]
+            else:  # only a subset of environments is written, copied by indexing
+                observations = self.shared_ndarrays['observation'][self.slot, self.step_indices]
+                rewards = self.shared_ndarrays['reward'][self.slot, self.step_indices]
+                dones = self.shared_ndarrays['done'][self.slot, self.step_indices]
+            # Put initial observations in info for done=True, unless they are delivered with next step
+            if not self.reset_ahead:
+                for k in np.where(dones)[0]:
+                    infos[k]['init_observation'] = self.shared_ndarrays['init_observation'][self.slot, self.step_indices[k]]
+                
+            return observations, rewards, dones, infos
+        
         # Unpack results
         observations, rewards, dones, infos = zip(*results)
         
+        if self.return_array:
+            observations, rewards, dones = self.stacked_arrays(observations, rewards, dones)
+            
+            return observations, rewards, dones, list(infos)
+        
         return observations, rewards, dones, infos
     
     def reset(self):
+        if self.shared_memory:
+            # Send 'reset' and slot of shared arrays to all environment workers
+            self.slot = (self.slot + 1) % self.num_slot
+            [master_conn.send(['reset', self.slot]) for master_conn in self.master_conns]
+            # Wait for all workers to write initial observations
+            [master_conn.recv() for master_conn in self.master_conns]
+            
+            return self.shared_ndarrays['observation'][self.slot]
+        
         # Send 'reset' to all environment workers
         [master_conn.send(['reset', None]) for master_conn in self.master_conns]
         # Receive a list of initial observations from reset() in all environment workers
-        observations = [master_conn.recv() for master_conn in self.master_conns]
+        observations = self._recv_all()
+        if self.return_array:
+            observations = self.stacked_arrays(observations)
         
         return observations
         
@@ -141,7 +422,7 @@ class ParallelVecEnv(VecEnv):
         # Send 'render' to all environment workers
         [master_conn.send(['render', None]) for master_conn in self.master_conns]
         # Receive all rendered output from all environment workers
-        imgs = [master_conn.recv() for master_conn in self.master_conns]
+        imgs = self._recv_all()
         
         return imgs
         
@@ -149,9 +430,9 @@ class ParallelVecEnv(VecEnv):
         if self.closed:  # all environments already closed
             return None
         
-        # Waiting to receive data from all the workers if they are still working
+        # Waiting to receive data from all the involved workers if they are still working
         if self.waiting:
-            [master_conn.recv() for master_conn in self.master_conns]
+            [self.master_conns[n].recv() for n in self.step_positions]
             
         # Send 'close' to all environment workers
         [master_conn.send(['close', None]) for master_conn in self.master_conns]
@@ -167,18 +448,78 @@ class ParallelVecEnv(VecEnv):
         
     def seed(self, seeds):
         # Send seeds to all environment workers
-        [master_conn.send(['seed', seed]) for master_conn, seed in zip(self.master_conns, seeds)]
+        [master_conn.send(['seed', block_seeds]) for master_conn, block_seeds in zip(self.master_conns, self._split(seeds))]
+        
+    def sync_standardize(self):
+        """
+        Merge the running averages of new data since last synchronization from all workers into the 
+        global running averages, and send them back to all workers. 
+        """
+        assert not self.waiting, 'Cannot synchronize when some environments are still pending. '
+        # Collect from all workers first
+        [master_conn.send(['get_standardize_delta', None]) for master_conn in self.master_conns]
+        all_delta = [master_conn.recv() for master_conn in self.master_conns]
+        # Merge with the parallel algorithm
+        for delta in all_delta:
+            self.obs_runningavg.update_from_moments(*delta['obs'])
+            self.reward_runningavg.update_from_moments(*delta['reward'])
+        # Send back merged running averages
+        stats = {'obs': (self.obs_runningavg.mean, self.obs_runningavg.var, self.obs_runningavg.N), 
+                 'reward': (self.reward_runningavg.mean, self.reward_runningavg.var, self.reward_runningavg.N)}
+        [master_conn.send(['set_standardize_stats', stats]) for master_conn in self.master_conns]
+        
+        self.num_step_unsync = 0
+        
+    def _positions(self, indices):
+        """
+        Return the positions of the environments with given indices within the block for each involved worker, 
+        i.e. a dictionary with worker index as key. 
+        """
+        positions = {}
+        for index in indices:
+            n = index//self.num_env_per_worker
+            positions.setdefault(n, []).append(index - self.blocks[n][0])
+            
+        return positions
+    
+    def _gather(self, positions, indices):
+        """
+        Receive the results from the involved workers and return them in the order of `indices`. 
+        """
+        results = {}
+        for n, position in positions.items():
+            for p, result in zip(position, self.master_conns[n].recv()):
+                results[self.blocks[n][p]] = result
+        
+        return [results[index] for index in indices]
+        
+    def _fan_out(self, cmd, data, indices):
+        """
+        Send a command to the workers of the environments with given indices, then gather the results
+        in the order of `indices`. The data is sent together with the positions of the environments in
+        each block. 
+        """
+        assert not self.waiting, 'Cannot send command when some environments are still pending. '
+        if indices is None:
+            indices = list(range(self.num_env))
+        
+        # Positions of the environments within the block for each involved worker
+        positions = self._positions(indices)
+        # Send command to all involved workers first
+        [self.master_conns[n].send([cmd, [*data, position]]) for n, position in positions.items()]
+        # Gather results from all involved workers
+        return self._gather(positions, indices)
+    
+    def get_attr(self, name, indices=None):
+        return self._fan_out('get_attr', [name], indices)
+    
+    def call_method(self, name, *args, indices=None, **kwargs):
+        return self._fan_out('call_method', [name, args, kwargs], indices)
         
     @property
     def T(self):
-        [master_conn.send(['T', None]) for master_conn in self.master_conns]
-        all_T = [master_conn.recv() for master_conn in self.master_conns]
-        
-        return all_T
+        return list(self._T)
     
     @property
     def max_episode_reward(self):
-        [master_conn.send(['max_episode_reward', None]) for master_conn in self.master_conns]
-        all_max_episode_reward = [master_conn.recv() for master_conn in self.master_conns]
-        
-        return all_max_episode_reward
+        return list(self._max_episode_reward)
@@ -1,6 +1,8 @@
 import numpy as np
 
 from lagom.envs.vec_env import VecEnv
+from .utils import StackedArrays
+from .utils import ResetAhead
 
 
 class SerialVecEnv(VecEnv):
@@ -11,6 +13,9 @@ class SerialVecEnv(VecEnv):
     needs very few computation, otherwise it will be slower than doing it parallelly. For 'slow' environment, 
     it is recommended to use ParallelVecEnv instead. 
     
+    If `reset_ahead=True`, the environments with terminated episodes are reset on a helper thread 
+    while the agent selects the next actions, see `ResetAhead` for details. 
+    
     Examples:
         def make_env():
             env = gym.make('CartPole-v0')
@@ -23,10 +28,14 @@ class SerialVecEnv(VecEnv):
         for _ in range(100):
             env.step([0]*5)
     """
-    def __init__(self, list_make_env):
+    def __init__(self, list_make_env, return_array=False, reset_ahead=False):
         """
         Args:
             list_make_env (list): list of functions to generate an environment. 
+            return_array (bool): If True, return stacked ndarrays for observations, rewards and dones. 
+                Default: False
+            reset_ahead (bool): If True, reset the environments in the background when episodes terminate, 
+                and deliver the initial observations with the next step. Default: False
         """
         # Create list of environments
         self.list_env = [make_env() for make_env in list_make_env]
@@ -36,9 +45,29 @@ class SerialVecEnv(VecEnv):
                          observation_space=self.list_env[0].observation_space, 
                          action_space=self.list_env[0].action_space)
         
-    def step_async(self, actions):
+        self.return_array = return_array
+        if self.return_array:
+            self.stacked_arrays = StackedArrays(observation_space=self.observation_space, num_env=self.num_env)
+            
+        self.reset_ahead = reset_ahead
+        if self.reset_ahead:
+            self.reset_ahead_helper = ResetAhead()
+        
+    def step_async(self, actions, indices=None):
+        """
+        Record the given actions, each for one environment. 
+        
+        Args:
+            actions (list): a list of given actions, each for one environment in `indices`
+            indices (list, optional): indices of environments to step, the others are not stepped. 
+                Default: None, i.e. all environments. 
+        """
+        if indices is None:
+            indices = list(range(self.num_env))
+        assert len(actions) == len(indices), 'The number of actions should be the same as indices. '
         # Record current actions
         self.actions = actions
+        self.indices = indices
         
     def step_wait(self):
         # Execute the recorded actions, each for one environment
@@ -46,11 +75,16 @@ class SerialVecEnv(VecEnv):
         rewards = []
         dones = []
         infos = []
-        for env, action in zip(self.list_env, self.actions):
-            observation, reward, done, info = env.step(action)
-            
+        for index, action in zip(self.indices, self.actions):
+            env = self.list_env[index]
+            # Reset in background if episode terminates, initial observation is delivered with next step
+            if self.reset_ahead:
+                observation, reward, done, info = self.reset_ahead_helper.step(env, index, action)
+            else:
+                observation, reward, done, info = env.step(action)
+                
             # If episode terminates, reset the environment and record initial observation in info
-            if done:
+            if done and not self.reset_ahead:
                 init_observation = env.reset()
                 info['init_observation'] = init_observation
                 
@@ -59,29 +93,61 @@ class SerialVecEnv(VecEnv):
             rewards.append(reward)
             dones.append(done)
             infos.append(info)
+            
+        if self.return_array:
+            observations, rewards, dones = self.stacked_arrays(observations, rewards, dones)
         
         return observations, rewards, dones, infos
     
     def reset(self):
+        # Discard pending resets in background
+        if self.reset_ahead:
+            self.reset_ahead_helper.clear()
         # Reset all the environment and return all the initial observations
         observations = [env.reset() for env in self.list_env]
+        if self.return_array:
+            observations = self.stacked_arrays(observations)
         
         return observations
     
     def render(self, mode='human'):
+        # Wait for pending resets in background, the environments are not thread-safe
+        if self.reset_ahead:
+            self.reset_ahead_helper.wait()
         # Render all the environments and return rendered images
         imgs = [env.render(mode='rgb_array') for env in self.list_env]
         
         return imgs
     
     def close(self):
+        # Shut down the helper thread for resets
+        if self.reset_ahead:
+            self.reset_ahead_helper.close()
         # Close all the environments
         [env.close() for env in self.list_env]
         
     def seed(self, seeds):
+        if self.reset_ahead:
+            self.reset_ahead_helper.wait()
         # Seed all the environments with given seeds
         [env.seed(seed) for env, seed in zip(self.list_env, seeds)]
         
+    def get_attr(self, name, indices=None):
+        if self.reset_ahead:
+            self.reset_ahead_helper.wait()
+        if indices is None:
+            indices = range(self.num_env)
+        
+        return [getattr(self.list_env[index], name) for index in indices]
+    
+    def call_method(self, name, *args, indices=None, **kwargs):
+        if self.reset_ahead:
+            self.reset_ahead_helper.wait()
+        if indices is None:
+            indices = range(self.num_env)
+        
+        return [getattr(self.list_env[index], name)(*args, **kwargs) for index in indices]
+        
     @property
     def T(self):
         all_T = [env.T for env in self.list_env]
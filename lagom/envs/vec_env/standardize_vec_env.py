@@ -5,15 +5,199 @@ from lagom.core.transform import RunningMeanStd
 from lagom.envs.vec_env import VecEnvWrapper
 
 
-class StandardizeVecEnv(VecEnvWrapper):
+class Standardizer(object):
     """
-    Standardize the observations and rewards by using running average. 
+    Standardize batched observations and rewards by using running averages. 
     i.e. subtract by running mean and divided by running standard deviation
     
     Note that we do not subtract the mean from rewards but only divided by standard deviation. 
     And the reward running average is computed by discounted returns continuously. 
     
-    Also note that each `reset()` we do not clean up the `self.all_returns` buffer. 
+    It is used by StandardizeVecEnv in the master process, and in the worker processes of ParallelVecEnv, 
+    each for a block of environments, so the standardization is done in parallel. 
+    
+    If `track_delta=True`, besides the running averages for standardization, it also keeps the running 
+    averages of the data since last synchronization. The master process periodically collects them from 
+    all workers via `get_delta()`, merges them into the global running averages and sends them back 
+    via `set_stats()`. 
+    """
+    def __init__(self, 
+                 num_env, 
+                 use_obs=True, 
+                 use_reward=True, 
+                 clip_obs=10., 
+                 clip_reward=10., 
+                 gamma=0.99, 
+                 eps=1e-8, 
+                 track_delta=False):
+        """
+        Args:
+            num_env (int): number of environments
+            use_obs (bool): Whether to standardize the observation by using its running average
+            use_reward (bool): Whether to standardize the reward by using its running average
+            clip_obs (float/ndarray): clipping range of standardized observation, i.e. [-clip_obs, clip_obs]
+            clip_reward (float): clipping range of standardized reward, i.e. [-clip_reward, clip_reward]
+            gamma (float): discounted factor. Note that the value 1.0 should not be used. 
+            eps (float): a small epsilon for numerical stability of dividing by standard deviation. 
+            track_delta (bool): Whether to keep the running averages since last synchronization. 
+                Default: False
+        """
+        self.use_obs = use_obs
+        self.use_reward = use_reward
+        self.clip_obs = clip_obs
+        self.clip_reward = clip_reward
+        self.gamma = gamma
+        assert self.gamma < 1.0, 'We do not allow discounted factor as 1.0. See StandardizeVecEnv for details. '
+        self.eps = eps
+        
+        self.obs_runningavg = RunningMeanStd(dtype='ndarray')
+        self.reward_runningavg = RunningMeanStd(dtype='ndarray')
+        # Running averages since last synchronization
+        self.track_delta = track_delta
+        if self.track_delta:
+            self.obs_delta = RunningMeanStd(dtype='ndarray')
+            self.reward_delta = RunningMeanStd(dtype='ndarray')
+        
+        self.all_returns = np.zeros(num_env)
+        
+    def _is_transition(self, infos):
+        """
+        Return a boolean mask of the steps which are transitions, i.e. excluding the steps delivering 
+        initial observations with `reset_ahead=True` (info['reset_ahead']=True), see ResetAhead. 
+        """
+        return np.array([not info.get('reset_ahead', False) for info in infos], dtype=bool)
+        
+    def process_obs(self, obs, update=True, infos=None):
+        """
+        Standardize batched observations. 
+        
+        Args:
+            obs (ndarray): batched observations
+            update (bool): Whether to update the running averages with the observations. 
+            infos (list, optional): infos of the step. If given, the initial observations delivered with 
+                info['reset_ahead']=True do not update the running averages, the same as 
+                info['init_observation'] without reset ahead. Default: None
+            
+        Returns:
+            obs (ndarray): standardized observations
+        """
+        if not self.use_obs:
+            return obs
+        obs = np.asarray(obs)
+        
+        if update:
+            if infos is not None:
+                update_obs = obs[self._is_transition(infos)]
+            else:
+                update_obs = obs
+            if len(update_obs) > 0:
+                self.obs_runningavg(update_obs)
+                if self.track_delta:
+                    self.obs_delta(update_obs)
+        # Standardize the observation
+        mean = self.obs_runningavg.mu
+        std = self.obs_runningavg.sigma
+        
+        return np.clip((obs - mean)/(std + self.eps), a_min=-self.clip_obs, a_max=self.clip_obs)
+        
+    def process_reward(self, rewards, indices=None, infos=None):
+        """
+        Standardize batched rewards by the running standard deviation of discounted returns. 
+        
+        Args:
+            rewards (ndarray): batched rewards
+            indices (list, optional): indices of environments of the rewards, e.g. only a subset of 
+                environments is stepped. Default: None, i.e. all environments. 
+            infos (list, optional): infos of the step. If given, the steps delivering initial observations 
+                with info['reset_ahead']=True are not transitions, so they do not update the discounted 
+                returns and running averages. Default: None
+            
+        Returns:
+            rewards (ndarray): standardized rewards
+        """
+        if not self.use_reward:
+            return rewards
+        rewards = np.asarray(rewards)
+        if indices is None:
+            indices = list(range(len(self.all_returns)))
+        
+        # Only the rewards of transitions update the discounted returns
+        if infos is not None:
+            mask = self._is_transition(infos)
+            update_rewards = rewards[mask]
+            indices = [index for index, is_transition in zip(indices, mask) if is_transition]
+        else:
+            update_rewards = rewards
+        
+        # Compute discounted returns and update running averages
+        if len(indices) > 0:
+            returns = update_rewards + self.gamma*self.all_returns[indices]
+            self.all_returns[indices] = returns
+            self.reward_runningavg(returns)
+            if self.track_delta:
+                self.reward_delta(returns)
+        # Note that we do not subtract from mean, but only divided by std
+        std = self.reward_runningavg.sigma
+        
+        return np.clip(rewards/(std + self.eps), a_min=-self.clip_reward, a_max=self.clip_reward)
+        
+    def process_infos(self, infos):
+        """
+        Standardize the initial observations in info['init_observation'] in place, without updating 
+        the running averages. 
+        
+        Args:
+            infos (list): infos of the step
+            
+        Returns:
+            infos (list): infos with standardized initial observations
+        """
+        for info in infos:
+            if 'init_observation' in info:
+                info['init_observation'] = self.process_obs(info['init_observation'], update=False)
+                
+        return infos
+        
+    def get_delta(self):
+        """
+        Return the running averages since last synchronization and clean them up. 
+        
+        Returns:
+            delta (dict): (mean, var, N) for keys ['obs', 'reward']
+        """
+        assert self.track_delta, 'The running averages since last synchronization are not tracked. '
+        
+        delta = {'obs': (self.obs_delta.mean, self.obs_delta.var, self.obs_delta.N), 
+                 'reward': (self.reward_delta.mean, self.reward_delta.var, self.reward_delta.N)}
+        self.obs_delta = RunningMeanStd(dtype='ndarray')
+        self.reward_delta = RunningMeanStd(dtype='ndarray')
+        
+        return delta
+    
+    def set_stats(self, stats):
+        """
+        Set the running averages, e.g. merged from all workers. 
+        
+        Args:
+            stats (dict): (mean, var, N) for keys ['obs', 'reward']
+        """
+        for runningavg, (mean, var, N) in zip([self.obs_runningavg, self.reward_runningavg], 
+                                              [stats['obs'], stats['reward']]):
+            if N > 0:
+                runningavg.mean, runningavg.var, runningavg.N = np.copy(mean), np.copy(var), N
+                
+
+class StandardizeVecEnv(VecEnvWrapper):
+    """
+    Standardize the observations and rewards by using running average, see Standardizer for details. 
+    
+    The initial observations in info['init_observation'] are also standardized, but they are not added 
+    to the running averages, the same as standardization inside the workers of ParallelVecEnv. 
+    
+    With `reset_ahead=True`, the steps delivering initial observations are not transitions, so their 
+    rewards (0.0) and observations are standardized but not added to the running averages. 
+    
+    Note that each `reset()` we do not clean up the `self.all_returns` buffer. 
     Because of discount factor (< 1), the running averages will be converged after some iterations. 
     Therefore, we do not allow discounted factor as 1.0, as it will lead to unbounded explosion 
     of reward running averages. 
@@ -58,54 +242,72 @@ class StandardizeVecEnv(VecEnvWrapper):
                  e.g. when standard deviation is zero.
         """
         super().__init__(venv)
-        self.obs_runningavg = RunningMeanStd(dtype='ndarray')
-        self.reward_runningavg = RunningMeanStd(dtype='ndarray')
+        self.standardizer = Standardizer(num_env=self.num_env, 
+                                         use_obs=use_obs, 
+                                         use_reward=use_reward, 
+                                         clip_obs=clip_obs, 
+                                         clip_reward=clip_reward, 
+                                         gamma=gamma, 
+                                         eps=eps)
+        # Indices of stepped environments, None for all environments
+        self.indices = None
         
-        self.use_obs = use_obs
-        self.use_reward = use_reward
-        self.clip_obs = clip_obs
-        self.clip_reward = clip_reward
-        
-        self.gamma = gamma
-        assert self.gamma < 1.0, 'We do not allow discounted factor as 1.0. See docstring for details. '
-        self.eps = eps
+    def step_async(self, actions, indices=None):
+        # Record indices of stepped environments for their discounted returns
+        self.indices = indices
+        super().step_async(actions, indices=indices)
         
-        self.all_returns = np.zeros(self.num_env)
-    
     def step_wait(self):
         # Call original step_wait to get results from all environments
         observations, rewards, dones, infos = self.venv.step_wait()
         
-        return self.process_obs(observations), self.process_reward(rewards), dones, infos
-        
-    def process_reward(self, rewards):
-        if self.use_reward:
-            # Compute discounted returns
-            self.all_returns = rewards + self.gamma*self.all_returns
-            # Update with calculated discounted returns
-            self.reward_runningavg(self.all_returns)
-            # Standardize the reward
-            mean = self.reward_runningavg.mu
-            std = self.reward_runningavg.sigma
-            # Note that we do not subtract from mean, but only divided by std
-            rewards = np.clip(rewards/(std + self.eps), a_min=-self.clip_reward, a_max=self.clip_reward)
-            
-            return rewards
-        else:  # return original rewards if use_reward is turned off
-            return rewards
+        observations = self.process_obs(observations, infos=infos)
+        rewards = self.process_reward(rewards, indices=self.indices, infos=infos)
+        infos = self.standardizer.process_infos(infos)
         
-    def process_obs(self, obs):
-        if self.use_obs:
-            # Update with new observation
-            self.obs_runningavg(obs)
-            # Standardize the observation
-            mean = self.obs_runningavg.mu
-            std = self.obs_runningavg.sigma
-            obs = np.clip((obs - mean)/(std + self.eps), a_min=-self.clip_obs, a_max=self.clip_obs)
-            
-            return obs
-        else:  # return original observation if use_obs is turned off
-            return obs
+        return observations, rewards, dones, infos
+        
+    def process_reward(self, rewards, indices=None, infos=None):
+        return self.standardizer.process_reward(rewards, indices=indices, infos=infos)
+        
+    def process_obs(self, obs, infos=None):
+        return self.standardizer.process_obs(obs, infos=infos)
         
     def reset(self):
         return self.process_obs(self.venv.reset())
+        
+    @property
+    def use_obs(self):
+        return self.standardizer.use_obs
+    
+    @property
+    def use_reward(self):
+        return self.standardizer.use_reward
+    
+    @property
+    def clip_obs(self):
+        return self.standardizer.clip_obs
+    
+    @property
+    def clip_reward(self):
+        return self.standardizer.clip_reward
+    
+    @property
+    def gamma(self):
+        return self.standardizer.gamma
+    
+    @property
+    def eps(self):
+        return self.standardizer.eps
+        
+    @property
+    def obs_runningavg(self):
+        return self.standardizer.obs_runningavg
+    
+    @property
+    def reward_runningavg(self):
+        return self.standardizer.reward_runningavg
+    
+    @property
+    def all_returns(self):
+        return self.standardizer.all_returns
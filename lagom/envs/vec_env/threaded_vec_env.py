@@ -0,0 +1,147 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from multiprocessing import cpu_count
+
+from lagom.envs.vec_env import VecEnv
+from .utils import StackedArrays
+
+
+class ThreadedVecEnv(VecEnv):
+    """
+    Run vectorized environment with a persistent pool of threads in the main process.
+    
+    Compared with ParallelVecEnv, there is no serialization of actions and results, and the observations
+    are returned directly without copying. It is useful for environments which release the GIL in step(),
+    e.g. physics simulators or other C extensions, then the environments are stepped concurrently. For pure
+    Python environments, the threads are serialized by the GIL and SerialVecEnv is recommended instead.
+    
+    Note that each environment is only stepped by one thread at a time, but it can be any thread from
+    the pool, so the environments should not rely on thread-local states.
+    
+    Examples:
+    
+        def make_env():
+            env = gym.make('CartPole-v0')
+            env = GymEnv(env)
+            
+            return env
+            
+        env = ThreadedVecEnv([make_env]*5)
+        env.reset()
+        for _ in range(100):
+            env.step([0]*5)
+    """
+    def __init__(self, list_make_env, num_thread=None, return_array=False):
+        """
+        Args:
+            list_make_env (list): list of functions to generate an environment.
+            num_thread (int, optional): number of threads in the pool. Default: None, i.e.
+                minimum of number of environments and number of CPU cores.
+            return_array (bool): If True, return stacked ndarrays for observations, rewards and dones. 
+                Default: False
+        """
+        # Create list of environments
+        self.list_env = [make_env() for make_env in list_make_env]
+        
+        # Call parent constructor
+        super().__init__(list_make_env=list_make_env,
+                         observation_space=self.list_env[0].observation_space,
+                         action_space=self.list_env[0].action_space)
+                         
+        # Create a persistent thread pool
+        if num_thread is None:
+            num_thread = min(self.num_env, cpu_count())
+        self.num_thread = num_thread
+        self.pool = ThreadPoolExecutor(max_workers=self.num_thread)
+        
+        # Futures of the pending steps, each for one environment
+        self.futures = None
+        
+        self.return_array = return_array
+        if self.return_array:
+            self.stacked_arrays = StackedArrays(observation_space=self.observation_space, num_env=self.num_env)
+        
+    def _step_env(self, env, action):
+        """
+        Step a single environment in a thread, auto-reset if the episode terminates.
+        """
+        observation, reward, done, info = env.step(action)
+        
+        # If episode terminates, reset the environment and record initial observation in info
+        if done:
+            init_observation = env.reset()
+            info['init_observation'] = init_observation
+            
+        return observation, reward, done, info
+        
+    def step_async(self, actions):
+        assert self.futures is None, 'The previous step is still pending. '
+        # Submit the actions to the thread pool, each for one environment
+        self.futures = [self.pool.submit(self._step_env, env, action) for env, action in zip(self.list_env, actions)]
+        
+    def step_wait(self):
+        # Wait for all the results, exceptions in the threads are raised here
+        results = [future.result() for future in self.futures]
+        self.futures = None
+        
+        # Unpack results
+        observations, rewards, dones, infos = zip(*results)
+        
+        if self.return_array:
+            observations, rewards, dones = self.stacked_arrays(observations, rewards, dones)
+            
+            return observations, rewards, dones, list(infos)
+        
+        return list(observations), list(rewards), list(dones), list(infos)
+        
+    def reset(self):
+        # Reset all the environment concurrently and return all the initial observations
+        observations = list(self.pool.map(lambda env: env.reset(), self.list_env))
+        if self.return_array:
+            observations = self.stacked_arrays(observations)
+        
+        return observations
+        
+    def render(self, mode='human'):
+        # Render all the environments and return rendered images
+        imgs = [env.render(mode='rgb_array') for env in self.list_env]
+        
+        return imgs
+        
+    def close(self):
+        # Wait for the pending step
+        if self.futures is not None:
+            [future.result() for future in self.futures]
+            self.futures = None
+        # Shut down the thread pool
+        self.pool.shutdown(wait=True)
+        # Close all the environments
+        [env.close() for env in self.list_env]
+        
+    def seed(self, seeds):
+        # Seed all the environments with given seeds
+        [env.seed(seed) for env, seed in zip(self.list_env, seeds)]
+        
+    def get_attr(self, name, indices=None):
+        if indices is None:
+            indices = range(self.num_env)
+        
+        return [getattr(self.list_env[index], name) for index in indices]
+    
+    def call_method(self, name, *args, indices=None, **kwargs):
+        if indices is None:
+            indices = range(self.num_env)
+        
+        return [getattr(self.list_env[index], name)(*args, **kwargs) for index in indices]
+        
+    @property
+    def T(self):
+        all_T = [env.T for env in self.list_env]
+        
+        return all_T
+        
+    @property
+    def max_episode_reward(self):
+        all_max_episode_reward = [env.max_episode_reward for env in self.list_env]
+        
+        return all_max_episode_reward
@@ -1,3 +1,13 @@
+from multiprocessing import RawArray
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from lagom.envs.spaces import Box
+from lagom.envs.spaces import Discrete
+
+
 class CloudpickleWrapper(object):
     """
     Uses cloudpickle to serialize contents (multiprocessing uses pickle by default)
@@ -17,3 +27,188 @@ class CloudpickleWrapper(object):
     def __setstate__(self, ob):
         import pickle
         self.x = pickle.loads(ob)
+
+        
+
+def get_array_specs(observation_space, shape):
+    """
+    Return the shapes and dtypes of the arrays for batched observations, initial observations, 
+    rewards (float32) and dones (bool). 
+    
+    Args:
+        observation_space (Space): observation space, must be Box or Discrete
+        shape (list): leading shape of all arrays, e.g. [num_slot, num_env]
+        
+    Returns:
+        specs (dict): dictionary of (shape, dtype) with keys ['observation', 'init_observation', 'reward', 'done']
+    """
+    if isinstance(observation_space, Box):
+        obs_shape, obs_dtype = observation_space.shape, observation_space.dtype
+    elif isinstance(observation_space, Discrete):
+        obs_shape, obs_dtype = (), observation_space.dtype
+    else:
+        raise TypeError('Batched arrays only support Box or Discrete observation space. ')
+        
+    return {'observation': ([*shape, *obs_shape], np.dtype(obs_dtype)), 
+            'init_observation': ([*shape, *obs_shape], np.dtype(obs_dtype)), 
+            'reward': (list(shape), np.dtype(np.float32)), 
+            'done': (list(shape), np.dtype(bool))}
+            
+
+class SharedArrays(object):
+    """
+    Preallocated arrays in shared memory for observations, initial observations, rewards and dones. 
+    
+    It is created in the main process and passed to the worker processes as arguments, then both can 
+    obtain ndarray views of the same memory via `to_ndarray()`. 
+    
+    Examples:
+    
+        shared_arrays = SharedArrays(observation_space=env.observation_space, shape=[3, 5])
+        arrays = shared_arrays.to_ndarray()
+        arrays['observation'].shape  # [3, 5, *observation_space.shape]
+    """
+    def __init__(self, observation_space, shape):
+        """
+        Args:
+            observation_space (Space): observation space, must be Box or Discrete
+            shape (list): leading shape of all arrays, e.g. [num_slot, num_env]
+        """
+        # Name: (shape, dtype) for all arrays
+        self.specs = get_array_specs(observation_space, shape)
+        
+        # Allocate raw bytes in shared memory, without lock because each worker writes its own slot
+        self.raw_arrays = {name: RawArray('b', int(np.prod(shape, dtype=np.int64))*dtype.itemsize) 
+                           for name, (shape, dtype) in self.specs.items()}
+        
+    def to_ndarray(self):
+        """
+        Return a dictionary of ndarray views of the shared memory. 
+        """
+        return {name: np.frombuffer(self.raw_arrays[name], dtype=dtype).reshape(shape) 
+                for name, (shape, dtype) in self.specs.items()}
+        
+
+class StackedArrays(object):
+    """
+    Preallocated arrays to return batched results of a VecEnv as ndarrays, i.e. observations with 
+    shape [num_env, ...], rewards (float32) and dones (bool) with shape [num_env]. 
+    
+    The results are written in place into the arrays, which rotate over `num_slot` slots, so the returned 
+    arrays from one call are overwritten after `num_slot` further calls. Make a copy if they should be 
+    kept longer. The results of a subset of environments (e.g. `step_async` with `indices`) are written 
+    into the leading rows, i.e. the returned arrays have shape [len(observations), ...]. 
+    
+    Examples:
+    
+        stacked_arrays = StackedArrays(observation_space=env.observation_space, num_env=5)
+        observations, rewards, dones = stacked_arrays(observations, rewards, dones)
+    """
+    def __init__(self, observation_space, num_env, num_slot=3):
+        """
+        Args:
+            observation_space (Space): observation space, must be Box or Discrete
+            num_env (int): number of environments
+            num_slot (int): number of rotating slots. Default: 3
+        """
+        self.num_slot = num_slot
+        self.arrays = {name: np.zeros(shape, dtype=dtype) 
+                       for name, (shape, dtype) in get_array_specs(observation_space, [num_slot, num_env]).items()}
+        # Current slot
+        self.slot = 0
+        
+    def __call__(self, observations, rewards=None, dones=None):
+        """
+        Write batched results into next slot and return the arrays. 
+        
+        Args:
+            observations (object): batched observations, e.g. list of observations
+            rewards (object, optional): batched rewards
+            dones (object, optional): batched dones
+            
+        Returns:
+            observations (ndarray): observations with shape [num_env, ...], only it is returned if 
+                rewards and dones are not given, e.g. for reset(). 
+            rewards (ndarray): rewards with shape [num_env]
+            dones (ndarray): dones with shape [num_env]
+        """
+        self.slot = (self.slot + 1) % self.num_slot
+        n = len(observations)
+        self.arrays['observation'][self.slot, :n] = observations
+        if rewards is None and dones is None:
+            return self.arrays['observation'][self.slot, :n]
+        
+        self.arrays['reward'][self.slot, :n] = rewards
+        self.arrays['done'][self.slot, :n] = dones
+        
+        return self.arrays['observation'][self.slot, :n], self.arrays['reward'][self.slot, :n], self.arrays['done'][self.slot, :n]
+
+
+class ResetAhead(object):
+    """
+    Reset the environments in the background when their episodes terminate, to hide the reset latency. 
+    
+    Without it, the step which terminates an episode also resets the environment synchronously, so it 
+    can be many times slower than a normal step (e.g. procedural generation or scene loading). Here the 
+    terminal step is returned right away without info['init_observation'], and the reset is submitted 
+    to a helper thread, so it runs while the agent is selecting the next actions. 
+    
+    The initial observation is delivered with the next step of that environment, i.e. the given action 
+    is ignored, and it returns the initial observation with reward 0.0, done=False and 
+    info['reset_ahead']=True. So the consumer should skip this transition, e.g. VecTrajectoryRunner 
+    ignores the environments after their episodes terminate, SegmentRunner keeps a time step counter 
+    for each environment, and Standardizer does not add it to the running averages. 
+    
+    Examples:
+    
+        reset_ahead = ResetAhead()
+        observation, reward, done, info = reset_ahead.step(env, key=0, action=action)
+    """
+    def __init__(self):
+        # A single helper thread, so the resets are executed in order of submission
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        # Futures of the pending resets, with key for each environment
+        self.pending = {}
+        
+    def step(self, env, key, action):
+        """
+        Step an environment, or deliver its initial observation if a reset is pending. 
+        
+        Args:
+            env (Env): environment
+            key (object): key of the environment, e.g. its index
+            action (object): action to execute
+            
+        Returns:
+            observation (object): observation, initial observation if a reset was pending
+            reward (float): reward
+            done (bool): done
+            info (dict): info
+        """
+        if key in self.pending:
+            return self.pending.pop(key).result(), 0.0, False, {'reset_ahead': True}
+        
+        observation, reward, done, info = env.step(action)
+        # Reset in background if episode terminates
+        if done:
+            self.pending[key] = self.pool.submit(env.reset)
+            
+        return observation, reward, done, info
+    
+    def wait(self):
+        """
+        Wait for all the pending resets to finish, e.g. before calling other methods of the environments. 
+        The initial observations are still delivered with the next step. 
+        """
+        [future.result() for future in self.pending.values()]
+        
+    def clear(self):
+        """
+        Wait for all the pending resets and discard them, e.g. before resetting all environments. 
+        """
+        self.wait()
+        self.pending = {}
+        
+    def close(self):
+        self.clear()
+        self.pool.shutdown(wait=True)
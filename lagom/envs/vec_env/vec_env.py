@@ -16,7 +16,24 @@ class VecEnv(ABC):
     5. close(self)
     6. seed(self, seeds)
     7. @property: T(self)
+    
+    If `return_array=True`, then `step_wait` and `reset` return stacked ndarrays rather than lists, i.e. 
+    observations with shape [num_env, ...], rewards (float32) and dones (bool) with shape [num_env]. 
+    The arrays are reused, i.e. overwritten after a few further calls, make a copy if they should be 
+    kept longer. See `StackedArrays` for details. 
+    
+    If `reset_ahead=True`, the environments are reset in the background when their episodes terminate, 
+    i.e. info['init_observation'] is not available for done=True, instead the initial observation is 
+    returned by the next step of that environment with info['reset_ahead']=True. See `ResetAhead` for 
+    details. 
+    
+    Some VecEnv (e.g. SerialVecEnv, ParallelVecEnv and AsyncVecEnv) also support stepping only a subset 
+    of environments via `step_async(actions, indices)`, then `step_wait` returns the results of these 
+    environments in the order of `indices`, and the other environments are not stepped. 
     """
+    return_array = False
+    reset_ahead = False
+    
     def __init__(self, list_make_env, observation_space, action_space):
         self.list_make_env = list_make_env
         self.num_env = len(self.list_make_env)
@@ -119,6 +136,34 @@ class VecEnv(ABC):
         # TODO: make it better to use
         pass
     
+    def get_attr(self, name, indices=None):
+        """
+        Return an attribute from the environments. 
+        
+        Args:
+            name (str): name of the attribute
+            indices (list, optional): indices of environments. Default: None, i.e. all environments. 
+            
+        Returns:
+            values (list): list of attribute values, each for one environment in `indices`. 
+        """
+        raise NotImplementedError
+        
+    def call_method(self, name, *args, indices=None, **kwargs):
+        """
+        Call a method of the environments with given arguments and return the results. 
+        
+        Args:
+            name (str): name of the method
+            *args: positional arguments of the method
+            indices (list, optional): indices of environments. Default: None, i.e. all environments. 
+            **kwargs: keyword arguments of the method
+            
+        Returns:
+            results (list): list of returned values, each for one environment in `indices`. 
+        """
+        raise NotImplementedError
+    
     @property
     def unwrapped(self):
         """
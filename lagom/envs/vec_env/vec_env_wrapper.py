@@ -11,8 +11,11 @@ class VecEnvWrapper(VecEnv):
                          observation_space=venv.observation_space, 
                          action_space=venv.action_space)
         
-    def step_async(self, actions):
-        self.venv.step_async(actions)
+    def step_async(self, actions, indices=None):
+        if indices is None:
+            self.venv.step_async(actions)
+        else:
+            self.venv.step_async(actions, indices=indices)
         
     @abstractmethod
     def step_wait(self):
@@ -31,6 +34,20 @@ class VecEnvWrapper(VecEnv):
     def seed(self, seeds):
         return self.venv.seed(seeds)
     
+    def get_attr(self, name, indices=None):
+        return self.venv.get_attr(name, indices=indices)
+    
+    def call_method(self, name, *args, indices=None, **kwargs):
+        return self.venv.call_method(name, *args, indices=indices, **kwargs)
+    
+    @property
+    def return_array(self):
+        return self.venv.return_array
+    
+    @property
+    def reset_ahead(self):
+        return self.venv.reset_ahead
+    
     @property
     def unwrapped(self):
         return self.venv.unwrapped
@@ -6,3 +6,4 @@ from .flatten_observation import FlattenObservation
 from .partial_flatten_dict import PartialFlattenDict
 from .sparse_reward import SparseReward
 from .stack_observation import StackObservation
+from .stack_observation import LazyFrames
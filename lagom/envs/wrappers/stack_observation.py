@@ -5,6 +5,44 @@ from lagom.envs.spaces import Box
 from lagom.envs.wrappers import ObservationWrapper
 
 
+class LazyFrames(object):
+    """
+    Lazy stacked observation, which only keeps references to the frames. 
+    
+    Consecutive stacked observations share the memory of their common frames, so each frame is stored 
+    only once. The stacked array with the frames in the last dimension (the most recent first) is only 
+    created when it is converted to ndarray, e.g. `np.asarray(lazy_frames)`, which is done automatically 
+    when a batch of them is converted, e.g. `np.asarray([lazy_frames1, lazy_frames2])`. 
+    """
+    def __init__(self, frames):
+        """
+        Args:
+            frames (list): list of frames, the most recent first
+        """
+        self.frames = frames
+        
+    def __array__(self, dtype=None):
+        out = np.stack(self.frames, axis=-1)
+        if dtype is not None:
+            out = out.astype(dtype)
+            
+        return out
+    
+    def __len__(self):
+        return len(self.frames)
+    
+    def __getitem__(self, index):
+        return np.asarray(self)[index]
+    
+    @property
+    def shape(self):
+        return (*self.frames[0].shape, len(self.frames))
+    
+    @property
+    def dtype(self):
+        return self.frames[0].dtype
+    
+
 class StackObservation(ObservationWrapper):
     """
     The observations are stacked, e.g. if the number of stacks is 4, then the returned
@@ -17,16 +55,31 @@ class StackObservation(ObservationWrapper):
     
     For example in 'Pendulum-v0', the observation is an array with the shape [3], if we stacks 4
     observations, each step(), the returned observation will have shape [3, 4]
+    
+    The frames are kept in a ring buffer with twice the number of stacks, and each new frame is written 
+    at two positions, so the most recent frames are always a contiguous window of the buffer. Then each 
+    step only writes the newest frame and copies the window once, rather than shifting all the frames. 
+    Note that the copy of the window (i.e. `num_stack` frames) is still made in every step, because the 
+    buffer is overwritten in later steps and a returned view would change under the caller. 
+    
+    If `lazy=True`, the returned observation is a LazyFrames object sharing the memory of the frames 
+    between consecutive observations, the stacked array is created only when it is converted to ndarray. 
+    This reduces the memory by roughly `num_stack` times only as long as the observations are kept as 
+    LazyFrames, e.g. in the transitions from TrajectoryRunner. Data storages with preallocated arrays, 
+    e.g. RolloutBuffer used by SegmentRunner, convert each observation to a stacked array, so there is 
+    no memory reduction there, and only the copy per step is saved. 
     """
-    def __init__(self, env, num_stack):
+    def __init__(self, env, num_stack, lazy=False):
         """
         Args:
             env (Env): environment object
             num_stack (int): number of stacks for the observation
+            lazy (bool): If True, return LazyFrames as observation. Default: False
         """
         super().__init__(env)
         
         self.num_stack = num_stack
+        self.lazy = lazy
         
         # TODO: support Dict space
         assert isinstance(env.observation_space, Box)  # enforce as Box space
@@ -37,23 +90,43 @@ class StackObservation(ObservationWrapper):
         dtype=env.observation_space.dtype
         self.stacked_observation_space = Box(low=low, high=high, dtype=dtype)
         
-        # Initialize stacked observations
-        self.stacked_observation = np.zeros(self.stacked_observation_space.shape, dtype=dtype)
+        if self.lazy:
+            # List of frames, the most recent first
+            self.frames = None
+        else:
+            # Ring buffer of frames with size 2*num_stack, the window [pointer, pointer + num_stack) 
+            # contains the most recent frames, the most recent first
+            self.buffer = np.zeros([*env.observation_space.shape, 2*self.num_stack], dtype=dtype)
+            self.pointer = 0
         
     def reset(self):
         # Clean up all stacked observation
-        self.stacked_observation.fill(0)
+        if self.lazy:
+            zero_frame = np.zeros(self.env.observation_space.shape, dtype=self.stacked_observation_space.dtype)
+            self.frames = [zero_frame]*self.num_stack
+        else:
+            self.buffer.fill(0)
+            self.pointer = 0
         
         # Call reset in original environment
         return super().reset()
         
     def process_observation(self, observation):
-        # Shift the oldest observation to the front
-        self.stacked_observation = np.roll(self.stacked_observation, shift=1, axis=-1)
-        # Change the front as new observation
-        self.stacked_observation[..., 0] = observation
+        if self.lazy:
+            # Add a copy of new observation as the most recent frame, drop the oldest one
+            frame = np.array(observation, dtype=self.stacked_observation_space.dtype)
+            self.frames = [frame] + self.frames[:-1]
+            
+            return LazyFrames(self.frames)
+        
+        # Move the pointer backwards and write the new observation at both positions
+        self.pointer = (self.pointer - 1) % self.num_stack
+        self.buffer[..., self.pointer] = observation
+        self.buffer[..., self.pointer + self.num_stack] = observation
         
-        return self.stacked_observation
+        # Copy the window of the most recent frames, because the buffer will be overwritten
+        # Note that it costs one copy of num_stack frames per step
+        return self.buffer[..., self.pointer:self.pointer + self.num_stack].copy()
     
     @property
     def observation_space(self):
@@ -9,6 +9,10 @@ class BaseExperimentMaster(BaseIterativeMaster):
     """
     Base class of the master for parallelized experiment. 
     
+    All configurations are assigned to the pool of workers dynamically, so there can be more 
+    configurations than workers, and the workers are kept busy even if the configurations take 
+    uneven time to run. 
+    
     For details about master in general, please refer to 
     the documentation of the class, BaseIterativeMaster. 
     
@@ -34,22 +38,16 @@ class BaseExperimentMaster(BaseIterativeMaster):
         if num_worker is None:
             num_worker = len(self.configs)
         
-        num_iteration = int(np.ceil(len(self.configs)/num_worker))
-        assert len(self.configs) <= num_iteration*num_worker, 'More configurations than capacity. '
-        assert len(self.configs) > (num_iteration - 1)*num_worker, 'Too many unused iterations. '
-        
-        super().__init__(num_iteration=num_iteration, 
+        # All configurations are submitted to the pool of workers in a single round, so each worker 
+        # receives the next configuration as soon as it finishes, without waiting for the slowest one
+        super().__init__(num_iteration=1, 
                          worker_class=worker_class, 
                          num_worker=num_worker, 
                          init_seed=0,  # Don't use this internal seeder, but set it in configuration
                          daemonic_worker=daemonic_worker)
         
-        self.splitted_configs = np.array_split(self.configs, num_iteration)
-        for config in self.splitted_configs:
-            assert len(config.tolist()) <= num_worker
-        
     def make_tasks(self, iteration):
-        tasks = self.splitted_configs.pop(0).tolist()
+        tasks = list(self.configs)
         
         # Print configuration
         [Config.print_config(config) for config in tasks]
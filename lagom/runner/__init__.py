@@ -1,5 +1,15 @@
 from .transition import Transition
 from .trajectory import Trajectory
 from .segment import Segment
+from .rollout_buffer import RolloutBuffer
+from .rollout_buffer import RolloutSegment
+from .replay_buffer import ReplayBuffer
+from .segment_tree import SegmentTree
+from .segment_tree import SumTree
+from .segment_tree import MinTree
+from .prioritized_replay_buffer import PrioritizedReplayBuffer
 from .trajectory_runner import TrajectoryRunner
+from .vec_trajectory_runner import VecTrajectoryRunner
 from .segment_runner import SegmentRunner
+from .pipelined_segment_runner import PipelinedSegmentRunner
+from .async_segment_runner import AsyncSegmentRunner
@@ -0,0 +1,122 @@
+import torch
+
+from .rollout_buffer import RolloutBuffer
+from .segment_runner import SegmentRunner
+from .segment_runner import _StepRecorder
+
+from lagom.envs import EnvSpec
+from lagom.envs.vec_env import AsyncVecEnv
+
+
+class AsyncSegmentRunner(SegmentRunner):
+    """
+    Asynchronous SegmentRunner, which does not step all environments in lockstep.
+    
+    With an AsyncVecEnv, the results are received from whichever environments have finished (at least
+    `k` of them), then the agent selects actions for just those environments and sends them again
+    immediately. So a slow step in one environment (e.g. episode reset) does not block the others.
+    
+    Each environment keeps its own time step counter and its results are stored by environment index,
+    until it collects `T` time steps, see `_StepRecorder` for details. The collected data is the same as 
+    SegmentRunner, i.e. a list of RolloutSegment, one for each environment with length `T`. Note that the 
+    additional information from the agent (e.g. log-probabilities) is selected per environment and stacked 
+    for each time step, so the computation graph is kept.
+    
+    Examples:
+    
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=16, init_seed=0)
+        env = AsyncVecEnv(list_make_env)
+        runner = AsyncSegmentRunner(agent=agent, env=env, gamma=0.99, k=4)
+        D = runner(T=5)
+    """
+    def __init__(self, agent, env, gamma, k=1, no_grad=False):
+        """
+        Args:
+            agent (BaseAgent): agent
+            env (AsyncVecEnv): asynchronous vectorized environment
+            gamma (float): discount factor
+            k (int): minimal number of environments to wait for before selecting actions. Default: 1
+            no_grad (bool): If True, collect data without computation graph. Default: False
+        """
+        self.agent = agent
+        self.env = env
+        assert isinstance(self.env, AsyncVecEnv), 'The environment must be of type AsyncVecEnv. '
+        self.env_spec = EnvSpec(self.env)
+        self.gamma = gamma
+        self.k = k
+        self.no_grad = no_grad
+        
+        # Buffer for observation (continuous with next call)
+        self.obs_buffer = None
+        
+    def __call__(self, T, reset=False):
+        """
+        Run the agent in the asynchronous environments and collect all necessary data for given number of
+        time steps for each Segment (one Segment for each environment).
+        
+        Args:
+            T (int): Number of time steps
+            reset (bool): Whether to reset all environments (in VecEnv).
+            
+        Returns:
+            D (list of RolloutSegment): list of collected segments.
+        """
+        num_env = self.env.num_env
+        # Preallocate a rollout buffer for all environments
+        buffer = RolloutBuffer(env_spec=self.env_spec, T=T, num_env=num_env)
+        
+        # Reset the environment and returns initial state if reset=True or first time call
+        if self.obs_buffer is None or reset:
+            self.obs_buffer = list(self.env.reset())
+            
+        # Time step counter for each environment
+        recorder = _StepRecorder(runner=self, buffer=buffer)
+        # Actions and selected outputs of the agent for the pending step in each environment
+        outputs = [None]*num_env
+        
+        def send(indices):
+            # Batched action selection for given environments
+            output_agent, raw_action, state_value = self._choose_action([self.obs_buffer[i] for i in indices])
+            output = recorder.select(output_agent, state_value)
+            for j, i in enumerate(indices):
+                outputs[i] = [raw_action[j], {key: val[j] for key, val in output.items()}]
+            # Execute the actions asynchronously
+            self.env.step_async(raw_action, indices=indices)
+            
+        send(list(range(num_env)))
+        while len(self.env.pending) > 0:
+            # Receive results from at least k environments
+            indices, obs_next, reward, done, info = self.env.step_wait_ready(k=self.k)
+            
+            # Write the transitions of ready environments, each at its own time step
+            raw_action = [outputs[i][0] for i in indices]
+            output = {key: [outputs[i][1][key] for i in indices] for key in outputs[indices[0]][1]}
+            recorder.record(indices, [self.obs_buffer[i] for i in indices], raw_action, output, 
+                            obs_next, reward, done, info)
+            
+            # Back up next observations, use info['init_observation'] if done=True
+            for i, next_obs in zip(indices, self._get_next_obs(obs_next, done, info)):
+                self.obs_buffer[i] = next_obs
+                
+            # Select actions for ready environments which still need more time steps
+            ready = recorder.unfinished(indices)
+            if len(ready) > 0:
+                send(ready)
+                
+        # Stack additional information for each time step over all environments
+        recorder.finalize()
+                    
+        # Call agent again to compute state value for final observation in collected segment
+        if recorder.has_state_value:
+            with torch.set_grad_enabled(not self.no_grad):
+                V_s_next = self.agent.choose_action(self.obs_buffer)['state_value']
+            # Add V_s_next to final transitions in each segment
+            buffer.add_final_info(name='V_s_next', value=V_s_next)
+            
+        # Segment-compatible view for each environment
+        D = buffer.segments(gamma=self.gamma)
+        # Record whether the data is collected without computation graph
+        for segment in D:
+            segment.add_info('no_grad', self.no_grad)
+        
+        return D
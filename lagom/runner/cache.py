@@ -0,0 +1,48 @@
+import inspect
+
+from functools import wraps
+
+
+def cached(f):
+    """
+    Decorator to memoize the output of a method of Segment or Trajectory.
+    
+    The output is stored in the dictionary `self._cache` with the key consisting of the method itself
+    and all its (hashable) arguments bound to the parameters of the method, with default values applied.
+    So the calls `all_gae(0.5)` and `all_gae(gae_lambda=0.5)` share the same cached output, and the methods
+    with the same name in different classes (e.g. an overridden method calling `super()`) do not collide.
+    Each derived quantity is only computed once. The counters `self.cache_hits` and `self.cache_misses` 
+    are incremented accordingly.
+    
+    Note that the cache should be cleared each time the object is mutated, e.g. `add_transition`.
+    
+    The cached output is returned directly without copying, so it is read-only. A caller which needs
+    to modify it (e.g. appending to the list from `all_r`) should make a copy first, e.g. `list(D.all_r)`,
+    otherwise the cache is corrupted. 
+    
+    Examples:
+    
+        class Segment(object):
+            @property
+            @cached
+            def all_r(self):
+                return [transition.r for transition in self.transitions]
+    """
+    signature = inspect.signature(f)
+    
+    @wraps(f)
+    def wrapper(self, *args, **kwargs):
+        # Bind the arguments to the parameters, the first one is self
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        key = (f, tuple(bound.arguments.values())[1:])
+        
+        if key in self._cache:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            self._cache[key] = f(self, *args, **kwargs)
+            
+        return self._cache[key]
+        
+    return wrapper
@@ -0,0 +1,229 @@
+from time import perf_counter
+
+import numpy as np
+
+import torch
+
+from .rollout_buffer import RolloutBuffer
+from .segment_runner import SegmentRunner
+from .segment_runner import _StepRecorder
+
+from lagom.envs import EnvSpec
+from lagom.envs.vec_env import VecEnv
+
+
+class PipelinedSegmentRunner(SegmentRunner):
+    """
+    Double-buffered SegmentRunner, which overlaps the environment stepping with the policy inference.
+    
+    The environments are split into two groups A and B, each as an individual VecEnv (e.g. ParallelVecEnv).
+    For each time step, while the actions of one group are executed by its workers (between `step_async`
+    and `step_wait`), the agent selects the actions for the other group. So both the workers and the
+    main process are kept busy. The schedule for each time step is
+    
+        1. Inference for group B, send its actions via `step_async`
+        2. Wait for results of group A
+        3. Inference for group A, send its actions via `step_async`
+        4. Wait for results of group B
+        
+    The collected data is the same as SegmentRunner with the environments from group A followed by
+    group B, i.e. a list of RolloutSegment, one for each environment.
+    
+    After each call, the timing statistics per time step are available in `self.timing` with keys
+    
+        - 'inference': time spent for policy inference
+        - 'wait': time blocked in `step_wait`, i.e. waiting time not hidden
+        - 'hidden': time when the actions are in flight but the main process is doing other work,
+          i.e. waiting time hidden by the pipeline. Note that it is an upper bound, because the
+          workers might finish earlier.
+        - 'total': total time
+        
+    Note that for SerialVecEnv, the environments are only stepped in `step_wait`, so there is no overlap.
+    
+    For VecEnv with `reset_ahead=True` (required for both groups), the step delivering the initial observation 
+    is skipped for that environment, so each environment keeps its own time step counter and only the 
+    environments with less than `T` transitions are stepped, the same as SegmentRunner. Then the number of 
+    steps per call might be more than `T`. 
+    
+    Examples:
+    
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=16, init_seed=0)
+        env = [ParallelVecEnv(list_make_env[:8]), ParallelVecEnv(list_make_env[8:])]
+        runner = PipelinedSegmentRunner(agent=agent, env=env, gamma=0.99)
+        D = runner(T=5)
+        runner.timing
+    """
+    def __init__(self, agent, env, gamma, no_grad=False):
+        """
+        Args:
+            agent (BaseAgent): agent
+            env (list): two VecEnv as two groups of environments
+            gamma (float): discount factor
+            no_grad (bool): If True, collect data without computation graph. Default: False
+        """
+        self.agent = agent
+        self.env = env
+        assert len(self.env) == 2, 'Exactly two groups of environments are required. '
+        assert all([isinstance(env, VecEnv) for env in self.env]), 'The environment must be of type VecEnv. '
+        assert self.env[0].reset_ahead == self.env[1].reset_ahead, 'Both groups should have the same reset_ahead. '
+        self.env_spec = EnvSpec(self.env[0])
+        self.num_env = sum([env.num_env for env in self.env])
+        self.gamma = gamma
+        self.no_grad = no_grad
+        
+        # Buffer for observation (continuous with next call), one for each group
+        self.obs_buffer = None
+        
+        # Timing statistics per time step
+        self.timing = None
+        
+    def __call__(self, T, reset=False):
+        """
+        Run the agent in both groups of environments and collect all necessary data for given number of
+        time steps for each Segment (one Segment for each environment).
+        
+        Args:
+            T (int): Number of time steps
+            reset (bool): Whether to reset all environments (in VecEnv).
+            
+        Returns:
+            D (list of RolloutSegment): list of collected segments.
+        """
+        # Preallocate a rollout buffer for all environments
+        buffer = RolloutBuffer(env_spec=self.env_spec, T=T, num_env=self.num_env)
+        
+        # Reset the environments and returns initial states if reset=True or first time call
+        if self.obs_buffer is None or reset:
+            self.obs_buffer = [env.reset() for env in self.env]
+            
+        # Timing
+        inference_time = 0.0
+        wait_time = 0.0
+        hidden_time = 0.0
+        start_time = perf_counter()
+        
+        def infer_and_send(g, indices=None):
+            nonlocal inference_time
+            t0 = perf_counter()
+            if indices is None:
+                output_agent, raw_action, state_value = self._choose_action(self.obs_buffer[g])
+            else:
+                output_agent, raw_action, state_value = self._choose_action([self.obs_buffer[g][k] for k in indices])
+            inference_time += perf_counter() - t0
+            # Execute the actions asynchronously
+            if indices is None:
+                self.env[g].step_async(raw_action)
+            else:
+                self.env[g].step_async(raw_action, indices=indices)
+            return [output_agent, raw_action, state_value], perf_counter()
+            
+        def wait(g, send_time):
+            nonlocal wait_time, hidden_time
+            t0 = perf_counter()
+            results = self.env[g].step_wait()
+            t1 = perf_counter()
+            wait_time += t1 - t0
+            hidden_time += t0 - send_time
+            return results
+            
+        if self.env[0].reset_ahead:
+            # Time step counter for each environment, the transitions delivering initial observations are skipped
+            recorder = _StepRecorder(runner=self, buffer=buffer)
+            # Global index of first environment in each group
+            offset = [0, self.env[0].num_env]
+            group = [list(range(self.env[0].num_env)), list(range(self.env[0].num_env, self.num_env))]
+            # Observation for each environment, copied because they might be views of shared memory
+            for g in range(2):
+                if isinstance(self.obs_buffer[g], np.ndarray):
+                    self.obs_buffer[g] = self.obs_buffer[g].copy()
+                self.obs_buffer[g] = list(self.obs_buffer[g])
+            # Global indices, observations, actions, outputs of the agent and send time for the steps in flight
+            in_flight = [None, None]
+            
+            def send(g):
+                # Only step the environments which still need more transitions
+                index = recorder.unfinished(group[g])
+                if in_flight[g] is not None or len(index) == 0:
+                    return None
+                local = [i - offset[g] for i in index]
+                obs = [self.obs_buffer[g][k] for k in local]
+                [output_agent, raw_action, state_value], send_time = infer_and_send(g, local)
+                in_flight[g] = [index, obs, raw_action, recorder.select(output_agent, state_value), send_time]
+                
+            def receive(g):
+                if in_flight[g] is None:
+                    return None
+                index, obs, raw_action, output, send_time = in_flight[g]
+                in_flight[g] = None
+                obs_next, reward, done, info = wait(g, send_time)
+                recorder.record(index, obs, raw_action, output, obs_next, reward, done, info)
+                for i, next_obs in zip(index, self._get_next_obs(obs_next, done, info)):
+                    self.obs_buffer[g][i - offset[g]] = next_obs
+                
+            send(0)
+            # The environments in flight are not finished yet, so the loop ends when nothing is in flight
+            while not recorder.is_finished():
+                send(1)
+                receive(0)
+                send(0)
+                receive(1)
+            recorder.finalize()
+            has_state_value = recorder.has_state_value
+        else:
+            # Actions of group A are in flight before each time step
+            out_A, send_A = infer_and_send(0)
+            for t in range(T):
+                out_B, send_B = infer_and_send(1)
+                results_A = wait(0, send_A)
+                obs_A = self.obs_buffer[0]
+                self.obs_buffer[0] = self._get_next_obs(results_A[0], results_A[2], results_A[3])
+                if t < T - 1:  # the final actions are sent in the next call
+                    next_out_A, send_A = infer_and_send(0)
+                results_B = wait(1, send_B)
+                obs_B = self.obs_buffer[1]
+                self.obs_buffer[1] = self._get_next_obs(results_B[0], results_B[2], results_B[3])
+                
+                # Write batched transitions for both groups into the buffer in place
+                output_agent, raw_action, state_value = [self._concat(x, y) for x, y in zip(out_A, out_B)]
+                obs_next, reward, done, info = [self._concat(x, y) for x, y in zip(results_A, results_B)]
+                self._add_step(buffer, t, self._concat(obs_A, obs_B), raw_action, state_value, output_agent, obs_next, reward, done)
+                
+                if t < T - 1:
+                    out_A = next_out_A
+            has_state_value = state_value is not None
+                    
+        # Call agent again to compute state value for final observation in collected segment
+        if has_state_value:
+            with torch.set_grad_enabled(not self.no_grad):
+                V_s_next = self.agent.choose_action(self._concat(*self.obs_buffer))['state_value']
+            # Add V_s_next to final transitions in each segment
+            buffer.add_final_info(name='V_s_next', value=V_s_next)
+            
+        # Timing statistics per time step
+        self.timing = {'inference': inference_time/T,
+                       'wait': wait_time/T,
+                       'hidden': hidden_time/T,
+                       'total': (perf_counter() - start_time)/T}
+                       
+        # Segment-compatible view for each environment
+        D = buffer.segments(gamma=self.gamma)
+        # Record whether the data is collected without computation graph
+        for segment in D:
+            segment.add_info('no_grad', self.no_grad)
+        
+        return D
+        
+    def _concat(self, x, y):
+        """
+        Concatenate batched data from two groups, i.e. Tensor, ndarray, dictionary or list.
+        """
+        if x is None:
+            return None
+        elif torch.is_tensor(x):
+            return torch.cat([x, y])
+        elif isinstance(x, np.ndarray) or isinstance(y, np.ndarray):
+            return np.concatenate([x, y])
+        elif isinstance(x, dict):
+            return {key: self._concat(x[key], y[key]) for key in x}
+        else:
+            return list(x) + list(y)
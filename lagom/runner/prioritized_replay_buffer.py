@@ -0,0 +1,111 @@
+import numpy as np
+
+import torch
+
+from .replay_buffer import ReplayBuffer
+from .segment_tree import SumTree
+from .segment_tree import MinTree
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    Prioritized experience replay with proportional prioritization.
+    https://arxiv.org/abs/1511.05952
+    
+    Each transition is sampled with probability P(i) = p_i^alpha / sum_k p_k^alpha, where the priority
+    p_i = |TD error| + eps. A sum-tree is used for sampling and a min-tree for the maximum importance
+    sampling weight, so both sampling and updating priorities cost O(log n) and are vectorized over
+    the batch.
+    
+    New transitions are added with the maximum priority so far, so they are sampled at least once.
+    
+    Examples:
+    
+        replay = PrioritizedReplayBuffer(env_spec=env_spec, capacity=1000000, alpha=0.6)
+        replay.add_segments(D)
+        
+        batch = replay.sample(batch_size=64, beta=0.4)
+        ...
+        replay.update_priorities(batch['index'], td_errors)
+    """
+    def __init__(self, env_spec, capacity, alpha=0.6, eps=1e-6, memmap_dir=None, device=None):
+        """
+        Args:
+            env_spec (EnvSpec): environment specification
+            capacity (int): maximum number of transitions to store
+            alpha (float): how much prioritization is used, 0.0 means uniform sampling
+            eps (float): small constant added to priorities, to avoid zero probability
+            memmap_dir (str, optional): if not None, all arrays are memory-mapped files in this directory.
+                Default: None, i.e. in-memory arrays.
+            device (torch.device, optional): device of the sampled tensors. Default: None, i.e. CPU.
+        """
+        super().__init__(env_spec=env_spec, capacity=capacity, memmap_dir=memmap_dir, device=device)
+        
+        self.alpha = alpha
+        self.eps = eps
+        
+        self.sum_tree = SumTree(capacity=self.capacity)
+        self.min_tree = MinTree(capacity=self.capacity)
+        self.max_priority = 1.0
+        
+    def add(self, s, a, r, s_next, done):
+        index = super().add(s=s, a=a, r=r, s_next=s_next, done=done)
+        
+        # New transitions with maximum priority
+        self.sum_tree[index] = self.max_priority**self.alpha
+        self.min_tree[index] = self.max_priority**self.alpha
+        
+        return index
+        
+    def sample(self, batch_size, beta=0.4):
+        """
+        Sample a minibatch of transitions with stratified sampling proportional to the priorities.
+        
+        The range [0, sum of priorities) is divided into `batch_size` equal strata and one transition is
+        sampled from each stratum.
+        
+        Args:
+            batch_size (int): number of transitions to sample
+            beta (float): how much importance sampling is used to correct the bias, 1.0 means full compensation
+            
+        Returns:
+            batch (dict): dictionary of Tensor, see `ReplayBuffer.get()` for details. An additional key
+                'weight' for the importance sampling weights normalized by the maximum weight.
+        """
+        assert self.size > 0, 'Cannot sample from an empty buffer. '
+        total = self.sum_tree.sum()
+        
+        # Stratified sampling of prefix sums
+        prefixsum = (np.arange(batch_size) + np.random.uniform(size=batch_size))*total/batch_size
+        index = self.sum_tree.find_prefixsum_index(prefixsum)
+        # Avoid numerical error beyond the stored transitions
+        index = np.minimum(index, self.size - 1)
+        
+        # Importance sampling weights, normalized by the maximum weight i.e. minimum probability
+        probs = self.sum_tree[index]/total
+        min_prob = self.min_tree.min()/total
+        weights = (probs/min_prob)**(-beta)
+        
+        batch = self.get(index)
+        batch['weight'] = self._to_tensor(weights, torch.float32)
+        
+        return batch
+        
+    def update_priorities(self, index, td_errors):
+        """
+        Update the priorities of the transitions with their new TD errors.
+        
+        Args:
+            index (ndarray): indices of transitions, e.g. batch['index'] from `sample()`
+            td_errors (list/ndarray/Tensor): TD errors with same length as index, e.g. `Segment.all_TD`
+        """
+        if torch.is_tensor(td_errors):
+            td_errors = td_errors.detach().cpu().numpy()
+        priorities = np.abs(np.asarray(td_errors, dtype=np.float64)).reshape(-1) + self.eps
+        index = np.asarray(index).reshape(-1)
+        assert priorities.shape == index.shape, 'The number of TD errors should be the same as indices. '
+        
+        self.sum_tree[index] = priorities**self.alpha
+        self.min_tree[index] = priorities**self.alpha
+        
+        self.max_priority = max(self.max_priority, priorities.max())
@@ -0,0 +1,217 @@
+from pathlib import Path
+
+import numpy as np
+
+import torch
+
+from .rollout_buffer import get_shape_dtype
+from .rollout_buffer import RolloutSegment
+
+
+class ReplayBuffer(object):
+    """
+    Fixed-capacity circular replay buffer for off-policy learning.
+    
+    Each field (state, action, reward, next state, done) is stored in one contiguous array with
+    shape [capacity, ...], shapes and dtypes are taken from the environment specification.
+    Inserting a transition is O(1), the oldest transitions are overwritten once the buffer is full.
+    
+    Optionally, the arrays can be backed by memory-mapped files (np.memmap) via `memmap_dir`, so the
+    capacity can exceed the available RAM.
+    
+    Batched transitions can be added directly from VecEnv step results, or from the list of segments
+    returned by SegmentRunner, without creating Transition objects.
+    
+    Examples:
+    
+        replay = ReplayBuffer(env_spec=env_spec, capacity=1000000)
+        
+        obs = env.reset()
+        for t in range(T):
+            ...
+            obs_next, reward, done, info = env.step(action)
+            replay.add(s=obs, a=action, r=reward, s_next=obs_next, done=done)
+            
+        batch = replay.sample(batch_size=64)
+        batch['s'], batch['a'], batch['r'], batch['s_next'], batch['done']
+    """
+    def __init__(self, env_spec, capacity, memmap_dir=None, device=None):
+        """
+        Args:
+            env_spec (EnvSpec): environment specification
+            capacity (int): maximum number of transitions to store
+            memmap_dir (str, optional): if not None, all arrays are memory-mapped files in this directory.
+                Default: None, i.e. in-memory arrays.
+            device (torch.device, optional): device of the sampled tensors. Default: None, i.e. CPU.
+        """
+        self.env_spec = env_spec
+        self.capacity = capacity
+        self.memmap_dir = memmap_dir
+        self.device = device
+        
+        obs_shape, obs_dtype = get_shape_dtype(self.env_spec.observation_space)
+        action_shape, action_dtype = get_shape_dtype(self.env_spec.action_space)
+        
+        self.s = self._make_array('s', [self.capacity, *obs_shape], obs_dtype)
+        self.a = self._make_array('a', [self.capacity, *action_shape], action_dtype)
+        self.r = self._make_array('r', [self.capacity], np.float32)
+        self.s_next = self._make_array('s_next', [self.capacity, *obs_shape], obs_dtype)
+        self.done = self._make_array('done', [self.capacity], bool)
+        
+        # Position for next insertion and current number of transitions
+        self.pointer = 0
+        self.size = 0
+        
+    def _make_array(self, name, shape, dtype):
+        """
+        Create an array filled with zeros, either in memory or memory-mapped to a file.
+        """
+        if self.memmap_dir is None:
+            return np.zeros(shape, dtype=dtype)
+        else:
+            assert dtype != object, 'Memory-mapped storage does not support non-array spaces. '
+            path = Path(self.memmap_dir)
+            path.mkdir(parents=True, exist_ok=True)
+            return np.memmap(path / f'{name}.dat', mode='w+', dtype=dtype, shape=tuple(shape))
+            
+    def __len__(self):
+        return self.size
+        
+    def add(self, s, a, r, s_next, done):
+        """
+        Add a batch of transitions, e.g. results of one step in VecEnv.
+        
+        Args:
+            s (object): batched states
+            a (object): batched actions
+            r (object): batched rewards
+            s_next (object): batched next states
+            done (object): batched dones
+            
+        Returns:
+            index (ndarray): indices of the added transitions in the buffer
+        """
+        r = np.asarray(r, dtype=np.float32)
+        n = r.shape[0]
+        assert n <= self.capacity, f'Cannot add {n} transitions to a buffer with capacity {self.capacity}. '
+        
+        # Indices wrapped around the circular buffer
+        index = (self.pointer + np.arange(n)) % self.capacity
+        
+        self.s[index] = self._to_array(s, self.s.dtype)
+        self.a[index] = self._to_array(a, self.a.dtype)
+        self.r[index] = r
+        self.s_next[index] = self._to_array(s_next, self.s_next.dtype)
+        self.done[index] = done
+        
+        self.pointer = (self.pointer + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+        
+        return index
+        
+    def _to_array(self, x, dtype):
+        """
+        Convert a list of items to an ndarray, non-array items are kept as a 1-dim object array.
+        """
+        if dtype == object:
+            out = np.empty(len(x), dtype=object)
+            out[:] = list(x)
+            return out
+        else:
+            return np.asarray(x, dtype=dtype)
+            
+    def add_segments(self, D):
+        """
+        Add all transitions in a list of segments, e.g. returned from SegmentRunner.
+        
+        If all segments are views of a single RolloutBuffer, then the arrays of the buffer are copied
+        directly without creating Transition objects.
+        
+        Args:
+            D (list of Segment): list of segments
+            
+        Returns:
+            index (ndarray): indices of the added transitions in the buffer
+        """
+        if all(isinstance(segment, RolloutSegment) and segment.buffer is D[0].buffer for segment in D):
+            buffer = D[0].buffer
+            # Select environments in the buffer, with shape [T, N, ...]
+            env_index = [segment.index for segment in D]
+            
+            def flatten(x):
+                x = x[:, env_index]
+                return x.reshape(-1, *x.shape[2:])
+                
+            return self.add(s=flatten(buffer.s),
+                            a=flatten(buffer.a),
+                            r=flatten(buffer.r),
+                            s_next=flatten(buffer.s_next),
+                            done=flatten(buffer.done))
+        else:
+            index = []
+            for segment in D:
+                transitions = list(segment.transitions)
+                index.append(self.add(s=[transition.s for transition in transitions],
+                                      a=[transition.a for transition in transitions],
+                                      r=[transition.r for transition in transitions],
+                                      s_next=[transition.s_next for transition in transitions],
+                                      done=[transition.done for transition in transitions]))
+            return np.concatenate(index)
+            
+    def get(self, index):
+        """
+        Return the transitions with given indices as a dictionary of Tensor.
+        
+        Note that the states and rewards are converted to float Tensor, the dones to float Tensor with
+        value either 0.0 or 1.0 i.e. ready to use as masks. Discrete actions are converted to long Tensor. 
+        Non-array items are returned as ndarray.
+        
+        Args:
+            index (ndarray): indices of transitions
+            
+        Returns:
+            batch (dict): dictionary with keys ['s', 'a', 'r', 's_next', 'done', 'index']
+        """
+        batch = {}
+        batch['s'] = self._to_tensor(self.s[index], torch.float32)
+        batch['a'] = self._to_tensor(self.a[index])
+        batch['r'] = self._to_tensor(self.r[index], torch.float32)
+        batch['s_next'] = self._to_tensor(self.s_next[index], torch.float32)
+        batch['done'] = self._to_tensor(self.done[index], torch.float32)
+        batch['index'] = index
+        
+        return batch
+        
+    def _to_tensor(self, x, dtype=None):
+        """
+        Convert an ndarray to Tensor with given dtype. If dtype is None, then integer arrays are
+        converted to long Tensor (e.g. discrete actions) and floating arrays keep their dtype. 
+        """
+        if x.dtype == object:
+            return x
+            
+        x = torch.from_numpy(np.ascontiguousarray(x))
+        if dtype is not None:
+            x = x.to(dtype)
+        elif not x.is_floating_point():
+            x = x.long()
+            
+        if self.device is not None:
+            x = x.to(self.device)
+            
+        return x
+        
+    def sample(self, batch_size):
+        """
+        Uniformly sample a minibatch of transitions.
+        
+        Args:
+            batch_size (int): number of transitions to sample
+            
+        Returns:
+            batch (dict): dictionary of Tensor, see `get()` for details
+        """
+        assert self.size > 0, 'Cannot sample from an empty buffer. '
+        index = np.random.randint(0, self.size, size=batch_size)
+        
+        return self.get(index)
@@ -0,0 +1,295 @@
+import numpy as np
+
+from lagom.envs.spaces import Box
+from lagom.envs.spaces import Discrete
+
+from .transition import Transition
+from .segment import Segment
+from .cache import cached
+
+
+def get_shape_dtype(space):
+    """
+    Return the shape and dtype of an element in the space.
+    
+    Non-array spaces (e.g. Dict, Product) are stored as object dtype.
+    
+    Args:
+        space (Space): observation or action space
+        
+    Returns:
+        shape (tuple): shape of an element
+        dtype (dtype): dtype of an element
+    """
+    if isinstance(space, Box):
+        return space.shape, space.dtype
+    elif isinstance(space, Discrete):
+        return (), space.dtype
+    else:
+        return (), object
+
+
+class RolloutBuffer(object):
+    """
+    Columnar storage of a batched rollout collected from a VecEnv.
+    
+    All arrays are preallocated once with shape [T, num_env, ...] according to the observation and
+    action spaces in the environment specification, and each time step is written in place. This
+    avoids creating one Transition object for each environment at each time step.
+    
+    Additional information (e.g. state values, log-probabilities of actions) is stored as a list
+    with one batched item per time step, so that Tensor dtype can be kept for backprop.
+    
+    Each observation is stored only once. The observations are kept in a single timeline `obs` with
+    shape [T + 1, num_env, ...], where obs[t] is the state at time step t and obs[T] is the final next
+    state. Because VecEnv automatically resets the environment when done=True, the terminal observation
+    is not the state at next time step, so it is stored separately in `terminal_obs` only at done
+    boundaries. The states and next states are derived by indexing, see `s` and `s_next`. 
+    
+    A Segment-compatible view for each environment can be obtained via `segments()`.
+    
+    Examples:
+    
+        buffer = RolloutBuffer(env_spec=env_spec, T=5, num_env=3)
+        for t in range(5):
+            ...
+            buffer.add(t, s=obs, a=action, r=reward, s_next=obs_next, done=done)
+            buffer.add_info(t, name='V_s', value=state_value)
+        D = buffer.segments(gamma=0.99)
+    """
+    def __init__(self, env_spec, T, num_env):
+        """
+        Args:
+            env_spec (EnvSpec): environment specification
+            T (int): number of time steps
+            num_env (int): number of environments
+        """
+        self.env_spec = env_spec
+        self.T = T
+        self.num_env = num_env
+        
+        obs_shape, obs_dtype = get_shape_dtype(self.env_spec.observation_space)
+        action_shape, action_dtype = get_shape_dtype(self.env_spec.action_space)
+        
+        self.obs = np.zeros([self.T + 1, self.num_env, *obs_shape], dtype=obs_dtype)
+        self.a = np.zeros([self.T, self.num_env, *action_shape], dtype=action_dtype)
+        self.r = np.zeros([self.T, self.num_env], dtype=np.float32)
+        self.done = np.zeros([self.T, self.num_env], dtype=bool)
+        
+        # Terminal observations only for done=True, with key (t, i) for time step t and environment i
+        self.terminal_obs = {}
+        
+        # Batched additional information for each time step, e.g. 'V_s'
+        self.info = {}
+        # Batched additional information only for the final time step, e.g. 'V_s_next'
+        self.final_info = {}
+        
+    def add(self, t, s, a, r, s_next, done, index=None):
+        """
+        Write the batched transitions of time step t in place.
+        
+        Args:
+            t (int): time step
+            s (object): batched states
+            a (object): batched actions
+            r (object): batched rewards
+            s_next (object): batched next states
+            done (object): batched dones
+            index (list, optional): indices of environments for the batched transitions, useful when 
+                the environments are not stepped in lockstep. Default: None, i.e. all environments.
+        """
+        if index is None:
+            index = slice(None)
+        else:
+            index = np.asarray(index, dtype=np.int64)
+            
+        self.obs[t, index] = s
+        self.a[t, index] = a
+        self.r[t, index] = r
+        self.done[t, index] = done
+        
+        # Next states for done=True are terminal observations, stored separately
+        # because the state at next time step is the initial observation of a new episode
+        # Note that they are also written to the timeline, but overwritten by the next call
+        self.obs[t + 1, index] = s_next
+        for i in np.arange(self.num_env)[index][self.done[t, index]]:
+            terminal_obs = self.obs[t + 1, i]
+            if isinstance(terminal_obs, np.ndarray):  # copy because the timeline will be overwritten
+                terminal_obs = terminal_obs.copy()
+            self.terminal_obs[(t, i)] = terminal_obs
+            
+    @property
+    def s(self):
+        """
+        Return the states with shape [T, num_env, ...], a view of the observation timeline. 
+        """
+        return self.obs[:-1]
+    
+    @property
+    def s_next(self):
+        """
+        Return the next states with shape [T, num_env, ...]. 
+        
+        Note that it creates a new array, with terminal observations for done=True. 
+        """
+        s_next = self.obs[1:].copy()
+        for (t, i), obs in self.terminal_obs.items():
+            s_next[t, i] = obs
+            
+        return s_next
+    
+    def get_s_next(self, t, i):
+        """
+        Return the next state at time step t in environment i. 
+        
+        Args:
+            t (int): time step
+            i (int): index of the environment
+            
+        Returns:
+            s_next (object): next state
+        """
+        if self.done[t, i]:
+            return self.terminal_obs[(t, i)]
+        else:
+            return self.obs[t + 1, i]
+        
+    def add_info(self, t, name, value):
+        """
+        Add batched additional information for time step t.
+        
+        Args:
+            t (int): time step
+            name (str): name of the information
+            value (object): batched value of the information
+        """
+        if name not in self.info:
+            self.info[name] = [None]*self.T
+        self.info[name][t] = value
+        
+    def add_final_info(self, name, value):
+        """
+        Add batched additional information for the final time step, e.g. 'V_s_next'
+        
+        Args:
+            name (str): name of the information
+            value (object): batched value of the information
+        """
+        self.final_info[name] = value
+        
+    def segments(self, gamma):
+        """
+        Return a list of Segment-compatible views, one for each environment.
+        
+        Args:
+            gamma (float): discounted factor
+            
+        Returns:
+            D (list of RolloutSegment): list of segments
+        """
+        return [RolloutSegment(buffer=self, index=i, gamma=gamma) for i in range(self.num_env)]
+        
+
+class _TransitionSequence(object):
+    """
+    Lazy sequence of Transition objects for one environment in a RolloutBuffer.
+    
+    Each Transition is only created when it is accessed, so code relying on `Segment.transitions`
+    still works without paying the cost for all time steps.
+    """
+    def __init__(self, buffer, index):
+        self.buffer = buffer
+        self.index = index
+        
+    def __len__(self):
+        return self.buffer.T
+        
+    def __getitem__(self, t):
+        if isinstance(t, slice):
+            return [self[i] for i in range(*t.indices(len(self)))]
+            
+        if t < 0:
+            t += len(self)
+        if t < 0 or t >= len(self):
+            raise IndexError('transition index out of range')
+            
+        i = self.index
+        transition = Transition(s=self.buffer.obs[t, i],
+                                a=self.buffer.a[t, i],
+                                r=self.buffer.r[t, i],
+                                s_next=self.buffer.get_s_next(t, i),
+                                done=self.buffer.done[t, i])
+        for key, val in self.buffer.info.items():
+            transition.add_info(key, val[t][i])
+        if t == len(self) - 1:
+            for key, val in self.buffer.final_info.items():
+                transition.add_info(key, val[i])
+                
+        return transition
+        
+    def __iter__(self):
+        return (self[t] for t in range(len(self)))
+        
+
+class RolloutSegment(Segment):
+    """
+    Segment-compatible view of one environment in a RolloutBuffer.
+    
+    All data are read directly from the columns of the buffer without copying them into
+    Transition objects. It is read-only, i.e. `add_transition` is not supported.
+    """
+    def __init__(self, buffer, index, gamma):
+        """
+        Args:
+            buffer (RolloutBuffer): rollout buffer
+            index (int): index of the environment in the buffer
+            gamma (float): discounted factor
+        """
+        super().__init__(gamma=gamma)
+        
+        self.buffer = buffer
+        self.index = index
+        
+        self.transitions = _TransitionSequence(buffer=self.buffer, index=self.index)
+        
+    def add_transition(self, transition):
+        raise TypeError('RolloutSegment is a read-only view of RolloutBuffer. ')
+        
+    @property
+    def T(self):
+        return self.buffer.T
+        
+    @property
+    @cached
+    def all_s(self):
+        obs = self.buffer.obs[:, self.index]
+        
+        all_s = []
+        start = 0
+        # Record the states until each done=True, followed by its terminal observation
+        for t in np.where(self.buffer.done[:, self.index])[0]:
+            all_s.extend(obs[start:t+1])
+            all_s.append(self.buffer.terminal_obs[(t, self.index)])
+            start = t + 1
+        # Record the remaining states and the final next state
+        if start < self.T:
+            all_s.extend(obs[start:self.T])
+            all_s.append(obs[self.T])
+            
+        return all_s
+        
+    @property
+    def all_a(self):
+        return list(self.buffer.a[:, self.index])
+        
+    @property
+    def all_r(self):
+        return self.buffer.r[:, self.index].tolist()
+        
+    @property
+    def all_done(self):
+        return self.buffer.done[:, self.index].tolist()
+        
+    @cached
+    def all_info(self, name):
+        return [val[self.index] for val in self.buffer.info[name]]
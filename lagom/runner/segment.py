@@ -4,6 +4,8 @@ import numpy as np
 
 from lagom.core.transform import ExpFactorCumSum
 
+from .cache import cached
+
 
 class Segment(object):
     """
@@ -24,6 +26,11 @@ class Segment(object):
     
     Some common properties for such transitions are provided as class method. 
     i.e. all states, all actions, all state values, all TD errors etc. 
+    
+    Note that all these derived quantities are cached once computed, and the cache is cleared
+    each time the segment is modified via `add_transition` or `add_info`. The counters `cache_hits`
+    and `cache_misses` record how often the cache is used. The returned lists are the cached ones, 
+    so they are read-only, make a copy before modifying them. 
     """
     def __init__(self, gamma):
         """
@@ -35,6 +42,11 @@ class Segment(object):
         self.transitions = []
         self.info = {}  # some information about the segment
         
+        # Cache of derived quantities, e.g. all_s, all_TD
+        self._cache = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        
     def add_transition(self, transition):
         """
         Add a new transition to append in the segment
@@ -44,6 +56,9 @@ class Segment(object):
         """
         self.transitions.append(transition)
         
+        # Clear cache, derived quantities should be recomputed
+        self.clear_cache()
+        
     def add_info(self, name, value):
         """
         Add additional information for the segment
@@ -54,7 +69,20 @@ class Segment(object):
         """
         self.info[name] = value
         
+        # Clear cache, derived quantities should be recomputed
+        self.clear_cache()
+        
+    def clear_cache(self):
+        """
+        Clear all cached derived quantities. 
+        
+        Note that it should be called manually if a contained transition is modified in place, 
+        e.g. adding information to the final transition after it is added to the segment. 
+        """
+        self._cache.clear()
+        
     @property
+    @cached
     def split_transitions(self):
         """
         Return a list of splitted transitions for different episodes contained in the segment. 
@@ -87,6 +115,7 @@ class Segment(object):
         return len(self.transitions)
     
     @property
+    @cached
     def T_split(self):
         """
         Return a list of length of transitions in splitted segment. 
@@ -98,6 +127,7 @@ class Segment(object):
         return T_split
     
     @property
+    @cached
     def all_s(self):
         """
         Return a list of all states in the segment. 
@@ -123,6 +153,7 @@ class Segment(object):
         return all_s
     
     @property
+    @cached
     def all_s_split(self):
         """
         Return a list of splitted episodic states. Each contain successive states from each episode. 
@@ -144,6 +175,7 @@ class Segment(object):
         return all_s_split
 
     @property
+    @cached
     def all_a(self):
         """
         Return a list of all actions in the segment. 
@@ -151,6 +183,7 @@ class Segment(object):
         return [transition.a for transition in self.transitions]
     
     @property
+    @cached
     def all_r(self):
         """
         Return a list of all rewards in the segment. 
@@ -158,6 +191,7 @@ class Segment(object):
         return [transition.r for transition in self.transitions]
     
     @property
+    @cached
     def all_done(self):
         """
         Return a list of all dones in the segment. 
@@ -165,6 +199,7 @@ class Segment(object):
         return [transition.done for transition in self.transitions]
     
     @property
+    @cached
     def all_returns(self):
         r"""
         Return a list of returns (no discount, gamma=1.0) for all time steps. 
@@ -184,6 +219,7 @@ class Segment(object):
         return self._compute_all_returns(use_discount=False)
     
     @property
+    @cached
     def all_discounted_returns(self):
         """
         Return a list of discounted returns for all time steps. 
@@ -208,16 +244,17 @@ class Segment(object):
         Args:
             use_discount (bool): Whether to use discount factor
         """
-        mask = np.logical_not(self.all_done).astype(int).tolist()
+        mask = np.logical_not(self.all_done).astype(np.float32)
         
         if use_discount:
             gamma = self.gamma
         else:
             gamma = 1.0
             
-        return ExpFactorCumSum(gamma)(self.all_r, mask=mask)
+        return ExpFactorCumSum(gamma)(self.all_r, mask=mask).tolist()
     
     @property
+    @cached
     def all_bootstrapped_returns(self):
         r"""
         Return a list of boostrapped returns (no discount, gamma=1.0) for all time steps. 
@@ -237,6 +274,7 @@ class Segment(object):
         return self._compute_bootstrapped_returns(use_discount=False)
     
     @property
+    @cached
     def all_bootstrapped_discounted_returns(self):
         r"""
         Return a list of boostrapped discounted returns for all time steps. 
@@ -293,10 +331,10 @@ class Segment(object):
             gamma = self.gamma
         else:
             gamma = 1.0
-        G = ExpFactorCumSum(gamma)(all_r, mask=mask.tolist())
+        G = ExpFactorCumSum(gamma)(all_r, mask=mask)
         
         # Remove the augmented values
-        delete_idx = dones_idx + np.arange(1, len(dones_idx)+1, dtype=np.float32)
+        delete_idx = dones_idx + np.arange(1, len(dones_idx)+1)
         G = np.delete(G, delete_idx)
         # Remove the final one
         G = np.delete(G, -1)
@@ -304,6 +342,7 @@ class Segment(object):
         return G.astype(np.float32).tolist()
     
     @property
+    @cached
     def all_V(self):
         """
         Return a list of all state values, from first to last state in an episode. 
@@ -345,6 +384,7 @@ class Segment(object):
         return all_V
     
     @property
+    @cached
     def all_TD(self):
         r"""
         Return a list of TD errors for all time steps. 
@@ -400,23 +440,36 @@ class Segment(object):
         
         # Remove the augmented computation for intermediate done=True (except for final transition)
         # Note dones_idx can be empty
-        delete_idx = dones_idx + np.arange(1, len(dones_idx)+1, dtype=np.float32)
+        delete_idx = dones_idx + np.arange(1, len(dones_idx)+1)
         all_TD = np.delete(all_TD, delete_idx)
         
         return all_TD.astype(np.float32).tolist()
 
+    @cached
     def all_gae(self, gae_lambda):
-        """
+        r"""
         Return a list of GAE. 
         https://arxiv.org/abs/1506.02438
         
+        It is computed by accumulating TD errors with exponential factor \gamma\lambda, i.e.
+        A_t = \sum_{i=t}^{T} (\gamma\lambda)^{i - t} \delta_i
+        
+        Note that it is okay when the history is a segment with transitions from several
+        episodes, in other words, some done is True for intermediate time steps and
+        transitions for new episode follows afterwards. 
+        
+        This can be generally computed by using a binary mask. Set one for `done=False`
+        and set zero for `done=True`. Thus each time reaching a zero value, the GAE
+        will be recalculated from that time step on. 
+        
         Args:
             gae_lambda (float): GAE lambda, in range [0, 1]
-        
-        TODO: remaining work. 
         """
-        raise NotImplementedError
+        mask = np.logical_not(self.all_done).astype(np.float32)
+        
+        return ExpFactorCumSum(self.gamma*gae_lambda)(self.all_TD, mask=mask).tolist()
         
+    @cached
     def all_info(self, name):
         """
         Return specified information for all transitions
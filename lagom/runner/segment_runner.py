@@ -1,8 +1,10 @@
+import numpy as np
+
 import torch
 
-from lagom.runner import Transition
-from lagom.runner import Segment
+from lagom.runner import RolloutBuffer
 
+from lagom.envs import EnvSpec
 from lagom.envs.vec_env import VecEnv
 
 
@@ -39,16 +41,39 @@ class SegmentRunner(object):
     In order to make such data collection possible, the environment must be of type VecEnv to support 
     batched data. VecEnv will continuously collect data in all environment, for each occurrence of 
     `done=True`, the environment will be automatically reset and continue. So if we want to collect data
-    from initial observation in all environments, the method `reset` should be called. 
+    from initial observation in all environments, the method `reset` should be called. For VecEnv with 
+    `reset_ahead=True`, the step delivering the initial observation is skipped for that environment, so 
+    each environment keeps its own time step counter, and only the environments with less than `T` 
+    transitions are stepped via `step_async(actions, indices)`, see `_StepRecorder` for details. 
     
     The SegmentRunner is very general, for runner that only collects transitions from a single 
     episode (start from initial observation) one can use TrajectoryRunner instead. 
+    
+    Note that the collected data is written in place into a preallocated RolloutBuffer with 
+    shape [T, num_env, ...] rather than creating one Transition object per environment per time step. 
+    Each returned Segment is a read-only view of one environment in the buffer, i.e. RolloutSegment. 
+    
+    If `no_grad=True`, the agent selects actions under `torch.no_grad()` and only the raw observations
+    and actions (together with the unconstrained actions if provided by the policy) are stored, i.e. no 
+    computation graph is kept alive during data collection. The agent should then re-evaluate the 
+    log-probabilities, entropies and state values of all time steps in a single batched forward pass 
+    in its `learn` method. Each collected segment records the flag in `info['no_grad']`. Note that the 
+    state values of the final observations are still recorded as 'V_s_next' but without computation graph. 
     """
-    def __init__(self, agent, env, gamma):
+    def __init__(self, agent, env, gamma, no_grad=False):
+        """
+        Args:
+            agent (BaseAgent): agent
+            env (VecEnv): vectorized environment
+            gamma (float): discount factor
+            no_grad (bool): If True, collect data without computation graph. Default: False
+        """
         self.agent = agent
         self.env = env
         assert isinstance(self.env, VecEnv), 'The environment must be of type VecEnv. '
+        self.env_spec = EnvSpec(self.env)
         self.gamma = gamma
+        self.no_grad = no_grad
         
         # Buffer for observation (continuous with next call)
         self.obs_buffer = None
@@ -69,67 +94,241 @@ class SegmentRunner(object):
             reset (bool): Whether to reset all environments (in VecEnv). 
             
         Returns:
-            D (list of Segment): list of collected segments. 
+            D (list of RolloutSegment): list of collected segments. 
         """ 
-        # Initialize all Segment for each environment
-        D = [Segment(gamma=self.gamma) for _ in range(self.env.num_env)]
+        # Preallocate a rollout buffer for all environments
+        buffer = RolloutBuffer(env_spec=self.env_spec, T=T, num_env=self.env.num_env)
         
         # Reset the environment and returns initial state if reset=True or first time call
         if self.obs_buffer is None or reset:
             self.obs_buffer = self.env.reset()
             
-        # Iterate over the number of time steps
-        for t in range(T):
-            # Action selection by the agent
-            output_agent = self.agent.choose_action(self.obs_buffer)
-            
-            # Unpack action from output. 
-            # We record Tensor dtype for backprop (propagate via Transitions)
-            action = output_agent.pop('action')  # pop-out
-            state_value = output_agent.pop('state_value', None)
-            
-            # Obtain raw action from Tensor for environment to execute
-            if torch.is_tensor(action):
-                raw_action = action.detach().cpu().numpy()
-                raw_action = list(raw_action)
-            else:
-                raw_action = action
-            # Execute the action
-            obs_next, reward, done, info = self.env.step(raw_action)
-            
-            # Iterate over all Segments to add transitions
-            for i, segment in enumerate(D):
-                # Create and record a Transition
-                transition = Transition(s=self.obs_buffer[i], 
-                                        a=action[i], 
-                                        r=reward[i], 
-                                        s_next=obs_next[i], 
-                                        done=done[i])
-                # Record state value if required
-                if state_value is not None:
-                    transition.add_info('V_s', state_value[i])
-                # Record additional information from output_agent
-                # Note that 'action' and 'state_value' already poped out
-                for key, val in output_agent.items():
-                    transition.add_info(key, val[i])
-                    
-                # Add transition to Segment
-                segment.add_transition(transition)
+        if self.env.reset_ahead:
+            # Time step counter for each environment, the transitions delivering initial observations are skipped
+            recorder = _StepRecorder(runner=self, buffer=buffer)
+            # Observation for each environment, copied because they might be views of shared memory
+            if isinstance(self.obs_buffer, np.ndarray):
+                self.obs_buffer = self.obs_buffer.copy()
+            self.obs_buffer = list(self.obs_buffer)
+            while not recorder.is_finished():
+                # Only step the environments which still need more transitions
+                index = recorder.unfinished()
+                obs = [self.obs_buffer[i] for i in index]
+                output_agent, raw_action, state_value = self._choose_action(obs)
+                self.env.step_async(raw_action, indices=index)
+                obs_next, reward, done, info = self.env.step_wait()
+                recorder.record(index, obs, raw_action, recorder.select(output_agent, state_value), 
+                                obs_next, reward, done, info)
+                for i, next_obs in zip(index, self._get_next_obs(obs_next, done, info)):
+                    self.obs_buffer[i] = next_obs
+            recorder.finalize()
+            has_state_value = recorder.has_state_value
+        else:
+            # Iterate over the number of time steps
+            for t in range(T):
+                # Action selection by the agent
+                output_agent, raw_action, state_value = self._choose_action(self.obs_buffer)
+                # Execute the action
+                obs_next, reward, done, info = self.env.step(raw_action)
                 
-            # Back up obs_next in self.obs_buffer for next iteration to feed into agent
-            # Update the ones with done=True, use their info['init_observation']
-            # Because VecEnv automatically reset and continue with new episode when done=True
-            for k in range(len(D)):  # iterate over each result
-                if done[k]:  # terminated, use info['init_observation']
-                    self.obs_buffer[k] = info[k]['init_observation']
-                else:  # non-terminal, continue with obs_next
-                    self.obs_buffer[k] = obs_next[k]
+                # Write batched transitions into the buffer in place
+                self._add_step(buffer, t, self.obs_buffer, raw_action, state_value, output_agent, obs_next, reward, done)
+                
+                # Back up obs_next in self.obs_buffer for next iteration to feed into agent
+                self.obs_buffer = self._get_next_obs(obs_next, done, info)
+            has_state_value = state_value is not None
             
         # Call agent again to compute state value for final observation in collected segment
-        if state_value is not None:
-            V_s_next = self.agent.choose_action(self.obs_buffer)['state_value']
+        if has_state_value:
+            with torch.set_grad_enabled(not self.no_grad):
+                V_s_next = self.agent.choose_action(self.obs_buffer)['state_value']
             # Add V_s_next to final transitions in each segment
-            for i, segment in enumerate(D):
-                segment.transitions[-1].add_info('V_s_next', V_s_next[i])
+            buffer.add_final_info(name='V_s_next', value=V_s_next)
+            
+        # Segment-compatible view for each environment
+        D = buffer.segments(gamma=self.gamma)
+        # Record whether the data is collected without computation graph
+        for segment in D:
+            segment.add_info('no_grad', self.no_grad)
 
         return D
+    
+    def _choose_action(self, obs):
+        """
+        Batched action selection by the agent. 
+        
+        Args:
+            obs (list/ndarray): batched observations
+            
+        Returns:
+            output_agent (dict): output from the agent without 'action' and 'state_value'
+            raw_action (ndarray): batched raw actions for the environment to execute
+            state_value (object): batched state values, None if not available
+        """
+        with torch.set_grad_enabled(not self.no_grad):
+            output_agent = self.agent.choose_action(obs)
+        
+        # Unpack action from output. 
+        # We record Tensor dtype for backprop (propagate via Transitions)
+        action = output_agent.pop('action')  # pop-out
+        state_value = output_agent.pop('state_value', None)
+        
+        # Obtain raw action from Tensor for environment to execute, batched ndarray without splitting
+        if torch.is_tensor(action):
+            raw_action = action.detach().cpu().numpy()
+        else:
+            raw_action = action
+            
+        return output_agent, raw_action, state_value
+    
+    def _add_step(self, buffer, t, obs, raw_action, state_value, output_agent, obs_next, reward, done):
+        """
+        Write batched transitions and additional information of time step t into the buffer. 
+        """
+        buffer.add(t, s=obs, a=raw_action, r=reward, s_next=obs_next, done=done)
+        if self.no_grad:
+            # Only record unconstrained action if available, all others are re-evaluated by the agent
+            if 'unconstrained_action' in output_agent:
+                buffer.add_info(t, name='unconstrained_action', value=output_agent['unconstrained_action'])
+        else:
+            # Record state value if required
+            if state_value is not None:
+                buffer.add_info(t, name='V_s', value=state_value)
+            # Record additional information from output_agent
+            # Note that 'action' and 'state_value' already poped out
+            for key, val in output_agent.items():
+                buffer.add_info(t, name=key, value=val)
+                
+    def _get_next_obs(self, obs_next, done, info):
+        """
+        Return the observations for next time step to feed into agent. 
+        
+        The ones with done=True use their info['init_observation']
+        Because VecEnv automatically reset and continue with new episode when done=True
+        
+        With `reset_ahead=True`, there is no info['init_observation'] and the terminal observation is kept, 
+        because the initial observation is delivered with the next step, which ignores the action. 
+        
+        If the observations are stacked ndarray (e.g. VecEnv with `return_array=True`), then the initial 
+        observations are merged in with a single masked assignment into a new array. 
+        """
+        reset = [done[k] and 'init_observation' in info[k] for k in range(len(done))]
+        
+        if isinstance(obs_next, np.ndarray):
+            obs = obs_next.copy()
+            reset = np.asarray(reset, dtype=bool)
+            if reset.any():
+                obs[reset] = [info[k]['init_observation'] for k in np.where(reset)[0]]
+                
+            return obs
+        
+        obs = list(obs_next)
+        for k in range(len(obs)):  # iterate over each result
+            if reset[k]:  # terminated, use info['init_observation']
+                obs[k] = info[k]['init_observation']
+                
+        return obs
+        
+
+class _StepRecorder(object):
+    """
+    Write the transitions into a RolloutBuffer with a time step counter for each environment, used by 
+    AsyncSegmentRunner, and by SegmentRunner and PipelinedSegmentRunner for VecEnv with `reset_ahead=True`. 
+    
+    The environments might be stepped in different subsets, e.g. whichever environments are ready in 
+    AsyncVecEnv. With `reset_ahead=True`, the step delivering the initial observation after `done=True` 
+    (with info['reset_ahead']=True) is not a transition, so it is skipped and that environment falls 
+    behind by one time step. Only the environments in `unfinished()` should be stepped, so no step is 
+    executed beyond `T` transitions, and each environment continues from its own observation in the 
+    next call. The additional information from the agent is selected per environment and stacked for 
+    each time step in `finalize()`, so the computation graph is kept. 
+    
+    Examples:
+    
+        recorder = _StepRecorder(runner=runner, buffer=buffer)
+        while not recorder.is_finished():
+            index = recorder.unfinished()
+            output_agent, raw_action, state_value = runner._choose_action(obs)
+            obs_next, reward, done, info = ...  # step the environments in `index`
+            recorder.record(index, obs, raw_action, recorder.select(output_agent, state_value), 
+                            obs_next, reward, done, info)
+        recorder.finalize()
+    """
+    def __init__(self, runner, buffer):
+        """
+        Args:
+            runner (SegmentRunner): runner, for `no_grad`
+            buffer (RolloutBuffer): rollout buffer to write in
+        """
+        self.runner = runner
+        self.buffer = buffer
+        
+        # Time step counter for each environment
+        self.t_env = [0]*self.buffer.num_env
+        # Additional information for each time step and each environment, e.g. info['V_s'][t][i]
+        self.info = {}
+        # Whether the agent outputs state values
+        self.has_state_value = False
+        
+    def unfinished(self, index=None):
+        """
+        Return the indices of environments with less than `T` transitions. 
+        
+        Args:
+            index (list, optional): indices of environments to select from. Default: None, i.e. all environments
+        """
+        if index is None:
+            index = range(self.buffer.num_env)
+            
+        return [i for i in index if self.t_env[i] < self.buffer.T]
+        
+    def is_finished(self):
+        """
+        Whether all environments collect `T` transitions. 
+        """
+        return len(self.unfinished()) == 0
+    
+    def select(self, output_agent, state_value):
+        """
+        Select the batched information to record from the output of the agent, same as SegmentRunner. 
+        
+        Returns:
+            output (dict): batched information to record, e.g. 'V_s' and log-probabilities
+        """
+        self.has_state_value = state_value is not None
+        if self.runner.no_grad:
+            # Only record unconstrained action if available, all others are re-evaluated by the agent
+            return {key: val for key, val in output_agent.items() if key == 'unconstrained_action'}
+        elif self.has_state_value:
+            return {'V_s': state_value, **output_agent}
+        else:
+            return dict(output_agent)
+        
+    def record(self, index, obs, raw_action, output, obs_next, reward, done, info):
+        """
+        Record the batched results of one step for environments with given indices. 
+        """
+        for j, i in enumerate(index):
+            # Skip the step delivering initial observation
+            if info[j].get('reset_ahead', False):
+                continue
+                
+            # Write the transition of environment i at its own time step
+            t = self.t_env[i]
+            assert t < self.buffer.T, f'The environment {i} already collects all transitions. '
+            self.buffer.add(t, s=[obs[j]], a=[raw_action[j]], r=[reward[j]], s_next=[obs_next[j]], 
+                            done=[done[j]], index=[i])
+            for key, val in output.items():
+                self.info.setdefault(key, [[None]*self.buffer.num_env for _ in range(self.buffer.T)])[t][i] = val[j]
+            self.t_env[i] += 1
+                
+    def finalize(self):
+        """
+        Stack the additional information for each time step over all environments into the buffer. 
+        """
+        for key, val in self.info.items():
+            for t in range(self.buffer.T):
+                if torch.is_tensor(val[t][0]):
+                    self.buffer.add_info(t, name=key, value=torch.stack(val[t]))
+                else:
+                    self.buffer.add_info(t, name=key, value=val[t])
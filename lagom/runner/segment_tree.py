@@ -0,0 +1,143 @@
+import numpy as np
+
+
+class SegmentTree(object):
+    """
+    Base class of a segment tree stored in a flat array, useful for prioritized experience replay.
+    
+    The leaves store the values of each item and each internal node stores the reduction
+    (e.g. sum or minimum) of its two children, so the reduction over all items is the root node.
+    
+    All operations are vectorized over a batch of indices, updating the values costs O(log n)
+    numpy operations regardless of the batch size.
+    
+    All inherited subclasses should at least implement the following function
+    1. operation(self, x, y)
+    """
+    def __init__(self, capacity, neutral_value):
+        """
+        Args:
+            capacity (int): number of items
+            neutral_value (float): neutral element of the reduction, e.g. 0.0 for sum and inf for minimum
+        """
+        self.capacity = capacity
+        
+        # Number of leaves as the smallest power of 2 no less than capacity
+        self.num_leaf = 1
+        while self.num_leaf < self.capacity:
+            self.num_leaf *= 2
+            
+        # Root node at index 1, children of node i at index 2*i and 2*i + 1, leaves start from num_leaf
+        self.tree = np.full(2*self.num_leaf, neutral_value, dtype=np.float64)
+        
+    def operation(self, x, y):
+        """
+        Elementwise reduction of two arrays.
+        
+        Args:
+            x (ndarray): values of left children
+            y (ndarray): values of right children
+            
+        Returns:
+            out (ndarray): reduced values
+        """
+        raise NotImplementedError
+        
+    def __setitem__(self, index, value):
+        """
+        Set the values of the items and update all their ancestors level by level.
+        
+        Args:
+            index (int/list/ndarray): indices of items
+            value (float/list/ndarray): values of items
+        """
+        index = np.asarray(index, dtype=np.int64).reshape(-1)
+        assert np.all((index >= 0) & (index < self.capacity)), 'index out of range'
+        
+        # Set leaves
+        node = index + self.num_leaf
+        self.tree[node] = value
+        
+        # Update ancestors, all nodes in the same level at each iteration
+        node = np.unique(node//2)
+        while node[0] > 0:
+            self.tree[node] = self.operation(self.tree[2*node], self.tree[2*node + 1])
+            node = np.unique(node//2)
+            
+    def __getitem__(self, index):
+        """
+        Return the values of the items.
+        
+        Args:
+            index (int/list/ndarray): indices of items
+            
+        Returns:
+            value (float/ndarray): values of items
+        """
+        return self.tree[np.asarray(index) + self.num_leaf]
+        
+    def reduce(self):
+        """
+        Return the reduction over all items, i.e. the root node.
+        """
+        return self.tree[1]
+        
+
+class SumTree(SegmentTree):
+    """
+    Segment tree with sum as reduction. It supports to find the items by prefix sums,
+    i.e. sampling items proportional to their values.
+    """
+    def __init__(self, capacity):
+        super().__init__(capacity=capacity, neutral_value=0.0)
+        
+    def operation(self, x, y):
+        return x + y
+        
+    def sum(self):
+        """
+        Return the sum of all items.
+        """
+        return self.reduce()
+        
+    def find_prefixsum_index(self, prefixsum):
+        """
+        Find for each given prefix sum the smallest index i such that sum of values[:i + 1] > prefixsum.
+        
+        It descends from the root to the leaves, vectorized over all the prefix sums.
+        
+        Args:
+            prefixsum (float/list/ndarray): prefix sums, in range [0, sum())
+            
+        Returns:
+            index (ndarray): indices of items
+        """
+        prefixsum = np.array(prefixsum, dtype=np.float64).reshape(-1)
+        
+        node = np.ones(prefixsum.shape, dtype=np.int64)
+        while node[0] < self.num_leaf:  # all nodes are in the same level
+            left = 2*node
+            left_value = self.tree[left]
+            # Go to right child if prefix sum exceeds the sum of left subtree
+            go_right = prefixsum >= left_value
+            prefixsum = np.where(go_right, prefixsum - left_value, prefixsum)
+            node = np.where(go_right, left + 1, left)
+            
+        return node - self.num_leaf
+        
+
+class MinTree(SegmentTree):
+    """
+    Segment tree with minimum as reduction.
+    """
+    def __init__(self, capacity):
+        super().__init__(capacity=capacity, neutral_value=float('inf'))
+        
+    def operation(self, x, y):
+        return np.minimum(x, y)
+        
+    def min(self):
+        """
+        Return the minimum of all items.
+        """
+        return self.reduce()
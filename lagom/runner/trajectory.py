@@ -4,6 +4,8 @@ import numpy as np
 
 from lagom.core.transform import ExpFactorCumSum
 
+from .cache import cached
+
 
 class Trajectory(object):
     """
@@ -13,6 +15,11 @@ class Trajectory(object):
     Note that it is not necessarily an episode (with terminal state). But it must be a part of an episode. 
     For segment of transitions which can contains `done=True` in the middle (more than one episode data), one 
     can use Segment instead. 
+    
+    Note that all derived quantities e.g. all_s, all_TD are cached once computed, and the cache is cleared
+    each time the trajectory is modified via `add_transition` or `add_info`. The counters `cache_hits`
+    and `cache_misses` record how often the cache is used. The returned lists are the cached ones, 
+    so they are read-only, make a copy before modifying them. 
     """
     def __init__(self, gamma):
         self.gamma = gamma  # discount factor
@@ -20,6 +27,11 @@ class Trajectory(object):
         self.transitions = []
         self.info = {}
         
+        # Cache of derived quantities, e.g. all_s, all_TD
+        self._cache = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        
     def add_transition(self, transition):
         """
         Add a new transition to append in the trajectory
@@ -29,6 +41,9 @@ class Trajectory(object):
         """
         self.transitions.append(transition)
         
+        # Clear cache, derived quantities should be recomputed
+        self.clear_cache()
+        
     def add_info(self, name, value):
         """
         Add additional information for current trajectory
@@ -39,6 +54,18 @@ class Trajectory(object):
         """
         self.info[name] = value
         
+        # Clear cache, derived quantities should be recomputed
+        self.clear_cache()
+        
+    def clear_cache(self):
+        """
+        Clear all cached derived quantities. 
+        
+        Note that it should be called manually if a contained transition is modified in place, 
+        e.g. adding information to the final transition after it is added to the trajectory. 
+        """
+        self._cache.clear()
+        
     @property
     def T(self):
         """
@@ -47,6 +74,7 @@ class Trajectory(object):
         return len(self.transitions)
     
     @property
+    @cached
     def all_s(self):
         """
         Return a list of all states in the trajectory from initial state to last state. 
@@ -54,6 +82,7 @@ class Trajectory(object):
         return [transition.s for transition in self.transitions] + [self.transitions[-1].s_next]
     
     @property
+    @cached
     def all_a(self):
         """
         Return a list of all actions in the trajectory. 
@@ -61,6 +90,7 @@ class Trajectory(object):
         return [transition.a for transition in self.transitions]
     
     @property
+    @cached
     def all_r(self):
         """
         Return a list of all rewards in the trajectory. 
@@ -68,6 +98,7 @@ class Trajectory(object):
         return [transition.r for transition in self.transitions]
     
     @property
+    @cached
     def all_done(self):
         """
         Return a list of all dones in the trajectory. 
@@ -77,6 +108,7 @@ class Trajectory(object):
         return [transition.done for transition in self.transitions]
     
     @property
+    @cached
     def all_returns(self):
         r"""
         Return a list of returns (no discount, gamma=1.0) for all time steps. 
@@ -84,9 +116,10 @@ class Trajectory(object):
         Suppose we have all rewards [r_1, ..., r_T], it computes
         G_t = \sum_{i=t}^{T} r_i
         """
-        return ExpFactorCumSum(1.0)(self.all_r)
+        return ExpFactorCumSum(1.0)(self.all_r).tolist()
     
     @property
+    @cached
     def all_discounted_returns(self):
         """
         Return a list of discounted returns for all time steps. 
@@ -94,9 +127,10 @@ class Trajectory(object):
         Suppose we have all rewards [r_1, ..., r_T], it computes
         G_t = \sum_{i=t}^{T} \gamma^{i - t} r_i
         """
-        return ExpFactorCumSum(self.gamma)(self.all_r)
+        return ExpFactorCumSum(self.gamma)(self.all_r).tolist()
     
     @property
+    @cached
     def all_V(self):
         """
         Return a list of all state values, from first to last state. 
@@ -109,6 +143,7 @@ class Trajectory(object):
         return [transition.V_s for transition in self.transitions] + [self.transitions[-1].V_s_next]
     
     @property
+    @cached
     def all_TD(self):
         r"""
         Return a list of TD errors for all time steps. 
@@ -142,16 +177,21 @@ class Trajectory(object):
         
         return all_TD.astype(np.float32).tolist()
     
-    @property
+    @cached
     def all_gae(self, gae_lambda):
-        """
+        r"""
         Return a list of GAE. 
         https://arxiv.org/abs/1506.02438
         
-        TODO: remaining work. 
+        It is computed by accumulating TD errors with exponential factor \gamma\lambda, i.e.
+        A_t = \sum_{i=t}^{T} (\gamma\lambda)^{i - t} \delta_i
+        
+        Args:
+            gae_lambda (float): GAE lambda, in range [0, 1]
         """
-        raise NotImplementedError
+        return ExpFactorCumSum(self.gamma*gae_lambda)(self.all_TD).tolist()
     
+    @cached
     def all_info(self, name):
         """
         Return specified information for all transitions
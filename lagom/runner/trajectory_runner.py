@@ -31,18 +31,26 @@ class TrajectoryRunner(object):
         s_0 -> s_1 -> s_2 -> s_T
     
     For runner that collects transitions from multiple episodes, one can use SegmentRunner instead. 
+    
+    If `no_grad=True`, the agent selects actions under `torch.no_grad()` and only the raw observations
+    and actions (together with the unconstrained actions if provided by the policy) are stored, i.e. no 
+    computation graph is kept alive during data collection. The agent should then re-evaluate the 
+    log-probabilities, entropies and state values of all time steps in a single batched forward pass 
+    in its `learn` method. Each collected trajectory records the flag in `info['no_grad']`. 
     """
-    def __init__(self, agent, env, gamma):
+    def __init__(self, agent, env, gamma, no_grad=False):
         """
         Args:
             agent (BaseAgent): agent
             env (Env): environment
             gamma (float): discount factor
+            no_grad (bool): If True, collect data without computation graph. Default: False
         """
         self.agent = agent
         self.env = env
         assert not isinstance(self.env, VecEnv), 'The environment cannot be of type VecEnv. '
         self.gamma = gamma
+        self.no_grad = no_grad
         
     def __call__(self, N, T):
         """
@@ -69,7 +77,8 @@ class TrajectoryRunner(object):
                 # Action selection by the agent
                 # We wrap obs with list to make a batch dimension
                 # Not using numpy because we don't know exact dtype, all Agent should handle batched data
-                output_agent = self.agent.choose_action([obs])
+                with torch.set_grad_enabled(not self.no_grad):
+                    output_agent = self.agent.choose_action([obs])
                 
                 # Unpack action from output. 
                 # We record Tensor dtype for backprop (propagate via Transitions)
@@ -93,13 +102,18 @@ class TrajectoryRunner(object):
                                         r=reward, 
                                         s_next=obs_next, 
                                         done=done)
-                # Record state value if required
-                if state_value is not None:
-                    transition.add_info('V_s', state_value)
-                # Record additional information from output_agent
-                # Note that 'action' and 'state_value' already poped out
-                for key, val in output_agent.items():
-                    transition.add_info(key, val)
+                if self.no_grad:
+                    # Only record unconstrained action if available, all others are re-evaluated by the agent
+                    if 'unconstrained_action' in output_agent:
+                        transition.add_info('unconstrained_action', output_agent['unconstrained_action'])
+                else:
+                    # Record state value if required
+                    if state_value is not None:
+                        transition.add_info('V_s', state_value)
+                    # Record additional information from output_agent
+                    # Note that 'action' and 'state_value' already poped out
+                    for key, val in output_agent.items():
+                        transition.add_info(key, val)
                     
                 # Add transition to Trajectory
                 trajectory.add_transition(transition)
@@ -113,14 +127,19 @@ class TrajectoryRunner(object):
             
             # Call agent again to compute state value for final obsevation in collected trajectory
             if state_value is not None:
-                V_s_next = self.agent.choose_action([obs])['state_value']  # batched observation with same reason as above
+                with torch.set_grad_enabled(not self.no_grad):
+                    V_s_next = self.agent.choose_action([obs])['state_value']  # batched observation with same reason as above
                 # We do not set zero even if it is terminal state
                 # Because it should be handled in Trajectory e.g. compute TD errors
                 # Return original Tensor in general can help backprop to work properly, e.g. learning value function
                 # Add to the final transition as 'V_s_next'
                 trajectory.transitions[-1].add_info('V_s_next', V_s_next)
+                # The final transition is modified in place, so clear cached quantities of the trajectory
+                trajectory.clear_cache()
             
             # Append trajectory to data
+            # Record whether the data is collected without computation graph
+            trajectory.add_info('no_grad', self.no_grad)
             D.append(trajectory)
 
         return D
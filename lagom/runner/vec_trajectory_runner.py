@@ -0,0 +1,176 @@
+import numpy as np
+
+import torch
+
+from .transition import Transition
+from .trajectory import Trajectory
+
+from lagom.envs.vec_env import VecEnv
+
+
+class VecTrajectoryRunner(object):
+    """
+    Batched data collection for an agent in a VecEnv for a number of trajectories and a certain time steps.
+    
+    It works the same as TrajectoryRunner and returns a list of Trajectory objects, but the trajectories
+    are collected concurrently in all environments of the VecEnv, with one batched forward pass of the
+    agent for all environments at each time step.
+    
+    The trajectories are collected in rounds. In each round, all environments are reset and each of
+    the first `N` of them (at most all of them) collects one trajectory until its episode terminates or 
+    reaching the maximal time steps. Only the environments with unfinished trajectories are stepped, via 
+    `step_async` with their indices, so the finished and unused environments are not stepped at all. 
+    So it works with VecEnv with `reset_ahead=True`, and the resets of finished environments do not slow 
+    down the others. 
+    
+    Note that the agent should handle batched observations from all environments and return batched
+    outputs, e.g. with first dimension as number of environments.
+    
+    Examples:
+    
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=10, init_seed=0)
+        env = SerialVecEnv(list_make_env=list_make_env)
+        runner = VecTrajectoryRunner(agent=agent, env=env, gamma=0.99)
+        D = runner(N=10, T=500)
+    """
+    def __init__(self, agent, env, gamma, no_grad=False):
+        """
+        Args:
+            agent (BaseAgent): agent
+            env (VecEnv): vectorized environment
+            gamma (float): discount factor
+            no_grad (bool): If True, collect data without computation graph. Default: False
+        """
+        self.agent = agent
+        self.env = env
+        assert isinstance(self.env, VecEnv), 'The environment must be of type VecEnv. '
+        self.gamma = gamma
+        self.no_grad = no_grad
+        
+    def __call__(self, N, T):
+        """
+        Run the agent in the vectorized environment and collect all necessary data for given number of
+        trajectories and horizon (time steps) for each trajectory.
+        
+        Args:
+            N (int): Number of trajectories
+            T (int): Number of time steps
+            
+        Returns:
+            D (list of Trajectory): list of collected trajectories.
+        """
+        D = []
+        
+        while len(D) < N:  # Iterate over rounds of trajectories
+            D.extend(self._run_round(num_trajectory=min(N - len(D), self.env.num_env), T=T))
+            
+        return D
+        
+    def _run_round(self, num_trajectory, T):
+        """
+        Collect one trajectory in each of the first `num_trajectory` environments from initial observations.
+        """
+        # Create trajectory objects, each for one active environment
+        trajectories = [Trajectory(gamma=self.gamma) for _ in range(num_trajectory)]
+        # Mask for environments whose trajectory is not finished yet
+        active = [True]*num_trajectory
+        # Final observations to compute V_s_next
+        final_obs = [None]*num_trajectory
+        
+        # Reset all the environments and returns initial states of the environments in use
+        obs = self.env.reset()
+        obs = [self._get_obs(obs, i) for i in range(num_trajectory)]
+        
+        for t in range(T):  # Iterate over the number of time steps
+            # Indices of active environments, only they are stepped
+            indices = [i for i in range(num_trajectory) if active[i]]
+            
+            # Batched action selection by the agent for active environments
+            with torch.set_grad_enabled(not self.no_grad):
+                output_agent = self.agent.choose_action([obs[i] for i in indices])
+                
+            # Unpack action from output.
+            # We record Tensor dtype for backprop (propagate via Transitions)
+            action = output_agent.pop('action')  # pop-out
+            state_value = output_agent.pop('state_value', None)
+            
+            # Obtain raw action from Tensor for environment to execute
+            if torch.is_tensor(action):
+                raw_action = action.detach().cpu().numpy()
+            else:
+                raw_action = action
+            # Execute the actions only in active environments
+            self.env.step_async(raw_action, indices=indices)
+            obs_next, reward, done, info = self.env.step_wait()
+            
+            for j, i in enumerate(indices):  # Iterate over active environments, j-th in the batch
+                # Create and record a Transition
+                # Note that the Tensor is sliced with batch size one, same as TrajectoryRunner
+                transition = Transition(s=obs[i],
+                                        a=self._get_item(action, j),
+                                        r=reward[j],
+                                        s_next=self._get_obs(obs_next, j),
+                                        done=done[j])
+                if self.no_grad:
+                    # Only record unconstrained action if available, all others are re-evaluated by the agent
+                    if 'unconstrained_action' in output_agent:
+                        transition.add_info('unconstrained_action', self._get_item(output_agent['unconstrained_action'], j))
+                else:
+                    # Record state value if required
+                    if state_value is not None:
+                        transition.add_info('V_s', self._get_item(state_value, j))
+                    # Record additional information from output_agent
+                    # Note that 'action' and 'state_value' already poped out
+                    for key, val in output_agent.items():
+                        transition.add_info(key, self._get_item(val, j))
+                        
+                # Add transition to Trajectory
+                trajectories[i].add_transition(transition)
+                
+                # Back up obs for next iteration to feed into agent
+                obs[i] = transition.s_next
+                
+                # Mask out the environment if episode finishes or reaching maximal time steps
+                if done[j] or t == T - 1:
+                    active[i] = False
+                    final_obs[i] = transition.s_next
+                    
+            # Terminate if all trajectories finish
+            if not any(active):
+                break
+                
+        # Call agent again to compute state values for final observations in all trajectories at once
+        if state_value is not None:
+            with torch.set_grad_enabled(not self.no_grad):
+                V_s_next = self.agent.choose_action(final_obs)['state_value']
+            for i, trajectory in enumerate(trajectories):
+                # Add to the final transition as 'V_s_next'
+                trajectory.transitions[-1].add_info('V_s_next', self._get_item(V_s_next, i))
+                # The final transition is modified in place, so clear cached quantities of the trajectory
+                trajectory.clear_cache()
+                
+        # Record whether the data is collected without computation graph
+        for trajectory in trajectories:
+            trajectory.add_info('no_grad', self.no_grad)
+                
+        return trajectories
+        
+    def _get_obs(self, obs, i):
+        """
+        Return the observation for environment i. Batched ndarray observations might be views of buffers
+        reused by the VecEnv (e.g. ParallelVecEnv with shared memory), so a copy is kept in the trajectory.
+        """
+        if isinstance(obs, np.ndarray):
+            return np.array(obs[i])
+        else:
+            return obs[i]
+        
+    def _get_item(self, x, i):
+        """
+        Return the item for environment i from batched data. Tensor is sliced with batch size one
+        to keep the batch dimension, the same as in TrajectoryRunner.
+        """
+        if torch.is_tensor(x):
+            return x[i:i+1]
+        else:
+            return x[i]
@@ -1,5 +1,7 @@
 import numpy as np
 
+import pytest
+
 import gym
 
 from lagom.envs import Env
@@ -8,6 +10,16 @@ from lagom.envs import make_gym_env
 from lagom.envs import make_envs
 
 from lagom.envs.wrappers import StackObservation
+from lagom.envs.wrappers import LazyFrames
+
+from lagom.envs.vec_env import SerialVecEnv
+from lagom.envs.vec_env import ParallelVecEnv
+from lagom.envs.vec_env import AsyncVecEnv
+from lagom.envs.vec_env import ThreadedVecEnv
+from lagom.envs.vec_env import CartPoleVecEnv
+from lagom.envs.vec_env import PendulumVecEnv
+from lagom.envs.vec_env import StandardizeVecEnv
+from lagom.envs.vec_env import Standardizer
 
 from lagom import Seeder
 
@@ -67,3 +79,468 @@ class TestWrapper(object):
 
         assert np.allclose(env_obs[..., 0], raw_env_obs)
         assert not np.allclose(env_obs[..., 2], init_raw_env)
+
+
+    def test_stackobservation_ringbuffer(self):
+        for lazy in [False, True]:
+            env = make_gym_env(env_id='Pendulum-v0', seed=0)
+            env = StackObservation(env, 4, lazy=lazy)
+            raw_env = make_gym_env(env_id='Pendulum-v0', seed=0)
+
+            # Reference by shifting all the observations
+            stacked_obs = np.zeros([3, 4])
+            def process(observation):
+                stacked_obs[:] = np.roll(stacked_obs, shift=1, axis=-1)
+                stacked_obs[..., 0] = observation
+                return stacked_obs.copy()
+
+            for episode in range(2):
+                stacked_obs.fill(0)
+                obs = env.reset()
+                assert np.allclose(obs, process(raw_env.reset()))
+                all_obs = [obs]
+                for t in range(10):
+                    action = raw_env.action_space.sample()
+                    obs, _, _, _ = env.step(action)
+                    raw_obs, _, _, _ = raw_env.step(action)
+                    assert np.asarray(obs).shape == (3, 4)
+                    assert np.allclose(obs, process(raw_obs))
+                    all_obs.append(obs)
+                # Returned observations are not modified by later steps
+                assert np.allclose(np.asarray(all_obs[-2])[..., :3], np.asarray(all_obs[-1])[..., 1:])
+
+            if lazy:
+                assert isinstance(obs, LazyFrames)
+                assert obs.shape == (3, 4) and len(obs) == 4
+                # Frames are shared between consecutive observations
+                assert all_obs[-1].frames[1] is all_obs[-2].frames[0]
+                # Batched conversion
+                batch = np.asarray(all_obs[-3:])
+                assert batch.shape == (3, 3, 4)
+                assert np.allclose(batch[-1], np.asarray(obs))
+
+
+class TestVecEnv(object):
+    def test_parallelvecenv_shared_memory(self):
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=3, init_seed=0)
+        env = SerialVecEnv(list_make_env)
+        shared_env = ParallelVecEnv(list_make_env, shared_memory=True)
+        assert shared_env.num_env == 3
+        assert shared_env.observation_space.shape == env.observation_space.shape
+
+        obs = env.reset()
+        shared_obs = shared_env.reset()
+        assert isinstance(shared_obs, np.ndarray) and shared_obs.shape == (3, 4)
+        assert np.allclose(obs, shared_obs)
+
+        num_done = 0
+        for t in range(100):
+            action = [t % 2]*3
+            obs, reward, done, info = env.step(action)
+            shared_obs, shared_reward, shared_done, shared_info = shared_env.step(action)
+            assert isinstance(shared_obs, np.ndarray) and shared_obs.shape == (3, 4)
+            assert shared_reward.dtype == np.float32 and shared_done.dtype == bool
+            assert np.allclose(obs, shared_obs)
+            assert np.allclose(reward, shared_reward)
+            assert list(done) == list(shared_done)
+            for i in range(3):
+                if done[i]:
+                    num_done += 1
+                    assert np.allclose(info[i]['init_observation'], shared_info[i]['init_observation'])
+                else:
+                    assert 'init_observation' not in shared_info[i]
+        assert num_done > 0
+
+        # Returned arrays are views of rotating slots, valid for two further steps
+        obs1, _, _, _ = shared_env.step([0]*3)
+        copy_obs1 = np.array(obs1)
+        shared_env.step([0]*3)
+        shared_env.step([0]*3)
+        assert np.allclose(obs1, copy_obs1)
+
+        shared_env.close()
+
+    def test_parallelvecenv_num_env_per_worker(self):
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=5, init_seed=0)
+        env = SerialVecEnv(list_make_env)
+        obs = env.reset()
+        all_obs = [obs]
+        for t in range(50):
+            obs, reward, done, info = env.step([t % 2]*5)
+            all_obs.append(obs)
+
+        for num_env_per_worker, shared_memory in [(1, False), (2, False), (5, False), (None, False), (2, True)]:
+            parallel_env = ParallelVecEnv(list_make_env, num_env_per_worker=num_env_per_worker, shared_memory=shared_memory)
+            if num_env_per_worker is not None:
+                assert parallel_env.num_worker == -(-5//num_env_per_worker)
+                assert len(parallel_env.list_process) == parallel_env.num_worker
+            assert sum([len(block) for block in parallel_env.blocks]) == 5
+            assert parallel_env.T == env.T
+
+            obs = parallel_env.reset()
+            assert len(obs) == 5
+            assert np.allclose(obs, all_obs[0])
+            for t in range(50):
+                obs, reward, done, info = parallel_env.step([t % 2]*5)
+                assert len(obs) == 5 and len(reward) == 5 and len(done) == 5 and len(info) == 5
+                assert np.allclose(obs, all_obs[t + 1])
+
+            parallel_env.close()
+
+    def test_asyncvecenv(self):
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=4, init_seed=0)
+        env = SerialVecEnv(list_make_env)
+        async_env = AsyncVecEnv(list_make_env, num_env_per_worker=2)
+        assert async_env.num_worker == 2
+
+        # Synchronous interface
+        assert np.allclose(env.reset(), async_env.reset())
+        for t in range(20):
+            obs, reward, done, info = env.step([t % 2]*4)
+            async_obs, async_reward, async_done, async_info = async_env.step([t % 2]*4)
+            assert np.allclose(obs, async_obs)
+            assert np.allclose(reward, async_reward)
+            assert list(done) == list(async_done)
+
+        # Actions should be sent to whole blocks
+        with pytest.raises(AssertionError):
+            async_env.step_async([0], indices=[1])
+
+        # Asynchronous interface
+        async_env.step_async([0, 0], indices=[2, 3])
+        assert async_env.pending == {1}
+        with pytest.raises(AssertionError):
+            async_env.reset()
+        indices, obs, reward, done, info = async_env.step_wait_ready(k=1)
+        assert indices == [2, 3]
+        assert len(obs) == 2 and len(reward) == 2 and len(done) == 2 and len(info) == 2
+        assert len(async_env.pending) == 0 and not async_env.waiting
+
+        async_env.step_async([1]*4)
+        indices, obs, reward, done, info = async_env.step_wait_ready(k=3)
+        assert sorted(indices) == [0, 1, 2, 3]
+
+        # Close with pending environments
+        async_env.step_async([1, 1], indices=[0, 1])
+        async_env.close()
+
+    def test_threadedvecenv(self):
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=3, init_seed=0)
+        env = SerialVecEnv(list_make_env)
+        threaded_env = ThreadedVecEnv(list_make_env, num_thread=2)
+        assert threaded_env.num_env == 3 and threaded_env.num_thread == 2
+        assert threaded_env.T == env.T
+        assert threaded_env.max_episode_reward == env.max_episode_reward
+
+        assert np.allclose(env.reset(), threaded_env.reset())
+        num_done = 0
+        for t in range(100):
+            obs, reward, done, info = env.step([t % 2]*3)
+            threaded_obs, threaded_reward, threaded_done, threaded_info = threaded_env.step([t % 2]*3)
+            assert np.allclose(obs, threaded_obs)
+            assert np.allclose(reward, threaded_reward)
+            assert list(done) == list(threaded_done)
+            for i in range(3):
+                if done[i]:
+                    num_done += 1
+                    assert np.allclose(info[i]['init_observation'], threaded_info[i]['init_observation'])
+        assert num_done > 0
+
+        # Seeding
+        env.seed([1, 2, 3])
+        threaded_env.seed([1, 2, 3])
+        assert np.allclose(env.reset(), threaded_env.reset())
+
+        threaded_env.step_async([0]*3)
+        threaded_env.close()
+
+    def test_get_attr_call_method(self):
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=5, init_seed=0)
+        for make_vec_env in [SerialVecEnv, ThreadedVecEnv, lambda x: ParallelVecEnv(x, num_env_per_worker=2)]:
+            env = make_vec_env(list_make_env)
+            # Cached metadata
+            assert env.T == [500]*5
+            assert env.max_episode_reward == [475.0]*5
+            if isinstance(env, ParallelVecEnv):
+                assert env.spec_ids == ['CartPole-v1']*5
+
+            assert env.get_attr('T') == [500]*5
+            assert env.get_attr('T', indices=[4, 1, 2]) == [500]*3
+
+            obs = env.call_method('reset', indices=[3, 0])
+            assert len(obs) == 2 and obs[0].shape == (4,)
+            env.call_method('seed', 1, indices=[2])
+            env.call_method('seed', seed=1, indices=[4])
+            assert np.allclose(*env.call_method('reset', indices=[2, 4]))
+
+            env.close()
+
+    def test_batchedvecenv(self):
+        for env_id, make_batched_env in [('CartPole-v1', CartPoleVecEnv), ('Pendulum-v0', PendulumVecEnv)]:
+            list_make_env = make_envs(make_env=make_gym_env, env_id=env_id, num_env=3, init_seed=0)
+            seeds = [make_env.keywords['seed'] for make_env in list_make_env]
+            env = SerialVecEnv(list_make_env)
+            batched_env = make_batched_env(num_env=3, seeds=seeds)
+            assert batched_env.num_env == 3
+            assert batched_env.T == env.T
+            assert batched_env.max_episode_reward == env.max_episode_reward
+            assert batched_env.observation_space.shape == env.observation_space.shape
+            assert batched_env.action_space.flat_dim == env.action_space.flat_dim
+
+            # Same results as gym environments with same seeds
+            assert np.allclose(env.reset(), batched_env.reset())
+            num_done = 0
+            for t in range(450):
+                action = [env.action_space.sample() for _ in range(3)]
+                obs, reward, done, info = env.step(action)
+                batched_obs, batched_reward, batched_done, batched_info = batched_env.step(action)
+                assert np.allclose(obs, batched_obs)
+                assert np.allclose(reward, batched_reward)
+                assert list(done) == list(batched_done)
+                for i in range(3):
+                    if done[i]:
+                        num_done += 1
+                        assert np.allclose(info[i]['init_observation'], batched_info[i]['init_observation'])
+                        assert info[i].get('TimeLimit.truncated') == batched_info[i].get('TimeLimit.truncated')
+            assert num_done > 0
+
+            # Each environment is reproducible by its own seed
+            batched_env = make_batched_env(num_env=2, seeds=seeds[1:])
+            env.seed(seeds)
+            assert np.allclose(batched_env.reset(), env.reset()[1:])
+            batched_env.seed(seeds[:2])
+            env.seed(seeds)
+            assert np.allclose(batched_env.reset(), env.reset()[:2])
+
+    def test_return_array(self):
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=3, init_seed=0)
+        seeds = [make_env.keywords['seed'] for make_env in list_make_env]
+        env = SerialVecEnv(list_make_env)
+        list_env = [SerialVecEnv(list_make_env, return_array=True),
+                    ThreadedVecEnv(list_make_env, return_array=True),
+                    ParallelVecEnv(list_make_env, num_env_per_worker=2, return_array=True),
+                    CartPoleVecEnv(num_env=3, seeds=seeds, return_array=True)]
+        assert not env.return_array
+        assert all([array_env.return_array for array_env in list_env])
+
+        obs = env.reset()
+        for array_env in list_env:
+            array_obs = array_env.reset()
+            assert isinstance(array_obs, np.ndarray) and array_obs.shape == (3, 4)
+            assert np.allclose(obs, array_obs)
+        for t in range(100):
+            obs, reward, done, info = env.step([t % 2]*3)
+            for array_env in list_env:
+                array_obs, array_reward, array_done, array_info = array_env.step(np.array([t % 2]*3))
+                assert isinstance(array_obs, np.ndarray) and array_obs.shape == (3, 4)
+                assert array_reward.dtype == np.float32 and array_reward.shape == (3,)
+                assert array_done.dtype == bool and array_done.shape == (3,)
+                assert np.allclose(obs, array_obs)
+                assert np.allclose(reward, array_reward)
+                assert list(done) == list(array_done)
+                for i in np.where(done)[0]:
+                    assert np.allclose(info[i]['init_observation'], array_info[i]['init_observation'])
+
+        [array_env.close() for array_env in list_env]
+
+    def test_parallelvecenv_standardize(self):
+        list_make_env = make_envs(make_env=make_gym_env, env_id='Pendulum-v0', num_env=4, init_seed=0)
+        for shared_memory in [False, True]:
+            env = ParallelVecEnv(list_make_env, 
+                                 num_env_per_worker=2, 
+                                 shared_memory=shared_memory, 
+                                 standardize={'clip_obs': 5.0, 'clip_reward': 5.0}, 
+                                 sync_interval=10)
+            assert env.num_worker == 2
+
+            obs = env.reset()
+            assert np.asarray(obs).shape == (4, 3)
+            assert np.all(np.abs(obs) <= 5.0)
+            for t in range(25):
+                obs, reward, done, info = env.step(np.random.uniform(-2, 2, size=[4, 1]))
+                assert np.all(np.isfinite(obs)) and np.all(np.abs(obs) <= 5.0)
+                assert np.all(np.isfinite(reward)) and np.all(np.abs(reward) <= 5.0)
+
+            # Synchronized twice, all observations from reset and 20 steps are merged
+            assert env.obs_runningavg.N == 4*21
+            assert env.reward_runningavg.N == 4*20
+            assert env.obs_runningavg.mean.shape == (3,)
+            # Synchronize manually for remaining data
+            env.sync_standardize()
+            assert env.obs_runningavg.N == 4*26
+            assert env.reward_runningavg.N == 4*25
+            assert env.num_step_unsync == 0
+            env.sync_standardize()
+            assert env.obs_runningavg.N == 4*26
+
+            env.close()
+
+    def test_standardizevecenv(self):
+        list_make_env = make_envs(make_env=make_gym_env, env_id='Pendulum-v0', num_env=2, init_seed=0)
+        venv = SerialVecEnv(list_make_env)
+        env = StandardizeVecEnv(venv, clip_obs=5.0, clip_reward=5.0, gamma=0.9)
+        assert isinstance(env.standardizer, Standardizer)
+        assert not env.standardizer.track_delta
+
+        # Same results as a Standardizer on the raw data
+        raw_env = SerialVecEnv(list_make_env)
+        standardizer = Standardizer(num_env=2, clip_obs=5.0, clip_reward=5.0, gamma=0.9)
+        assert np.allclose(env.reset(), standardizer.process_obs(np.asarray(raw_env.reset())))
+        for t in range(10):
+            action = np.random.uniform(-2, 2, size=[2, 1])
+            obs, reward, done, info = env.step(action)
+            raw_obs, raw_reward, raw_done, raw_info = raw_env.step(action)
+            assert np.allclose(obs, standardizer.process_obs(np.asarray(raw_obs)))
+            assert np.allclose(reward, standardizer.process_reward(np.asarray(raw_reward)))
+            assert np.all(np.abs(obs) <= 5.0) and np.all(np.abs(reward) <= 5.0)
+        assert env.obs_runningavg.N == 2*11
+        assert env.reward_runningavg.N == 2*10
+        assert np.allclose(env.all_returns, standardizer.all_returns)
+        with pytest.raises(AssertionError):
+            env.standardizer.get_delta()
+        assert env.use_obs and env.use_reward
+        assert env.clip_obs == 5.0 and env.clip_reward == 5.0
+        assert env.gamma == 0.9 and env.eps == 1e-8
+
+        env.close()
+        raw_env.close()
+
+        # Initial observations are standardized in the master the same as in the workers
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=3, init_seed=0)
+        env = StandardizeVecEnv(SerialVecEnv(list_make_env), clip_obs=5.0, gamma=0.9)
+        worker_env = ParallelVecEnv(list_make_env, num_env_per_worker=3, standardize={'clip_obs': 5.0, 'gamma': 0.9})
+        assert np.allclose(env.reset(), worker_env.reset())
+        num_done = 0
+        for t in range(50):
+            obs, reward, done, info = env.step([0]*3)
+            worker_obs, worker_reward, worker_done, worker_info = worker_env.step([0]*3)
+            assert np.allclose(obs, worker_obs) and np.allclose(reward, worker_reward)
+            for i in range(3):
+                if done[i]:
+                    num_done += 1
+                    assert np.allclose(info[i]['init_observation'], worker_info[i]['init_observation'])
+                    assert np.all(np.abs(info[i]['init_observation']) <= 5.0)
+        assert num_done > 0
+        # Initial observations are not added to the running averages
+        assert env.obs_runningavg.N == 3*51
+
+        env.close()
+        worker_env.close()
+
+    def test_step_subset(self):
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=3, init_seed=0)
+        env = SerialVecEnv(list_make_env)
+
+        # Results of each environment when all of them are stepped
+        env.reset()
+        expected = [[] for _ in range(3)]
+        for t in range(30):
+            obs, reward, done, info = env.step([0]*3)
+            for i in range(3):
+                expected[i].append([obs[i], reward[i], done[i], info[i].get('init_observation', None)])
+        env.close()
+
+        list_env = [SerialVecEnv(list_make_env),
+                    SerialVecEnv(list_make_env, return_array=True),
+                    ParallelVecEnv(list_make_env, num_env_per_worker=2),
+                    ParallelVecEnv(list_make_env, num_env_per_worker=2, shared_memory=True),
+                    StandardizeVecEnv(SerialVecEnv(list_make_env), use_obs=False, use_reward=False)]
+        for subset_env in list_env:
+            subset_env.reset()
+            results = [[] for _ in range(3)]
+            for t in range(30):
+                # Only a subset of environments is stepped, the others keep their states
+                indices = [[0, 1, 2], [0, 2], [1], [2], [1, 2]][t % 5]
+                subset_env.step_async([0]*len(indices), indices=indices)
+                obs, reward, done, info = subset_env.step_wait()
+                assert len(obs) == len(reward) == len(done) == len(info) == len(indices)
+                for j, i in enumerate(indices):
+                    results[i].append([np.array(obs[j]), reward[j], done[j], info[j].get('init_observation', None)])
+            for i in range(3):
+                assert len(results[i]) > 0
+                for x, y in zip(expected[i], results[i]):
+                    assert np.allclose(x[0], y[0]) and x[1] == y[1] and x[2] == y[2]
+                    assert (x[3] is None and y[3] is None) or np.allclose(x[3], y[3])
+            # All environments are stepped by default
+            obs, reward, done, info = subset_env.step([0]*3)
+            assert len(obs) == 3
+            subset_env.close()
+
+        # Discounted returns of stepped environments for standardization
+        standardizer = Standardizer(num_env=3, gamma=0.5)
+        standardizer.process_reward(np.array([1.0, 1.0, 1.0]))
+        standardizer.process_reward(np.array([1.0]), indices=[1])
+        assert np.allclose(standardizer.all_returns, [1.0, 1.5, 1.0])
+
+    def test_reset_ahead(self):
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=3, init_seed=0)
+        env = SerialVecEnv(list_make_env)
+        list_env = [SerialVecEnv(list_make_env, reset_ahead=True),
+                    ParallelVecEnv(list_make_env, num_env_per_worker=2, reset_ahead=True),
+                    ParallelVecEnv(list_make_env, shared_memory=True, reset_ahead=True)]
+        assert not env.reset_ahead
+        assert all([ahead_env.reset_ahead for ahead_env in list_env])
+
+        # Results of each environment without reset ahead
+        obs = env.reset()
+        expected = [[] for _ in range(3)]
+        for t in range(100):
+            obs, reward, done, info = env.step([0]*3)
+            for i in range(3):
+                expected[i].append([obs[i], reward[i], done[i]])
+                if done[i]:
+                    expected[i].append(info[i]['init_observation'])
+        env.close()
+
+        for ahead_env in list_env:
+            ahead_env.reset()
+            results = [[] for _ in range(3)]
+            num_reset = 0
+            for t in range(100):
+                obs, reward, done, info = ahead_env.step([0]*3)
+                for i in range(3):
+                    if 'reset_ahead' in info[i]:  # initial observation delivered with next step
+                        num_reset += 1
+                        assert reward[i] == 0.0 and not done[i]
+                        results[i].append(np.array(obs[i]))  # copy the view of shared arrays
+                    else:
+                        assert 'init_observation' not in info[i]
+                        results[i].append([np.array(obs[i]), reward[i], done[i]])
+            assert num_reset > 0
+            # Same sequence as without reset ahead, except that initial observations come one step later
+            for i in range(3):
+                for x, y in zip(expected[i], results[i]):
+                    if isinstance(x, list):
+                        assert np.allclose(x[0], y[0]) and x[1] == y[1] and x[2] == y[2]
+                    else:
+                        assert np.allclose(x, y)
+
+            # Other commands wait for pending resets
+            assert ahead_env.get_attr('T') == [500]*3
+            ahead_env.close()
+
+        # The steps delivering initial observations are not added to the running averages of standardization
+        env = StandardizeVecEnv(SerialVecEnv(list_make_env, reset_ahead=True), gamma=0.9)
+        env.reset()
+        returns = np.zeros(3)
+        num_transition = 0
+        for t in range(100):
+            obs, reward, done, info = env.step([0]*3)
+            for i in range(3):
+                if 'reset_ahead' in info[i]:
+                    assert reward[i] == 0.0
+                else:
+                    returns[i] = 1.0 + 0.9*returns[i]  # CartPole reward is always 1.0
+                    num_transition += 1
+        assert num_transition < 3*100
+        assert env.reward_runningavg.N == num_transition
+        assert env.obs_runningavg.N == 3 + num_transition  # including reset()
+        assert np.allclose(env.all_returns, returns)
+        env.close()
+
+        standardizer = Standardizer(num_env=2, gamma=0.5)
+        standardizer.process_reward(np.array([1.0, 1.0]))
+        rewards = standardizer.process_reward(np.array([1.0, 0.0]), infos=[{}, {'reset_ahead': True}])
+        assert rewards[1] == 0.0
+        assert np.allclose(standardizer.all_returns, [1.5, 1.0])
+        assert standardizer.reward_runningavg.N == 3
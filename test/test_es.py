@@ -0,0 +1,291 @@
+import pickle
+import time
+
+import numpy as np
+
+import pytest
+
+from lagom.core.es import BaseESWorker
+from lagom.core.es import BaseESMaster
+from lagom.core.es import OpenAIES
+from lagom.core.es import CMAES
+from lagom.core.es import NativeCMAES
+from lagom.core.es import ESOptimizer
+from lagom.core.es import SharedNoiseTable
+from lagom.core.es import NoiseCandidate
+from lagom.core.es import shared_noise_table
+
+from lagom.core.es.test_functions import Sphere
+
+
+class SphereWorker(BaseESWorker):
+    def f(self, solution, seed):
+        assert isinstance(solution, np.ndarray)
+        
+        return Sphere()(solution)
+    
+    
+class SphereMaster(BaseESMaster):
+    def make_es(self):
+        noise_table = SharedNoiseTable(size=100000, seed=0)
+        es = OpenAIES(mu0=[1.0]*50, std0=0.1, popsize=4, lr=0.05, antithetic=True, noise_table=noise_table)
+        
+        return es
+    
+    def _process_es_result(self, result):
+        self.all_best_f_val.append(result['best_f_val'])
+        
+
+class RecordES(OpenAIES):
+    def tell(self, solutions, function_values):
+        # Function values are reassembled in the order of candidates
+        assert len(function_values) == self.popsize
+        assert np.allclose(function_values, [Sphere()(solution) for solution in solutions])
+        super().tell(solutions, function_values)
+        
+        
+class BatchSphereWorker(BaseESWorker):
+    def f(self, solution, seed):
+        return Sphere()(solution)
+    
+    def f_batch(self, solutions, seeds):
+        assert len(solutions) == len(seeds) <= 4
+        
+        return list(np.sum(np.asarray(solutions)**2, axis=1))
+        
+        
+class RestartSphereMaster(BaseESMaster):
+    def make_es(self):
+        es = RecordES(mu0=[1.0]*10, std0=0.1, popsize=6*self.popsize_factor, lr=0.05)
+        
+        return es
+    
+    def _process_es_result(self, result):
+        self.all_popsize.append(self.es.popsize)
+        
+    def should_restart(self, result):
+        return self.generation % 3 == 2
+        
+
+class RestartNoiseTableMaster(SphereMaster):
+    def should_restart(self, result):
+        return True
+        
+        
+class StragglerSphereWorker(BaseESWorker):
+    def f(self, solution, seed):
+        # Uneven evaluation time
+        time.sleep(0.05 if seed % 4 == 0 else 0.001)
+        
+        return Sphere()(solution)
+    
+    
+class WeightES(OpenAIES):
+    def tell(self, solutions, function_values, weights=None):
+        self.all_weights.append(list(weights))
+        super().tell(solutions, function_values, weights=weights)
+        
+        
+class AsyncSphereMaster(BaseESMaster):
+    def make_es(self):
+        noise_table = SharedNoiseTable(size=100000, seed=0)
+        es = WeightES(mu0=[1.0]*10, std0=0.1, popsize=8, lr=0.05, noise_table=noise_table, num_slot=3)
+        es.all_weights = []
+        
+        return es
+    
+    def _process_es_result(self, result):
+        self.all_best_f_val.append(result['best_f_val'])
+        
+
+class CMASphereMaster(BaseESMaster):
+    def make_es(self):
+        es = NativeCMAES(mu0=[1.0]*10, std0=0.5, popsize=8)
+        
+        return es
+    
+    def _process_es_result(self, result):
+        self.all_best_f_val.append(result['best_f_val'])
+        
+        
+class TestES(object):
+    def test_shared_noise_table(self, monkeypatch):
+        noise_table = SharedNoiseTable(size=100000, seed=0)
+        assert noise_table.noise.dtype == np.float32 and noise_table.noise.shape == (100000,)
+        assert abs(noise_table.noise.mean()) < 0.05 and abs(noise_table.noise.std() - 1.0) < 0.05
+        # Same seed, same noise
+        assert np.allclose(SharedNoiseTable(size=100, seed=0).noise, noise_table.noise[:100])
+        
+        offsets = noise_table.sample_offset(num_params=1000, num=10)
+        assert len(offsets) == 10 and np.all(offsets >= 0) and np.all(offsets <= 100000 - 1000)
+        assert np.allclose(noise_table.get(offsets[0], 1000), noise_table.noise[offsets[0]:offsets[0]+1000])
+        
+        # Only the key is pickled, the noise is looked up in shared memory
+        assert len(pickle.dumps(noise_table)) < 1000
+        assert np.allclose(pickle.loads(pickle.dumps(noise_table)).noise, noise_table.noise)
+        
+        # The shared memory is only inherited by worker processes started with fork
+        monkeypatch.setattr(shared_noise_table, 'get_start_method', lambda: 'spawn')
+        with pytest.raises(AssertionError):
+            SharedNoiseTable(size=100, seed=0)
+        
+    def test_openaies_noise_table(self):
+        noise_table = SharedNoiseTable(size=100000, seed=0)
+        es = OpenAIES(mu0=[1.0]*1000, std0=0.1, popsize=8, antithetic=True, noise_table=noise_table)
+        solutions = es.ask()
+        assert len(solutions) == 8
+        assert all([isinstance(solution, NoiseCandidate) for solution in solutions])
+        assert not hasattr(es, 'eps')
+        # Small messages to workers
+        assert len(pickle.dumps(solutions[0])) < 1000
+        # Reconstruct the parameters, antithetic pairs
+        params = [np.asarray(solution) for solution in solutions]
+        assert all([param.shape == (1000,) for param in params])
+        for i in range(4):
+            assert np.allclose(params[i] - 1.0, -(params[i + 4] - 1.0), atol=1e-6)
+            eps = noise_table.get(solutions[i].offset, 1000)
+            assert np.allclose(params[i], 1.0 + 0.1*eps)
+        assert np.allclose(np.asarray(pickle.loads(pickle.dumps(solutions[0]))), params[0])
+        
+        # Same gradient as with explicit noise matrix
+        function_values = [Sphere()(param) for param in params]
+        es_explicit = OpenAIES(mu0=[1.0]*1000, std0=0.1, popsize=8, antithetic=True)
+        es_explicit.ask()
+        es_explicit.eps = np.array([solution.sign*noise_table.get(solution.offset, 1000) for solution in solutions])
+        es.tell(solutions, function_values)
+        es_explicit.tell(params, function_values)
+        assert np.allclose(es.mu.detach().numpy(), es_explicit.mu.detach().numpy(), atol=1e-6)
+        assert isinstance(es.result['best_param'], np.ndarray)
+        assert np.allclose(es.result['best_f_val'], min(function_values))
+        
+        # Optimize with ESOptimizer
+        es = OpenAIES(mu0=[1.0]*10, std0=0.1, popsize=16, lr=0.05, noise_table=noise_table)
+        optimizer = ESOptimizer(es, Sphere())
+        for _ in range(50):
+            result = optimizer.step()
+        assert result['best_f_val'] < 10.0
+        
+    def test_es_master_noise_table(self):
+        master = SphereMaster(num_iteration=30, worker_class=SphereWorker, num_worker=4)
+        master.all_best_f_val = []
+        master()
+        assert len(master.all_best_f_val) == 30
+        assert master.all_best_f_val[-1] < master.all_best_f_val[0]
+        
+    def test_es_master_batch_restart(self):
+        # Larger population than the number of workers, one batch for each worker
+        master = RestartSphereMaster(num_iteration=9, worker_class=SphereWorker, num_worker=3)
+        master.all_popsize = []
+        assert master.popsize_factor == 1
+        master()
+        assert master.all_popsize == [6]*3 + [12]*3 + [24]*3
+        assert master.num_restart == 3 and master.popsize_factor == 8
+        
+        # Fixed batch size, vectorized evaluation
+        master = RestartSphereMaster(num_iteration=3, worker_class=BatchSphereWorker, num_worker=2, batch_size=4)
+        master.all_popsize = []
+        tasks = master.make_tasks(0)
+        assert [len(solutions) for solutions, seeds in tasks] == [4, 2]
+        assert [len(seeds) for solutions, seeds in tasks] == [4, 2]
+        master()
+        assert master.all_popsize == [6]*3
+        
+        # Restart with shared noise table, the workers cannot find the new shared memory
+        master = RestartNoiseTableMaster(num_iteration=3, worker_class=SphereWorker, num_worker=2)
+        master.all_best_f_val = []
+        with pytest.raises(AssertionError):
+            master()
+        master.stop_workers()
+        assert master.num_restart == 0
+        
+    def test_async_es_master(self):
+        master = AsyncSphereMaster(num_iteration=40, 
+                                   worker_class=StragglerSphereWorker, 
+                                   num_worker=4, 
+                                   async_k=4, 
+                                   max_staleness=2, 
+                                   staleness_decay=0.5)
+        master.all_best_f_val = []
+        master()
+        assert master.generation == 40
+        assert len(master.all_best_f_val) == 40
+        all_weights = [w for weights in master.es.all_weights for w in weights]
+        # Fresh results with weight 1, stale results are down-weighted, too stale ones are discarded
+        assert set(all_weights) <= {1.0, 0.5, 0.25}
+        assert 1.0 in all_weights and 0.5 in all_weights
+        assert all([len(weights) <= 4 for weights in master.es.all_weights])
+        assert np.mean(master.all_best_f_val[-5:]) < np.mean(master.all_best_f_val[:5])
+        assert np.all(np.isfinite(master.es.mu.detach().numpy()))
+        
+        # Update with every two function values, several workers are ready at once
+        master = AsyncSphereMaster(num_iteration=20, worker_class=SphereWorker, num_worker=4, async_k=2)
+        master.all_best_f_val = []
+        master()
+        assert master.generation == 20
+        assert len(master.all_best_f_val) == 20
+        assert all([len(weights) >= 2 for weights in master.es.all_weights])
+        assert np.all(np.isfinite(master.es.mu.detach().numpy()))
+        assert np.all(np.isfinite(master.all_best_f_val))
+        assert np.mean(master.all_best_f_val[-5:]) < np.mean(master.all_best_f_val[:5])
+        
+        # A single function value is kept until more values arrive
+        master = AsyncSphereMaster(num_iteration=1, worker_class=SphereWorker, num_worker=2, async_k=2)
+        master.generation = 0
+        solutions = master.es.ask(3)
+        arrived = [[master.es, solution, Sphere()(np.asarray(solution)), generation] 
+                   for solution, generation in zip(solutions, [-5, -5, 0])]
+        arrived = master._update_async(arrived)
+        assert len(arrived) == 1 and master.generation == 0
+        
+        # At least two function values for each update
+        with pytest.raises(AssertionError):
+            AsyncSphereMaster(num_iteration=10, worker_class=SphereWorker, num_worker=4, async_k=1)
+        
+        # Candidates should come from the noise table
+        master = RestartSphereMaster(num_iteration=2, worker_class=SphereWorker, num_worker=2, async_k=2)
+        master.all_popsize = []
+        with pytest.raises(AssertionError):
+            master()
+        master.stop_workers()
+        
+    def test_native_cmaes(self):
+        # Full covariance matrix
+        es = NativeCMAES(mu0=[3.0]*10, std0=0.5, popsize=10, separable=False)
+        assert es.C.shape == (10, 10)
+        solutions = es.ask()
+        assert len(solutions) == 10 and all([solution.shape == (10,) for solution in solutions])
+        optimizer = ESOptimizer(es, Sphere())
+        for _ in range(150):
+            result = optimizer.step()
+        assert result['best_f_val'] < 1e-6
+        assert np.allclose(Sphere()(result['best_param']), result['best_f_val'])
+        assert result['stds'].shape == (10,) and np.all(result['stds'] < 0.01)
+        # Same result keys as CMAES, with the mean as 'hist_best_param'
+        cmaes = CMAES(mu0=[3.0]*10, std0=0.5, popsize=10)
+        ESOptimizer(cmaes, Sphere()).step()
+        assert set(result.keys()) == set(cmaes.result.keys())
+        assert np.allclose(result['hist_best_param'], es.mean)
+        
+        # Separable, only the diagonal is stored
+        es = NativeCMAES(mu0=[3.0]*10, std0=0.5, popsize=10, separable=True)
+        assert es.C is None and es.D.shape == (10,)
+        optimizer = ESOptimizer(es, Sphere())
+        for _ in range(150):
+            result = optimizer.step()
+        assert result['best_f_val'] < 1e-6
+        
+        # Separable by default for high-dimensional problems
+        es = NativeCMAES(mu0=[1.0]*10000, std0=0.1, popsize=16)
+        assert es.separable and es.C is None
+        optimizer = ESOptimizer(es, Sphere())
+        first_f_val = optimizer.step()['best_f_val']
+        for _ in range(20):
+            result = optimizer.step()
+        assert result['best_f_val'] < first_f_val
+        
+    def test_native_cmaes_es_master(self):
+        master = CMASphereMaster(num_iteration=30, worker_class=SphereWorker, num_worker=4)
+        master.all_best_f_val = []
+        master()
+        assert len(master.all_best_f_val) == 30
+        assert master.all_best_f_val[-1] < master.all_best_f_val[0]
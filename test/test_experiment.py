@@ -25,6 +25,7 @@ class ExperimentMaster(BaseExperimentMaster):
     def process_algo_result(self, config, result):
         result, msg = result
         assert result == config['ID']
+        self.all_ID.append(result)
         
         print(msg)
         
@@ -46,10 +47,22 @@ def test_experiment():
     experiment = ExperimentMaster(worker_class=ExperimentWorker, 
                                   num_worker=128, 
                                   daemonic_worker=None)
+    experiment.all_ID = []
 
     experiment()
     
-    assert len(experiment.configs) <= experiment.num_iteration*experiment.num_worker
-    assert len(experiment.configs) > (experiment.num_iteration - 1)*experiment.num_worker
-    
+    assert experiment.num_iteration == 1
     assert len(experiment.configs) == 500
+    assert experiment.all_ID == [config['ID'] for config in experiment.configs]
+    
+    # More configurations than workers, all in one pooled round
+    experiment = ExperimentMaster(worker_class=ExperimentWorker, 
+                                  num_worker=4, 
+                                  daemonic_worker=None)
+    experiment.all_ID = []
+    assert len(experiment.make_tasks(0)) == 500
+    
+    experiment()
+    
+    assert experiment.num_iteration == 1
+    assert experiment.all_ID == [config['ID'] for config in experiment.configs]
@@ -1,3 +1,5 @@
+import time
+
 import numpy as np
 
 import pytest
@@ -62,6 +64,30 @@ class NaivePrimalityIterativeMaster(BaseIterativeMaster):
                 assert prime == naive_primality(integer)
     
 
+class SleepWorker(BaseWorker):
+    def work(self, master_cmd):
+        task_id, task, seed = master_cmd
+        
+        time.sleep(task)
+        
+        return task_id, task
+    
+    
+class SleepMaster(BaseIterativeMaster):
+    def make_tasks(self, iteration):
+        # More tasks than workers, with uneven durations
+        tasks = [0.1 if i % 5 == 0 else 0.001 for i in range(23 + iteration)]
+        
+        return tasks
+    
+    def _process_workers_result(self, tasks, workers_result):
+        assert len(workers_result) == len(tasks)
+        for task_id, (task, worker_result) in enumerate(zip(tasks, workers_result)):
+            assert worker_result[0] == task_id
+            assert worker_result[1] == task
+        self.num_result.append(len(workers_result))
+    
+
 class TestMultiprocessing(object):
     def test_seeder(self):
         seeder = Seeder(init_seed=0)
@@ -89,3 +115,26 @@ class TestMultiprocessing(object):
                                                    daemonic_worker=None)
 
         prime_test()
+        
+    def test_pool_master_worker(self):
+        master = SleepMaster(num_iteration=2, 
+                             worker_class=SleepWorker, 
+                             num_worker=4, 
+                             init_seed=0, 
+                             daemonic_worker=None)
+        master.num_result = []
+        
+        start = time.perf_counter()
+        master()
+        # Lockstep rounds of 4 tasks would take at least 0.1 seconds for each of 6 + 6 rounds
+        assert time.perf_counter() - start < 1.0
+        assert master.num_result == [23, 24]
+        
+        # Less tasks than workers
+        master = NaivePrimalityIterativeMaster(num_iteration=2, 
+                                               worker_class=NaivePrimalityWorker, 
+                                               num_worker=4, 
+                                               init_seed=0, 
+                                               daemonic_worker=None)
+        master.make_tasks = lambda iteration: np.array_split(range(10), 2)
+        master()
@@ -11,13 +11,29 @@ import torch.nn.functional as F
 from torch.distributions import Categorical
 
 from lagom.envs import EnvSpec, GymEnv
+from lagom.envs import make_envs, make_gym_env
+from lagom.envs.vec_env import SerialVecEnv, ParallelVecEnv, AsyncVecEnv
 from lagom.agents import BaseAgent, RandomAgent
+from lagom.agents import A2CAgent, ActorCriticAgent, REINFORCEAgent
+
+from lagom.core.networks import BaseMLP
+from lagom.core.policies import BaseCategoricalPolicy, BaseGaussianPolicy
 
 from lagom.runner import Transition
 from lagom.runner import Trajectory
 from lagom.runner import TrajectoryRunner
+from lagom.runner import VecTrajectoryRunner
 from lagom.runner import Segment
 from lagom.runner import SegmentRunner
+from lagom.runner import PipelinedSegmentRunner
+from lagom.runner import AsyncSegmentRunner
+from lagom.runner import RolloutBuffer
+from lagom.runner.cache import cached
+from lagom.runner import RolloutSegment
+from lagom.runner import ReplayBuffer
+from lagom.runner import SumTree
+from lagom.runner import MinTree
+from lagom.runner import PrioritizedReplayBuffer
 
 
 class Agent1(BaseAgent):
@@ -78,6 +94,41 @@ class Agent2(BaseAgent):
         pass
 
     
+class Network(BaseMLP):
+    def make_params(self, config):
+        self.fc = nn.Linear(in_features=config['in'], out_features=16)
+        self.action_head = nn.Linear(in_features=16, out_features=config['out'])
+        self.logvar_head = nn.Linear(in_features=16, out_features=config['out'])
+        self.value_head = nn.Linear(in_features=16, out_features=1)
+        
+    def init_params(self, config):
+        pass
+    
+    def forward(self, x):
+        x = F.relu(self.fc(x))
+        
+        out = {}
+        out['action_scores'] = self.action_head(x)
+        out['mean'] = out['action_scores']
+        out['logvar'] = self.logvar_head(x)
+        out['state_value'] = self.value_head(x)
+        
+        return out
+    
+
+class CategoricalPolicy(BaseCategoricalPolicy):
+    def process_network_output(self, network_out):
+        return {'state_value': network_out['state_value']}
+    
+    
+class GaussianPolicy(BaseGaussianPolicy):
+    def process_network_output(self, network_out):
+        return {'state_value': network_out['state_value']}
+    
+    def constraint_action(self, action):
+        return 2*torch.tanh(action)
+    
+
 class TestRunner(object):
     def test_transition(self):
         transition = Transition(s=1.2, 
@@ -149,6 +200,7 @@ class TestRunner(object):
         all_V = [V.item() if torch.is_tensor(V) else V for V in segment.all_V]
         assert np.allclose(segment.all_V, [100, 200, 300, 400, 500])
         assert np.allclose(segment.all_TD, [-79, -168, -257, -346])
+        assert np.allclose(segment.all_gae(gae_lambda=0.5), [-88.08575, -181.715, -274.3, -346])
 
 
         # Test case: part of episode with final terminal transition
@@ -230,6 +282,7 @@ class TestRunner(object):
         all_V = [V.item() if torch.is_tensor(V) else V for V in segment.all_V]
         assert np.allclose(segment.all_V, [100, 200, 250, 300, 400, 500])
         assert np.allclose(segment.all_TD, [-79, -198, -257, -346])
+        assert np.allclose(segment.all_gae(gae_lambda=0.5), [-88.9, -198, -274.3, -346])
         
         
         # Test case: segment of transitions from three episodes with final transition non-terminal
@@ -402,6 +455,8 @@ class TestRunner(object):
         assert np.allclose(trajectory.all_discounted_returns, [0.56, 0.6, 1.0])
         assert np.allclose(trajectory.all_V, [10, 20, 30, 0])
         assert np.allclose(trajectory.all_TD, [-7.5, -16.5, -29])
+        assert np.allclose(trajectory.all_gae(gae_lambda=1.0), [-9.44, -19.4, -29])
+        assert np.allclose(trajectory.all_gae(gae_lambda=0.0), trajectory.all_TD)
         assert np.allclose(trajectory.all_info(name='V_s'), [10, 20, 30])
         
     def test_trajectoryrunner(self):
@@ -442,3 +497,620 @@ class TestRunner(object):
         # Continuous action space
         env = gym.make('Pendulum-v0')
         helper('agent2', env)
+        
+    def test_cache(self):
+        for cls in [Segment, Trajectory]:
+            D = cls(gamma=0.9)
+            D.add_transition(Transition(s=1, a=0.1, r=1.0, s_next=2, done=False))
+            D.add_transition(Transition(s=2, a=0.2, r=2.0, s_next=3, done=False))
+            for transition in D.transitions:
+                transition.add_info('V_s', torch.tensor(1.0))
+            D.transitions[-1].add_info('V_s_next', torch.tensor(0.5))
+            assert D.cache_hits == 0 and D.cache_misses == 0
+            
+            # Computed only once
+            all_r = D.all_r
+            assert D.all_r == all_r
+            assert D.cache_misses == 1 and D.cache_hits == 1
+            
+            # Cached output is returned directly without copying
+            assert D.all_r is all_r
+            if cls is Segment:
+                assert D.split_transitions is D.split_transitions
+            
+            # Cached with arguments bound to parameters
+            assert D.all_gae(0.5) == D.all_gae(0.5)
+            assert D.all_gae(0.5) != D.all_gae(0.9)
+            assert (cls.all_gae.__wrapped__, (0.5,)) in D._cache and (cls.all_gae.__wrapped__, (0.9,)) in D._cache
+            num_cache = len(D._cache)
+            assert D.all_gae(gae_lambda=0.5) is D.all_gae(0.5)
+            assert len(D._cache) == num_cache
+            
+            # Invalidated after mutation
+            D.add_transition(Transition(s=3, a=0.3, r=3.0, s_next=4, done=True))
+            D.transitions[-1].add_info('V_s', torch.tensor(1.0))
+            D.transitions[-1].add_info('V_s_next', torch.tensor(0.0))
+            assert len(D._cache) == 0
+            assert D.all_r == [1.0, 2.0, 3.0]
+            
+            D.add_info('extra', 1)
+            assert len(D._cache) == 0
+            D.all_r
+            D.clear_cache()
+            assert len(D._cache) == 0
+            
+        # Overridden method calling super() does not collide with the parent method
+        class ScaledSegment(Segment):
+            @cached
+            def all_gae(self, gae_lambda):
+                return [2*x for x in super().all_gae(gae_lambda)]
+        
+        D = ScaledSegment(gamma=0.9)
+        D.add_transition(Transition(s=1, a=0.1, r=2.0, s_next=2, done=True))
+        D.transitions[-1].add_info('V_s', torch.tensor(1.0))
+        D.transitions[-1].add_info('V_s_next', torch.tensor(0.0))
+        assert np.allclose(D.all_gae(0.5), [2.0]) and np.allclose(D.all_gae(0.5), [2.0])
+        assert (Segment.all_gae.__wrapped__, (0.5,)) in D._cache
+        assert (ScaledSegment.all_gae.__wrapped__, (0.5,)) in D._cache
+        assert np.allclose(Segment.all_gae(D, 0.5), [1.0])
+            
+    def test_rolloutbuffer(self):
+        env = GymEnv(gym.make('CartPole-v1'))
+        env_spec = EnvSpec(env)
+        
+        buffer = RolloutBuffer(env_spec=env_spec, T=4, num_env=2)
+        assert buffer.obs.shape == (5, 2, 4)
+        assert buffer.s.shape == (4, 2, 4) and buffer.s_next.shape == (4, 2, 4)
+        assert buffer.a.shape == (4, 2)
+        assert buffer.r.shape == (4, 2) and buffer.r.dtype == np.float32
+        assert buffer.done.shape == (4, 2) and buffer.done.dtype == bool
+        
+        # env 0: done [False, True, False, True], env 1: no done
+        # The next episode in env 0 starts with initial observation -30, terminal observations are 25 and 45
+        dones = [[False, False], [True, False], [False, False], [True, False]]
+        for t in range(4):
+            s = np.full([2, 4], 10*(t + 1))
+            s_next = np.full([2, 4], 10*(t + 2))
+            if t == 2:
+                s[0] = -30
+            if dones[t][0]:
+                s_next[0] = 10*(t + 2) - 5
+            buffer.add(t, s=s, a=[t, t], r=[t + 1, -(t + 1)], s_next=s_next, done=dones[t])
+            buffer.add_info(t, name='V_s', value=torch.tensor([100.*(t + 1), 0.]))
+        buffer.add_final_info(name='V_s_next', value=torch.tensor([500., 0.]))
+        
+        D = buffer.segments(gamma=0.1)
+        assert len(D) == 2
+        assert all([isinstance(segment, Segment) for segment in D])
+        assert all([isinstance(segment, RolloutSegment) for segment in D])
+        
+        segment = D[0]
+        assert segment.T == 4
+        assert np.allclose(segment.all_r, [1, 2, 3, 4])
+        assert np.allclose(segment.all_a, [0, 1, 2, 3])
+        assert segment.all_done == [False, True, False, True]
+        assert np.allclose([s[0] for s in segment.all_s], [10, 20, 25, -30, 40, 45])
+        assert np.allclose([s[0] for s in segment.all_s_split[1]], [-30, 40, 45])
+        assert np.allclose(segment.all_info('V_s'), [100, 200, 300, 400])
+        assert segment.T_split == [2, 2]
+        assert np.allclose(segment.all_returns, [3, 2, 7, 4])
+        assert np.allclose(segment.all_bootstrapped_returns, [3, 2, 7, 4])
+        assert np.allclose(D[1].all_r, [-1, -2, -3, -4])
+        assert np.allclose([s[0] for s in D[1].all_s], [10, 20, 30, 40, 50])
+        assert np.allclose(D[1].all_bootstrapped_returns, [-10, -9, -7, -4])
+        
+        # Each observation stored once, terminal observations only at done boundaries
+        assert sorted(buffer.terminal_obs.keys()) == [(1, 0), (3, 0)]
+        assert np.allclose(buffer.s[:, 0, 0], [10, 20, -30, 40])
+        assert np.allclose(buffer.s_next[:, 0, 0], [20, 25, 40, 45])
+        assert np.allclose(buffer.s_next[:, 1, 0], [20, 30, 40, 50])
+        assert np.allclose([transition.s_next[0] for transition in segment.transitions], [20, 25, 40, 45])
+        
+        # Lazy Transition objects
+        transition = segment.transitions[-1]
+        assert isinstance(transition, Transition)
+        assert transition.r == 4.0 and transition.done
+        assert transition.V_s == 400 and transition.V_s_next == 500
+        assert len(segment.transitions[1:3]) == 2
+        
+        with pytest.raises(TypeError):
+            segment.add_transition(transition)
+        
+    def test_segmentrunner(self):
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=3, init_seed=0)
+        env = SerialVecEnv(list_make_env=list_make_env)
+        
+        agent = Agent1(config=None)
+        runner = SegmentRunner(agent=agent, env=env, gamma=0.99)
+        
+        D = runner(T=20)
+        assert len(D) == 3
+        assert all([isinstance(segment, Segment) for segment in D])
+        assert all([segment.T == 20 for segment in D])
+        assert all([segment.gamma == 0.99 for segment in D])
+        assert all([len(segment.all_info('action_logprob')) == 20 for segment in D])
+        assert all([len(segment.all_s) == 21 + sum(segment.all_done[:-1]) for segment in D])
+        
+        # Continue from previous call
+        D = runner(T=5)
+        assert all([segment.T == 5 for segment in D])
+        
+    def test_segmentrunner_return_array(self):
+        class Agent3(Agent1):
+            def choose_action(self, obs):
+                # Deterministic policy
+                obs = torch.from_numpy(np.asarray(obs)).float()
+                output = {}
+                output['action'] = (obs[:, 2] > 0).long()
+                output['state_value'] = obs[:, :1]
+                return output
+            
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=3, init_seed=0)
+        runner = SegmentRunner(agent=Agent3(config=None), env=SerialVecEnv(list_make_env), gamma=0.99)
+        array_runner = SegmentRunner(agent=Agent3(config=None), env=SerialVecEnv(list_make_env, return_array=True), gamma=0.99)
+        for T in [50, 30]:
+            D = runner(T=T)
+            D_array = array_runner(T=T)
+            assert isinstance(array_runner.obs_buffer, np.ndarray)
+            for segment, segment_array in zip(D, D_array):
+                assert np.allclose(segment.all_r, segment_array.all_r)
+                assert segment.all_done == segment_array.all_done
+                assert np.allclose(segment.all_a, segment_array.all_a)
+                assert np.allclose(segment.all_s, segment_array.all_s)
+                assert np.allclose(segment.transitions[-1].V_s_next, segment_array.transitions[-1].V_s_next)
+            
+    def test_no_grad(self):
+        config = {'agent:standardize': True, 
+                  'agent:max_grad_norm': 0.5, 
+                  'agent:value_coef': 0.5, 
+                  'agent:entropy_coef': 0.01}
+        
+        def make_agent(agent_class, env_spec, policy_class, in_features, out_features):
+            network = Network(config={'in': in_features, 'out': out_features})
+            policy = policy_class(network=network, env_spec=env_spec)
+            optimizer = torch.optim.SGD(network.parameters(), lr=0.0)  # keep parameters unchanged
+            return agent_class(policy=policy, optimizer=optimizer, config=config, device=torch.device('cpu'))
+        
+        def check_losses(out1, out2):
+            for key in ['batch_policy_loss', 'batch_entropy_loss', 'batch_total_loss']:
+                assert np.allclose([x.item() for x in out1[key]], [x.item() for x in out2[key]], atol=1e-5)
+                
+        # SegmentRunner with A2CAgent, discrete action space
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=3, init_seed=0)
+        env = SerialVecEnv(list_make_env=list_make_env)
+        env_spec = EnvSpec(env)
+        agent = make_agent(A2CAgent, env_spec, CategoricalPolicy, 4, 2)
+        
+        runner = SegmentRunner(agent=agent, env=env, gamma=0.99, no_grad=True)
+        D = runner(T=20, reset=True)
+        assert all([segment.info['no_grad'] for segment in D])
+        assert 'action_logprob' not in D[0].transitions[0].info
+        assert 'V_s' not in D[0].transitions[0].info
+        assert not D[0].transitions[-1].V_s_next.requires_grad
+        out = agent.learn(D)
+        assert out['loss'].requires_grad
+        
+        # Same losses as collection with computation graph
+        runner = SegmentRunner(agent=agent, env=env, gamma=0.99, no_grad=False)
+        D = runner(T=20, reset=True)
+        assert not any([segment.info['no_grad'] for segment in D])
+        assert D[0].transitions[0].info['action_logprob'].requires_grad
+        logprobs, entropies, Vs = agent._evaluate(D)
+        assert logprobs.shape == (20, 3) and entropies.shape == (20, 3) and Vs.shape == (20, 3)
+        assert np.allclose(logprobs.detach().numpy(), 
+                           torch.stack([torch.stack(segment.all_info('action_logprob')) for segment in D], dim=1).detach().numpy(), 
+                           atol=1e-6)
+        # Columns of a subset of segments, and of segments from different buffers
+        logprobs_sub, _, Vs_sub = agent._evaluate([D[2], D[0]])
+        assert np.allclose(logprobs_sub.detach().numpy(), logprobs[:, [2, 0]].detach().numpy(), atol=1e-6)
+        assert np.allclose(Vs_sub.detach().numpy(), Vs[:, [2, 0]].detach().numpy(), atol=1e-6)
+        D2 = runner(T=20)
+        logprobs2, _, Vs2 = agent._evaluate(D2)
+        logprobs_mix, _, Vs_mix = agent._evaluate([D[1], D2[0]])
+        assert np.allclose(logprobs_mix.detach().numpy(), 
+                           torch.stack([logprobs[:, 1], logprobs2[:, 0]], dim=1).detach().numpy(), 
+                           atol=1e-6)
+        assert np.allclose(Vs_mix.detach().numpy(), torch.stack([Vs[:, 1], Vs2[:, 0]], dim=1).detach().numpy(), atol=1e-6)
+        out1 = agent.learn(D)
+        buffer = D[0].buffer
+        for key in ['V_s', 'action_logprob', 'entropy', 'perplexity']:
+            buffer.info.pop(key)
+        for segment in D:
+            segment.add_info('no_grad', True)
+        check_losses(out1, agent.learn(D))
+        
+        # TrajectoryRunner with ActorCriticAgent and REINFORCEAgent, continuous action space
+        env = make_gym_env(env_id='Pendulum-v0', seed=0)
+        env_spec = EnvSpec(env)
+        for agent_class in [ActorCriticAgent, REINFORCEAgent]:
+            agent = make_agent(agent_class, env_spec, GaussianPolicy, 3, 1)
+            
+            runner = TrajectoryRunner(agent=agent, env=env, gamma=0.99, no_grad=True)
+            D = runner(N=2, T=15)
+            assert all([trajectory.info['no_grad'] for trajectory in D])
+            assert 'action_logprob' not in D[0].transitions[0].info
+            assert not D[0].transitions[0].info['unconstrained_action'].requires_grad
+            agent.learn(D)
+            
+            runner = TrajectoryRunner(agent=agent, env=env, gamma=0.99, no_grad=False)
+            D = runner(N=2, T=15)
+            out1 = agent.learn(D)
+            for trajectory in D:
+                for transition in trajectory.transitions:
+                    for key in ['V_s', 'action_logprob', 'entropy', 'perplexity']:
+                        transition.info.pop(key)
+                trajectory.add_info('no_grad', True)
+            check_losses(out1, agent.learn(D))
+            
+    def test_replaybuffer(self, tmpdir):
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=3, init_seed=0)
+        env = SerialVecEnv(list_make_env=list_make_env)
+        env_spec = EnvSpec(env)
+        
+        for memmap_dir in [None, str(tmpdir)]:
+            replay = ReplayBuffer(env_spec=env_spec, capacity=10, memmap_dir=memmap_dir)
+            assert len(replay) == 0
+            assert replay.s.shape == (10, 4) and replay.s.dtype == np.float32
+            assert replay.a.shape == (10,)
+            if memmap_dir is not None:
+                assert isinstance(replay.s, np.memmap)
+            
+            # Add VecEnv step results
+            obs = env.reset()
+            obs_next, reward, done, info = env.step([0, 1, 0])
+            index = replay.add(s=obs, a=[0, 1, 0], r=reward, s_next=obs_next, done=done)
+            assert np.allclose(index, [0, 1, 2])
+            assert len(replay) == 3 and replay.pointer == 3
+            assert np.allclose(replay.s[:3], obs)
+            assert np.allclose(replay.s_next[:3], obs_next)
+            assert np.allclose(replay.a[:3], [0, 1, 0])
+            
+            # Add segments from SegmentRunner, wrap around
+            runner = SegmentRunner(agent=Agent1(config=None), env=env, gamma=0.99)
+            D = runner(T=3)
+            index = replay.add_segments(D)
+            assert np.allclose(index, [3, 4, 5, 6, 7, 8, 9, 0, 1])
+            assert len(replay) == 10 and replay.pointer == 2
+            assert np.allclose(replay.s[3:6], [D[0].transitions[0].s, D[1].transitions[0].s, D[2].transitions[0].s])
+            assert np.allclose(replay.r[[9, 0, 1]], [D[0].all_r[-1], D[1].all_r[-1], D[2].all_r[-1]])
+            
+            # Add segments created manually
+            segment = Segment(gamma=0.99)
+            segment.add_transition(Transition(s=obs[0], a=1, r=0.5, s_next=obs_next[0], done=True))
+            index = replay.add_segments([segment])
+            assert np.allclose(index, [2])
+            assert replay.r[2] == 0.5 and replay.done[2]
+            
+            # Uniform sampling
+            batch = replay.sample(batch_size=32)
+            assert batch['s'].shape == (32, 4) and batch['s'].dtype == torch.float32
+            assert batch['s_next'].shape == (32, 4)
+            assert batch['a'].shape == (32,) and batch['a'].dtype == torch.int64
+            assert batch['r'].shape == (32,) and batch['done'].shape == (32,)
+            assert batch['done'].dtype == torch.float32
+            assert np.allclose(batch['r'].numpy(), replay.r[batch['index']])
+            
+        # Continuous action space
+        list_make_env = make_envs(make_env=make_gym_env, env_id='Pendulum-v0', num_env=2, init_seed=0)
+        env = SerialVecEnv(list_make_env=list_make_env)
+        env_spec = EnvSpec(env)
+        replay = ReplayBuffer(env_spec=env_spec, capacity=100)
+        runner = SegmentRunner(agent=Agent2(config=None), env=env, gamma=0.99)
+        replay.add_segments(runner(T=5))
+        assert len(replay) == 10
+        batch = replay.sample(batch_size=4)
+        assert batch['s'].shape == (4, 3) and batch['a'].shape == (4, 1) and batch['a'].dtype == torch.float32
+        
+    def test_segmenttree(self):
+        sum_tree = SumTree(capacity=5)
+        min_tree = MinTree(capacity=5)
+        assert sum_tree.num_leaf == 8
+        assert sum_tree.sum() == 0.0
+        assert min_tree.min() == float('inf')
+        
+        sum_tree[[0, 1, 2, 3, 4]] = [1.0, 2.0, 3.0, 4.0, 5.0]
+        min_tree[[0, 1, 2, 3, 4]] = [1.0, 2.0, 3.0, 4.0, 5.0]
+        assert sum_tree.sum() == 15.0
+        assert min_tree.min() == 1.0
+        assert np.allclose(sum_tree[[1, 3]], [2.0, 4.0])
+        
+        sum_tree[0] = 10.0
+        min_tree[[0, 4]] = [10.0, 0.5]
+        assert sum_tree.sum() == 24.0
+        assert min_tree.min() == 0.5
+        
+        # prefix sums: [10, 12, 15, 19, 24]
+        index = sum_tree.find_prefixsum_index([0.0, 9.9, 10.0, 11.5, 14.0, 18.0, 23.9])
+        assert np.allclose(index, [0, 0, 1, 1, 2, 3, 4])
+        
+        with pytest.raises(AssertionError):
+            sum_tree[5] = 1.0
+            
+    def test_prioritizedreplaybuffer(self):
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=2, init_seed=0)
+        env = SerialVecEnv(list_make_env=list_make_env)
+        env_spec = EnvSpec(env)
+        
+        replay = PrioritizedReplayBuffer(env_spec=env_spec, capacity=16, alpha=1.0, eps=0.0)
+        runner = SegmentRunner(agent=Agent1(config=None), env=env, gamma=0.99)
+        index = replay.add_segments(runner(T=4))
+        assert len(replay) == 8
+        assert np.allclose(replay.sum_tree[index], 1.0)
+        
+        # Uniform priorities
+        batch = replay.sample(batch_size=8, beta=1.0)
+        assert np.allclose(batch['weight'].numpy(), 1.0)
+        assert np.allclose(np.sort(batch['index']), np.arange(8))  # stratified sampling
+        
+        # Update priorities with TD errors
+        segment = Segment(gamma=0.99)
+        for t in range(8):
+            segment.add_transition(Transition(s=0, a=0, r=float(t == 7), s_next=1, done=False))
+            segment.transitions[-1].add_info('V_s', 0.0)
+        segment.transitions[-1].add_info('V_s_next', 0.0)
+        td_errors = segment.all_TD
+        assert np.allclose(td_errors, [0]*7 + [1.0])
+        replay.update_priorities(np.arange(8), np.array(td_errors) + 0.01)
+        assert replay.max_priority == 1.01
+        assert np.isclose(replay.sum_tree.sum(), 1.08)
+        
+        batch = replay.sample(batch_size=100, beta=1.0)
+        assert (batch['index'] == 7).sum() > 80
+        weights = batch['weight'].numpy()
+        assert np.allclose(weights[batch['index'] == 7], 0.01/1.01)
+        assert np.allclose(weights[batch['index'] != 7], 1.0)
+        
+        # Tensor TD errors, new transitions with max priority
+        replay.update_priorities([0, 1], torch.tensor([-2.0, 0.5]))
+        assert np.allclose(replay.sum_tree[[0, 1]], [2.0, 0.5])
+        index = replay.add(s=np.zeros([1, 4]), a=[0], r=[1.0], s_next=np.zeros([1, 4]), done=[True])
+        assert np.allclose(replay.sum_tree[index], 2.0)
+        assert replay.min_tree.min() == 0.01
+        
+    def test_vectrajectoryrunner(self):
+        class Agent3(Agent1):
+            def choose_action(self, obs):
+                output = super().choose_action(obs)
+                output['state_value'] = torch.ones(len(obs), 1)
+                return output
+            
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=3, init_seed=0)
+        env = SerialVecEnv(list_make_env=list_make_env)
+        
+        with pytest.raises(AssertionError):
+            VecTrajectoryRunner(agent=Agent3(config=None), env=make_gym_env('CartPole-v1', 0), gamma=0.99)
+        
+        runner = VecTrajectoryRunner(agent=Agent3(config=None), env=env, gamma=0.99)
+        
+        # Multiple rounds, 3 + 3 + 1 trajectories
+        D = runner(N=7, T=15)
+        assert len(D) == 7
+        assert all([isinstance(trajectory, Trajectory) for trajectory in D])
+        assert all([trajectory.gamma == 0.99 for trajectory in D])
+        for trajectory in D:
+            assert trajectory.T <= 15
+            assert trajectory.T == 15 or trajectory.all_done[-1]
+            assert not any(trajectory.all_done[:-1])
+            assert len(trajectory.all_s) == trajectory.T + 1
+            # batch dimension kept, same as TrajectoryRunner
+            assert trajectory.transitions[0].a.shape == (1,)
+            assert trajectory.transitions[0].V_s.shape == (1, 1)
+            assert trajectory.transitions[0].info['action_logprob'].requires_grad
+            assert np.allclose([V.item() for V in trajectory.all_V], 1.0)
+            
+        # Each trajectory starts from initial observation
+        D = runner(N=3, T=500)
+        assert all([trajectory.all_done[-1] for trajectory in D])
+        
+        # Without computation graph
+        runner = VecTrajectoryRunner(agent=Agent3(config=None), env=env, gamma=0.99, no_grad=True)
+        D = runner(N=2, T=10)
+        assert len(D) == 2
+        assert 'action_logprob' not in D[0].transitions[0].info
+        assert not D[0].transitions[-1].V_s_next.requires_grad
+        
+        # Only the environments with unfinished trajectories are stepped
+        class RecordVecEnv(SerialVecEnv):
+            def step_async(self, actions, indices=None):
+                self.all_indices.append(indices)
+                super().step_async(actions, indices=indices)
+                
+        for N in [2, 3]:
+            env = RecordVecEnv(list_make_env=list_make_env)
+            env.all_indices = []
+            runner = VecTrajectoryRunner(agent=Agent3(config=None), env=env, gamma=0.99)
+            D = runner(N=N, T=500)
+            assert all([trajectory.all_done[-1] for trajectory in D])
+            assert all([set(indices) <= set(range(N)) for indices in env.all_indices])
+            for i, trajectory in enumerate(D):
+                assert trajectory.T == sum([i in indices for indices in env.all_indices])
+            env.close()
+        
+        # Reset ahead, the environments are masked out after done=True
+        env = SerialVecEnv(list_make_env=list_make_env, reset_ahead=True)
+        runner = VecTrajectoryRunner(agent=Agent3(config=None), env=env, gamma=0.99)
+        D = runner(N=6, T=500)
+        assert len(D) == 6
+        assert all([trajectory.all_done[-1] and not any(trajectory.all_done[:-1]) for trajectory in D])
+        env.close()
+        
+    def test_segmentrunner_reset_ahead(self):
+        class Agent3(Agent1):
+            def choose_action(self, obs):
+                # Deterministic policy, short episodes
+                obs = torch.from_numpy(np.array(obs)).float()
+                output = {}
+                output['action'] = (obs[:, 1] < -0.5).long()
+                output['state_value'] = obs[:, :1]
+                output['extra'] = obs
+                return output
+            
+        def check_segments(D, D_reset_ahead, T):
+            for segment, segment_reset_ahead in zip(D, D_reset_ahead):
+                assert segment_reset_ahead.T == T
+                assert np.allclose(segment.all_r, segment_reset_ahead.all_r)
+                assert segment.all_done == segment_reset_ahead.all_done
+                assert np.allclose(segment.all_a, segment_reset_ahead.all_a)
+                assert np.allclose(segment.all_s, segment_reset_ahead.all_s)
+                assert torch.equal(torch.stack(segment.all_info('V_s')), torch.stack(segment_reset_ahead.all_info('V_s')))
+                assert torch.equal(torch.stack(segment.all_info('extra')), torch.stack(segment_reset_ahead.all_info('extra')))
+                # Terminal observation is used for the final done=True, masked out anyway
+                if not segment.all_done[-1]:
+                    assert np.allclose(segment.transitions[-1].V_s_next, segment_reset_ahead.transitions[-1].V_s_next)
+                    
+        def check_concat(D, D_first, D_second):
+            # No transition is missing or repeated between two calls
+            for segment, first, second in zip(D, D_first, D_second):
+                assert first.T + second.T == segment.T
+                transitions = list(first.transitions) + list(second.transitions)
+                assert np.allclose([x.s for x in transitions], [x.s for x in segment.transitions])
+                assert np.allclose([x.s_next for x in transitions], [x.s_next for x in segment.transitions])
+                assert np.allclose(np.concatenate([first.all_a, second.all_a]), segment.all_a)
+                assert np.allclose(first.all_r + second.all_r, segment.all_r)
+                assert first.all_done + second.all_done == segment.all_done
+                assert torch.equal(torch.stack(first.all_info('V_s') + second.all_info('V_s')), 
+                                   torch.stack(segment.all_info('V_s')))
+            
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=3, init_seed=0)
+        
+        # Same transitions as without reset ahead, each environment skips the steps delivering initial observations
+        for make_env in [lambda: SerialVecEnv(list_make_env, reset_ahead=True), 
+                         lambda: SerialVecEnv(list_make_env, return_array=True, reset_ahead=True), 
+                         lambda: ParallelVecEnv(list_make_env, num_env_per_worker=2, reset_ahead=True), 
+                         lambda: ParallelVecEnv(list_make_env, num_env_per_worker=2, shared_memory=True, reset_ahead=True)]:
+            runner = SegmentRunner(agent=Agent3(config=None), env=SerialVecEnv(list_make_env), gamma=0.99)
+            env = make_env()
+            reset_ahead_runner = SegmentRunner(agent=Agent3(config=None), env=env, gamma=0.99)
+            D = runner(T=50, reset=True)
+            D_reset_ahead = reset_ahead_runner(T=50, reset=True)
+            assert all([sum(segment.all_done) >= 2 for segment in D])
+            check_segments(D, D_reset_ahead, 50)
+            
+            # Continue with next calls, the environments with all transitions are not stepped further
+            # Different number of steps delivering initial observations, i.e. done=True before the final 
+            # transition, so some environments collect all transitions before the others
+            D = runner(T=50)
+            D_first = reset_ahead_runner(T=10)
+            assert len(set([sum(segment.all_done[:-1]) for segment in D_first])) > 1
+            D_second = reset_ahead_runner(T=40)
+            assert all([segment.T == 40 for segment in D_second])
+            check_concat(D, D_first, D_second)
+            env.close()
+            
+        # PipelinedSegmentRunner with both groups
+        runner = SegmentRunner(agent=Agent3(config=None), env=SerialVecEnv(list_make_env), gamma=0.99)
+        env = [SerialVecEnv(list_make_env[:1], reset_ahead=True), ParallelVecEnv(list_make_env[1:], reset_ahead=True)]
+        pipelined_runner = PipelinedSegmentRunner(agent=Agent3(config=None), env=env, gamma=0.99)
+        D = runner(T=50, reset=True)
+        D_pipelined = pipelined_runner(T=50, reset=True)
+        check_segments(D, D_pipelined, 50)
+        D = runner(T=50)
+        D_first = pipelined_runner(T=10)
+        D_second = pipelined_runner(T=40)
+        check_concat(D, D_first, D_second)
+        [e.close() for e in env]
+        
+        with pytest.raises(AssertionError):
+            PipelinedSegmentRunner(agent=Agent3(config=None), 
+                                   env=[SerialVecEnv(list_make_env[:1], reset_ahead=True), SerialVecEnv(list_make_env[1:])], 
+                                   gamma=0.99)
+            
+    def test_pipelinedsegmentrunner(self):
+        class Agent3(Agent1):
+            def choose_action(self, obs):
+                # Deterministic policy
+                obs = torch.from_numpy(np.array(obs)).float()
+                output = {}
+                output['action'] = (obs[:, 2] > 0).long()
+                output['state_value'] = obs[:, :1]
+                output['extra'] = obs
+                return output
+            
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=4, init_seed=0)
+        
+        with pytest.raises(AssertionError):
+            PipelinedSegmentRunner(agent=Agent3(config=None), env=[SerialVecEnv(list_make_env)], gamma=0.99)
+        
+        # Same data as SegmentRunner
+        runner = SegmentRunner(agent=Agent3(config=None), env=SerialVecEnv(list_make_env), gamma=0.99)
+        env = [SerialVecEnv(list_make_env[:2]), ParallelVecEnv(list_make_env[2:])]
+        pipelined_runner = PipelinedSegmentRunner(agent=Agent3(config=None), env=env, gamma=0.99)
+        for T in [30, 1, 20]:  # continue with previous call
+            D = runner(T=T)
+            D_pipelined = pipelined_runner(T=T)
+            assert len(D_pipelined) == 4
+            assert all([isinstance(segment, RolloutSegment) for segment in D_pipelined])
+            for segment, segment_pipelined in zip(D, D_pipelined):
+                assert segment_pipelined.T == T
+                assert np.allclose(segment.all_r, segment_pipelined.all_r)
+                assert segment.all_done == segment_pipelined.all_done
+                assert np.allclose(segment.all_a, segment_pipelined.all_a)
+                assert np.allclose(segment.all_s, segment_pipelined.all_s)
+                assert torch.equal(torch.stack(segment.all_info('V_s')), torch.stack(segment_pipelined.all_info('V_s')))
+                assert torch.equal(torch.stack(segment.all_info('extra')), torch.stack(segment_pipelined.all_info('extra')))
+                assert np.allclose(segment.transitions[-1].V_s_next, segment_pipelined.transitions[-1].V_s_next)
+                
+            assert sorted(pipelined_runner.timing.keys()) == ['hidden', 'inference', 'total', 'wait']
+            assert all([val >= 0.0 for val in pipelined_runner.timing.values()])
+        
+        env[1].close()
+        
+        # Shared memory in both groups
+        runner = SegmentRunner(agent=Agent3(config=None), env=SerialVecEnv(list_make_env), gamma=0.99)
+        env = [ParallelVecEnv(list_make_env[:2], shared_memory=True), ParallelVecEnv(list_make_env[2:], shared_memory=True)]
+        pipelined_runner = PipelinedSegmentRunner(agent=Agent3(config=None), env=env, gamma=0.99)
+        for T in [30, 1, 20]:
+            D = runner(T=T)
+            D_pipelined = pipelined_runner(T=T)
+            for segment, segment_pipelined in zip(D, D_pipelined):
+                assert np.allclose(segment.all_r, segment_pipelined.all_r)
+                assert segment.all_done == segment_pipelined.all_done
+                assert np.allclose(segment.all_s, segment_pipelined.all_s)
+                assert np.allclose(segment.transitions[-1].V_s_next, segment_pipelined.transitions[-1].V_s_next)
+        
+        [e.close() for e in env]
+        
+    def test_asyncsegmentrunner(self):
+        class Agent3(Agent1):
+            def choose_action(self, obs):
+                # Deterministic policy
+                obs = torch.from_numpy(np.array(obs)).float()
+                output = {}
+                output['action'] = (obs[:, 2] > 0).long()
+                output['state_value'] = obs[:, :1]
+                output['extra'] = obs
+                return output
+            
+        list_make_env = make_envs(make_env=make_gym_env, env_id='CartPole-v1', num_env=4, init_seed=0)
+        
+        with pytest.raises(AssertionError):
+            AsyncSegmentRunner(agent=Agent3(config=None), env=SerialVecEnv(list_make_env), gamma=0.99)
+        
+        # Same data as SegmentRunner
+        runner = SegmentRunner(agent=Agent3(config=None), env=SerialVecEnv(list_make_env), gamma=0.99)
+        env = AsyncVecEnv(list_make_env)
+        async_runner = AsyncSegmentRunner(agent=Agent3(config=None), env=env, gamma=0.99, k=1)
+        for T in [30, 1, 20]:  # continue with previous call
+            D = runner(T=T)
+            D_async = async_runner(T=T)
+            assert len(D_async) == 4
+            assert all([isinstance(segment, RolloutSegment) for segment in D_async])
+            assert len(env.pending) == 0
+            for segment, segment_async in zip(D, D_async):
+                assert segment_async.T == T
+                assert np.allclose(segment.all_r, segment_async.all_r)
+                assert segment.all_done == segment_async.all_done
+                assert np.allclose(segment.all_a, segment_async.all_a)
+                assert np.allclose(segment.all_s, segment_async.all_s)
+                assert torch.equal(torch.stack(segment.all_info('V_s')), torch.stack(segment_async.all_info('V_s')))
+                assert torch.equal(torch.stack(segment.all_info('extra')), torch.stack(segment_async.all_info('extra')))
+                assert np.allclose(segment.transitions[-1].V_s_next, segment_async.transitions[-1].V_s_next)
+                
+        # Without computation graph
+        async_runner = AsyncSegmentRunner(agent=Agent3(config=None), env=env, gamma=0.99, k=2, no_grad=True)
+        D = async_runner(T=10, reset=True)
+        assert all([segment.T == 10 for segment in D])
+        assert 'extra' not in D[0].transitions[0].info and 'V_s' not in D[0].transitions[0].info
+        assert 'V_s_next' in D[0].transitions[-1].info
+        
+        env.close()
@@ -2,11 +2,14 @@ import numpy as np
 
 import pytest
 
+import torch
+
 from lagom.core.transform import Clip
 from lagom.core.transform import Centralize
 from lagom.core.transform import Normalize 
 from lagom.core.transform import Standardize
 from lagom.core.transform import ExpFactorCumSum
+from lagom.core.transform import GAE
 from lagom.core.transform import RunningMeanStd
 from lagom.core.transform import RankTransform
 from lagom.core.transform import PolySmooth
@@ -244,6 +247,39 @@ class TestTransform(object):
         f = np.array([1, 2, 3, 4, 5, 6])
         _test_vec_mask(f, mask)
         
+        # ndarray mask
+        _test_vec_mask(f, np.array(mask))
+        
+        #
+        # Test batched data [T, N]
+        #
+        x = np.array([[1, 4], [2, 5], [3, 6]])
+        mask_x = np.array([[1, 1], [0, 1], [1, 1]])
+        out = expfactorcumsum(x=x, mask=mask_x)
+        assert isinstance(out, np.ndarray) and out.dtype == np.float32 and out.shape == (3, 2)
+        assert np.allclose(out, [[1.2, 4.56], [2, 5.6], [3, 6]])
+        assert np.allclose(expfactorcumsum(x=x), [[1.23, 4.56], [2.3, 5.6], [3, 6]])
+        
+        #
+        # Test Tensor
+        #
+        x = torch.tensor([1., 2., 3., 4., 5., 6.], requires_grad=True)
+        out = expfactorcumsum(x=x, mask=torch.tensor(mask))
+        assert torch.is_tensor(out)
+        assert np.allclose(out.detach().numpy(), [1.23, 2.3, 3.0, 4.56, 5.6, 6.0])
+        out.sum().backward()
+        assert np.allclose(x.grad.numpy(), [1, 1.1, 1.11, 1, 1.1, 1.11])
+        
+        # ndarray (filter) and Tensor (scan) agree on batched data with masks
+        x = np.random.randn(50, 4).astype(np.float32)
+        mask_x = (np.random.rand(50, 4) > 0.2).astype(np.float32)
+        mask_x[-1, 0] = 0.0
+        mask_x[:, 1] = 0.0
+        out = expfactorcumsum(x=x, mask=mask_x)
+        assert out.dtype == np.float32 and out.flags.c_contiguous
+        assert np.allclose(out, expfactorcumsum(x=torch.from_numpy(x), mask=torch.from_numpy(mask_x)).numpy(), atol=1e-5)
+        assert np.allclose(out[:, 1], x[:, 1])
+        
         #
         # Test exceptions
         #
@@ -251,17 +287,10 @@ class TestTransform(object):
         with pytest.raises(AssertionError):
             expfactorcumsum(x=1)
         
-        # ndarray more than 1-dim is not allowed
-        g = np.array([[1, 2, 3]])
+        # ndarray more than 2-dim is not allowed
+        g = np.array([[[1, 2, 3]]])
         with pytest.raises(ValueError):
             expfactorcumsum(g)
-            
-        # mask must be list dtype
-        h = [1, 2, 3]
-        dones_h = np.array([True, False, True])
-        mask_h = np.logical_not(dones_h).astype(int)
-        with pytest.raises(AssertionError):
-            expfactorcumsum(h, mask_h)
         
         # mask must have same length with input data
         i = [1, 2, 3]
@@ -281,7 +310,36 @@ class TestTransform(object):
         mask_k = [True, False, False]
         with pytest.raises(AssertionError):
             expfactorcumsum(k, mask_k)
+        with pytest.raises(AssertionError):
+            expfactorcumsum(torch.tensor(k), torch.tensor(mask_k))
 
+    def test_gae(self):
+        # Two segments with shape [T, N], the first one contains an intermediate done=True
+        rewards = np.array([[1, 0], [2, 0], [3, 1]])
+        values = np.array([[10, 0], [20, 0], [30, 0]])
+        dones = np.array([[False, False], [True, False], [False, False]])
+        last_values = np.array([40, 2])
+        
+        gae = GAE(gamma=0.5, gae_lambda=0.5)
+        advantages, returns = gae(rewards, values, dones, last_values)
+        assert isinstance(advantages, np.ndarray) and advantages.shape == (3, 2)
+        assert np.allclose(advantages, [[-3.5, 0.125], [-18, 0.5], [-7, 2]])
+        assert np.allclose(returns, [[6.5, 0.125], [2, 0.5], [23, 2]])
+        
+        # lambda=1.0: boostrapped discounted returns
+        gae = GAE(gamma=0.5, gae_lambda=1.0)
+        advantages, returns = gae(rewards, values, dones, last_values)
+        assert np.allclose(returns[:, 0], [2, 2, 23])
+        
+        # Single sequence
+        advantages, returns = gae(rewards[:, 0], values[:, 0], dones[:, 0], last_values[0])
+        assert advantages.shape == (3,) and np.allclose(returns, [2, 2, 23])
+        
+        # Tensor
+        advantages, returns = gae(rewards, torch.tensor(values).float(), dones, torch.tensor(last_values).float())
+        assert torch.is_tensor(advantages) and torch.is_tensor(returns)
+        assert np.allclose(returns[:, 0].numpy(), [2, 2, 23])
+        
     def test_runningmeanstd(self):
         def _test_moments(runningmeanstd, x):
             assert np.allclose(runningmeanstd.mu, np.mean(x))